@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+'''
+Compares evaluating device compliance one ClientCompliance object per device (the way
+PerDeviceStatus.collect_client_data used to) against ClientComplianceBatch, which takes whole columns.
+
+    PYTHONPATH=. python benchmarks/bench_compliance.py --devices 100000
+
+It's timed twice; once for the compliance checks alone and once including turning the last check in
+date string into a number of days, as that was part of the per row loop too.
+'''
+import argparse
+import datetime
+import random
+import time
+import numpy as np
+import pandas as pd
+
+from extra_metrics.compliance import ClientCompliance, ClientComplianceBatch
+
+CHECKIN_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+def make_columns(num_devices, seed=42):
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    columns = {"last_check_in": [], "total_disk": [], "free_disk": [], "critical": [], "normal": []}
+    for _ in range(num_devices):
+        if rng.random() < 0.02:
+            columns["last_check_in"].append(None)
+        else:
+            checkin = now - datetime.timedelta(seconds=rng.randint(0, 60 * 86400))
+            columns["last_check_in"].append(checkin.strftime(CHECKIN_FORMAT))
+        total = rng.choice([None, 256000000000, 500107862016, 1000204886016])
+        columns["total_disk"].append(total)
+        columns["free_disk"].append(None if total is None else int(total * rng.random()))
+        columns["critical"].append(rng.choice([0, 0, 0, 1, 2]))
+        columns["normal"].append(rng.choice([0, 0, 1, 5]))
+    return columns
+
+
+def per_device_checkin_days(columns, now):
+    days = []
+    for last_check_in in columns["last_check_in"]:
+        checkin_days = 999
+        if last_check_in is not None:
+            checkin_days = (now - datetime.datetime.strptime(last_check_in, CHECKIN_FORMAT)).days
+        days.append(checkin_days)
+    return days
+
+
+def per_device(columns, checkin_days):
+    counts = [0, 0, 0, 0]
+    rows = zip(columns["last_check_in"], columns["total_disk"], columns["free_disk"], checkin_days,
+               columns["critical"], columns["normal"])
+    for row in rows:
+        counts[ClientCompliance(*row).get_compliance_state()] += 1
+    return counts
+
+
+def batch_checkin_days(columns, now):
+    checkin_dates = pd.to_datetime(pd.Series(columns["last_check_in"], dtype=object), format=CHECKIN_FORMAT)
+    return (now - checkin_dates).dt.days.fillna(999).to_numpy(dtype=np.int64)
+
+
+def batch(columns, checkin_days):
+    states = ClientComplianceBatch(columns["last_check_in"], columns["total_disk"], columns["free_disk"],
+                                   checkin_days, columns["critical"], columns["normal"]).get_compliance_state()
+    return [int(n) for n in np.bincount(states, minlength=4)]
+
+
+def best_of(repeat, func, *args):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    columns = make_columns(args.devices)
+    now = datetime.datetime.now()
+
+    scalar_days_time, scalar_days = best_of(args.repeat, per_device_checkin_days, columns, now)
+    batch_days_time, batch_days = best_of(args.repeat, batch_checkin_days, columns, now)
+    assert scalar_days == list(batch_days), "the check in days differ"
+
+    scalar_time, scalar_counts = best_of(args.repeat, per_device, columns, scalar_days)
+    batch_time, batch_counts = best_of(args.repeat, batch, columns, batch_days)
+    assert scalar_counts == batch_counts, f"the results differ: {scalar_counts} vs {batch_counts}"
+
+    print(f"devices: {args.devices}, states (ok/unknown/warning/error): {batch_counts}")
+    print("                   compliance only      with check in days")
+    print(f"per device: {scalar_time * 1000:16.1f} ms {(scalar_time + scalar_days_time) * 1000:16.1f} ms")
+    print(f"batch:      {batch_time * 1000:16.1f} ms {(batch_time + batch_days_time) * 1000:16.1f} ms")
+    print(f"speed up:   {scalar_time / batch_time:16.1f} x  "
+          f"{(scalar_time + scalar_days_time) / (batch_time + batch_days_time):16.1f} x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+'''
+Compares peak memory and time of decoding an inventory query_result payload (the client info query)
+the original way - read the whole body, json.loads it and build a DataFrame from the list-of-lists -
+against the streaming QueryResultDecoder.
+
+    PYTHONPATH=. python benchmarks/bench_query_result_decode.py --rows 50000
+
+Peak memory is measured with tracemalloc, so it's the peak of Python (and numpy) allocations made
+while decoding, rather than the RSS of the whole process.
+'''
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+import pandas as pd
+
+from extra_metrics.queries import query_client_info
+from extra_metrics.querystream import QueryResultDecoder
+
+CHUNK_BYTES = 64 * 1024
+
+
+def make_payload(num_rows):
+    fields = [f"{f['component']}_{f['column']}" for f in json.loads(query_client_info)["fields"]]
+    values = []
+    for i in range(num_rows):
+        row = []
+        for j, name in enumerate(fields):
+            if name.endswith("disk_space"):
+                row.append(500107862016 - i)
+            elif name == "Client_filewave_id":
+                row.append(i)
+            elif name == "Client_last_check_in":
+                row.append("2020-06-01T10:11:12.123456Z")
+            elif j % 5 == 0:
+                row.append(None)
+            else:
+                row.append(f"{name}-{i % 97}")
+        values.append(row)
+    return json.dumps({"offset": 0, "fields": fields, "values": values,
+                       "filter_results": num_rows, "total_results": num_rows, "version": 1}).encode('utf-8')
+
+
+def chunks_of(body):
+    for i in range(0, len(body), CHUNK_BYTES):
+        yield body[i:i + CHUNK_BYTES]
+
+
+def decode_whole_body(body):
+    # what requests + r.json() + pd.DataFrame did; the whole body is read, then decoded, then copied
+    content = b"".join(chunks_of(body))
+    j = json.loads(content.decode('utf-8'))
+    return pd.DataFrame(j["values"], columns=j["fields"])
+
+
+def decode_streaming(body):
+    decoder = QueryResultDecoder()
+    for chunk in chunks_of(body):
+        decoder.feed(chunk)
+    return decoder.close().to_dataframe()
+
+
+def measure(func, body):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = func(body)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return df, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000, help='number of devices in the payload')
+    args = parser.parse_args()
+
+    body = make_payload(args.rows)
+    print(f"payload: {args.rows} rows, {len(body) / 1e6:.1f} MB")
+
+    results = {}
+    for name, func in [("whole body", decode_whole_body), ("streaming", decode_streaming)]:
+        df, elapsed, peak = measure(func, body)
+        results[name] = df
+        print(f"{name:>12}: {elapsed:7.3f} sec, peak {peak / 1e6:8.1f} MB")
+
+    assert results["whole body"].equals(results["streaming"]), "the two decoders disagree"
+
+
+if __name__ == "__main__":
+    main()
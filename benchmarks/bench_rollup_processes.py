@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+'''
+How the device rollups scale with the number of worker processes (fw_rollup_processes); 0 is the
+single process RollupEngine, 1..N split the rows by filewave_id and count each share in its own
+process, reading the codes from shared memory.
+
+    PYTHONPATH=. python benchmarks/bench_rollup_processes.py --devices 2000000 --processes 1 2 4 8
+
+The time includes factorizing the columns in the parent and adding up the partial counts; the
+process pool is started before the timing, as it is kept from one collection to the next.
+'''
+import argparse
+import os
+import random
+import time
+import numpy as np
+import pandas as pd
+
+from extra_metrics.devices import DEFAULT_ROLLUPS
+from extra_metrics.rollup import RollupDimension, RollupEngine
+
+
+def make_client_info(num_devices, seed=42):
+    rng = np.random.default_rng(seed)
+    pick = random.Random(seed)
+    versions = [f"14.{minor}.{patch}" for minor in range(4) for patch in range(5)]
+    os_versions = [f"{major}.{minor}" for major in range(10, 15) for minor in range(8)]
+    ids = np.arange(num_devices, dtype=np.float64)
+    ids[rng.random(num_devices) < 0.001] = np.nan
+    return pd.DataFrame({
+        "Client_filewave_id": ids,
+        "DesktopClient_filewave_client_version": [pick.choice(versions + [None]) for _ in range(num_devices)],
+        "OperatingSystem_name": rng.choice(["macOS", "Windows", "Chrome OS", "iOS"], num_devices),
+        "OperatingSystem_version": rng.choice(os_versions, num_devices),
+        "Client_is_tracking_enabled": rng.random(num_devices) < 0.5,
+        "Client_filewave_client_locked": rng.random(num_devices) < 0.1,
+    })
+
+
+def dimensions():
+    return [dimension for dimension, _ in DEFAULT_ROLLUPS] + [
+        RollupDimension("os_version", ["OperatingSystem_name", "OperatingSystem_version"]),
+        RollupDimension("os_client", ["OperatingSystem_name", "OperatingSystem_version", "DesktopClient_filewave_client_version"]),
+    ]
+
+
+def best_of(repeat, engine, df):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = engine.run(df)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=1000000)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_client_info(args.devices)
+    print(f"devices: {args.devices}, cpus: {os.cpu_count()}")
+
+    baseline, expected = best_of(args.repeat, RollupEngine(dimensions()), df)
+    print(f"processes:  0  {baseline * 1000:8.1f} ms")
+
+    for processes in sorted(set(args.processes)):
+        engine = RollupEngine(dimensions(), processes=processes, min_partitioned_rows=0)
+        try:
+            engine.run(df.head(1000))  # starts the workers
+            elapsed, result = best_of(args.repeat, engine, df)
+        finally:
+            engine.shutdown()
+        assert result == expected, f"the counts with {processes} processes differ"
+        print(f"processes: {processes:2}  {elapsed * 1000:8.1f} ms  speed up: {baseline / elapsed:5.2f} x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+'''
+How long it takes to save the metrics snapshots after a cycle and to restore them at startup, for a
+fleet of --devices devices (one series per device in each per device gauge, plus a few rollups), and
+how big the file is next to the text exposition of the same data.
+
+    PYTHONPATH=. python benchmarks/bench_snapshotstore.py --devices 100000
+'''
+import argparse
+import os
+import random
+import tempfile
+import time
+from prometheus_client import CollectorRegistry, generate_latest
+
+from extra_metrics.snapshot import SnapshotCollector
+from extra_metrics.snapshotstore import SnapshotStore
+
+
+def make_collector():
+    metrics = SnapshotCollector()
+    gauges = [
+        metrics.gauge('bench_per_device_modelnum', 'model number per device', ["device_name"]),
+        metrics.gauge('bench_per_device_checkin_days', 'days since the last check in per device', ["device_name"]),
+        metrics.gauge('bench_per_device_updates', 'updates per device and state', ["device_name", "state"]),
+        metrics.gauge('bench_devices_by_platform', 'devices per platform', ["platform", "version"]),
+    ]
+    return metrics, gauges
+
+
+def fill(metrics, gauges, num_devices, rng):
+    modelnum, checkin_days, updates, by_platform = gauges
+    snapshot = metrics.new_snapshot()
+    for n in range(num_devices):
+        name = f"device-{n}"
+        snapshot.set(modelnum, [name], rng.randint(1, 5000))
+        snapshot.set(checkin_days, [name], rng.randint(0, 60))
+        for state in ("Installed", "Pending"):
+            snapshot.set(updates, [name, state], rng.randint(0, 20))
+    for platform in ("macOS", "Windows", "iOS", "Chrome OS"):
+        for version in range(20):
+            snapshot.set(by_platform, [platform, f"{version}.0"], rng.randint(0, num_devices))
+    metrics.publish(snapshot)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=100000)
+    args = parser.parse_args()
+
+    metrics, gauges = make_collector()
+    fill(metrics, gauges, args.devices, random.Random(42))
+    print(f"devices: {args.devices}, series: {metrics.snapshot.num_series()}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "snapshot.bin")
+        start = time.perf_counter()
+        SnapshotStore(path, {"bench": metrics}).save()
+        save_time = time.perf_counter() - start
+
+        restarted, _ = make_collector()
+        start = time.perf_counter()
+        SnapshotStore(path, {"bench": restarted}).load()
+        load_time = time.perf_counter() - start
+
+        registry = CollectorRegistry()
+        registry.register(restarted)
+        start = time.perf_counter()
+        exposition = generate_latest(registry)
+        render_time = time.perf_counter() - start
+
+        print(f"save: {save_time * 1000:8.1f} ms, load: {load_time * 1000:8.1f} ms, first render: {render_time * 1000:8.1f} ms")
+        print(f"file: {os.path.getsize(path) / 1024:8.0f} KiB, text exposition: {len(exposition) / 1024:8.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+'''
+How long each console script in setup.py takes to start; a fresh interpreter imports the entry point
+(which is what the generated script does before anything else), best of --repeat runs.  Fails (exit
+code 1) when an entry point goes over its budget, e.g.
+
+    PYTHONPATH=. python benchmarks/bench_startup.py
+    PYTHONPATH=. python benchmarks/bench_startup.py --budget extra-metrics-config=100
+'''
+import argparse
+import subprocess
+import sys
+import time
+
+# the same reading of setup.py as the test that guards what the entry points import
+from extra_metrics.test.test_startup import console_scripts
+
+# milliseconds; the config CLI should start about as quickly as python does, the exporter has pandas
+# and friends to load
+DEFAULT_BUDGETS = {
+    "extra-metrics-config": 250,
+    "extra-metrics-run": 1500,
+    "extra-metrics-test": 1500,
+}
+
+
+def time_startup(module, function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"from {module} import {function}"], check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', action='append', default=[], help='script=milliseconds, overrides the default budget')
+    args = parser.parse_args()
+
+    budgets = dict(DEFAULT_BUDGETS)
+    for budget in args.budget:
+        name, ms = budget.split("=", 1)
+        budgets[name] = float(ms)
+
+    baseline = time_startup("sys", "path", args.repeat)
+    print(f"{'python':22} {baseline * 1000:8.1f} ms")
+
+    over_budget = []
+    for name, (module, function) in console_scripts().items():
+        elapsed = time_startup(module, function, args.repeat)
+        budget = budgets.get(name)
+        verdict = "" if budget is None else ("ok" if elapsed * 1000 <= budget else "OVER BUDGET")
+        print(f"{name:22} {elapsed * 1000:8.1f} ms (budget: {budget} ms) {verdict}")
+        if verdict == "OVER BUDGET":
+            over_budget.append(name)
+
+    if len(over_budget) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
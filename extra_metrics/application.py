@@ -1,36 +1,24 @@
 from prometheus_client import REGISTRY
-from prometheus_client.metrics_core import GaugeMetricFamily
 
+import asyncio
 import traceback
-import pkg_resources
-import pandas as pd
 import json
 import sys
 
-from extra_metrics.package import get_package_resource_json
+from extra_metrics import instrumentation
+from extra_metrics.package import get_package_resource_json, list_package_resources
+from extra_metrics.snapshot import SnapshotCollector
 from .fwrest import http_request_time_taken
 from .logs import logger
 
 
-class ApplicationResultCollector(object):
-    def __init__(self):
-        self.app_results = []
+application_metrics = SnapshotCollector()
 
-    def add_result(self, query_id, query_name, app_version, app_total):
-        self.app_results.append({
-            "id": str(query_id),
-            "query_name": query_name,
-            "app_version": app_version,
-            "total": app_total
-        })
+application_version = application_metrics.gauge('extra_metrics_application_version',
+    'a summary of how many devices are using a particular app & version',
+    ['query_name', 'application_version', 'query_id'])
 
-    def collect(self):
-        gauge = GaugeMetricFamily(name="extra_metrics_application_version",
-                                  documentation='a summary of how many devices are using a particular app & version',
-                                  labels=['query_name', 'application_version', 'query_id'])
-        for item in self.app_results:
-            gauge.add_metric([item['query_name'], item['app_version'], item["id"]], item["total"])
-        yield gauge
+REGISTRY.register(application_metrics)
 
 
 class ApplicationUsageRollup:
@@ -50,12 +38,14 @@ class ApplicationUsageRollup:
         self.op = op
         self.result_df = None
 
-    def exec(self, fw_rest_api):
-        r = fw_rest_api.get_results_for_query_id(self.query_id)
-        j = r.json()
-        df = pd.DataFrame(j["values"], columns=j["fields"])
+    async def exec(self, fw_rest_api):
+        df = await fw_rest_api.get_results_for_query_id_df(self.query_id)
+        if df is None:
+            raise Exception(f"no results were returned for query id {self.query_id}")
+        instrumentation.add_rows(len(df))
         # run the group-by and count operation
-        self.result_df = df.groupby(self.rollup_column_names, as_index=False)[self.op_column_name].count()
+        with instrumentation.stage(instrumentation.STAGE_AGGREGATE):
+            self.result_df = df.groupby(self.rollup_column_names, as_index=False)[self.op_column_name].count()
 
     def results(self):
         return self.result_df.to_numpy()
@@ -66,22 +56,18 @@ class ApplicationQueryManager:
     Responsible for managing the refresh of queries for apps from the FW server, associating that
     with the rolled up results (via ApplicationUsageRollup)
     """
-    def __init__(self, fw_query):
+    def __init__(self, fw_query, max_concurrency=4):
         self.fw_query = fw_query
+        self.max_concurrency = max_concurrency
         self.app_queries = {}
-        self.results_collector = None
 
-    def __del__(self):
-        if self.results_collector is not None:
-            REGISTRY.unregister(self.results_collector)
-
-    def is_query_valid(self, q_id):
+    async def is_query_valid(self, q_id):
         app_name = False
         app_version = False
         client_id = False
 
         # fetch the query def
-        json_query = self.fw_query.get_definition_for_query_id_j(q_id)
+        json_query = await self.fw_query.get_definition_for_query_id_j(q_id)
         if json_query is None:
             return False
 
@@ -104,29 +90,29 @@ class ApplicationQueryManager:
 
         return app_name and app_version and client_id
 
-    def create_default_queries_in_group(self, group_id):
-        for query_file in pkg_resources.resource_listdir("extra_metrics", "app_queries"):
+    async def create_default_queries_in_group(self, group_id):
+        for query_file in list_package_resources("extra_metrics.app_queries"):
             if query_file.endswith(".json"):
                 json_data = get_package_resource_json("extra_metrics.app_queries", query_file)
                 json_data["group"] = group_id
-                self.fw_query.create_inventory_query(json.dumps(json_data))
+                await self.fw_query.create_inventory_query(json.dumps(json_data))
 
-    def retrieve_all_queries_in_group(self, group_id):
+    async def retrieve_all_queries_in_group(self, group_id):
         # in all cases - read all queries in this group and find their IDs, store in-mem for redirection
-        all_queries = self.fw_query.get_all_inventory_queries()
+        all_queries = await self.fw_query.get_all_inventory_queries()
 
         self.app_queries = {}
 
         for q in all_queries:
             q_group = q["group"]
             q_id = q["id"]
-            if q_group == group_id and self.is_query_valid(q_id):
+            if q_group == group_id and await self.is_query_valid(q_id):
                 self.app_queries[q_id] = q
                 logger.info(f"refreshed app query {q_id}/{q['name']}")
 
-    def validate_query_definitions(self):
+    async def validate_query_definitions(self):
         # ensure there is a top level query group we can place queries into...
-        query_group, was_created = self.fw_query.ensure_inventory_query_group_exists("Extra Metrics Queries - Apps")
+        query_group, was_created = await self.fw_query.ensure_inventory_query_group_exists("Extra Metrics Queries - Apps")
         if query_group is not None:
             logger.debug(f"found group: {query_group}")
             group_id = int(query_group['id'])
@@ -134,39 +120,45 @@ class ApplicationQueryManager:
             # if we created this group; then pre-pop the queries with what we have in code, otherwise
             # assume the queries inside this group are definitive
             if was_created:
-                self.create_default_queries_in_group(group_id)
+                await self.create_default_queries_in_group(group_id)
 
-            self.retrieve_all_queries_in_group(group_id)
+            await self.retrieve_all_queries_in_group(group_id)
         else:
             logger.warning("The inventory group named 'Extra Metrics Queries - Apps' could not be found - not refreshing queries")
 
-    def collect_application_query_results(self):
-        # temp - to ensure we run/collect results and only swap the collector right at the end
-        temp_collector = ApplicationResultCollector()
-
-        for q_id, q in self.app_queries.items():
-            r = ApplicationUsageRollup(q_id, ["Application_name", "Application_version"], "Client_device_id")
+    async def _collect_one_query_result(self, q_id, q, semaphore, snapshot):
+        r = ApplicationUsageRollup(q_id, ["Application_name", "Application_version"], "Client_device_id")
 
-            try:
-                label_name = f"app_query_{q['name']}"
+        try:
+            label_name = f"app_query_{q['name']}"
+            # only the time spent running the query is recorded, not the time spent waiting for a slot
+            async with semaphore:
                 with http_request_time_taken.labels(label_name).time():
-                    r.exec(self.fw_query)
+                    await r.exec(self.fw_query)
+
+            for result in r.results():
+                name = q['name']
+                version = result[1]
+                total = int(result[2])
+                logger.info(f"app query result for {name}, {version}, query_id: {r.query_id} = {total}")
+                snapshot.set(application_version, [name, version, r.query_id], total)
+
+        except Exception as e:
+            logger.error(f"failed to do app query rollup on query id {q_id}, {e}")
+            traceback.print_exc(file=sys.stdout)
 
-                for result in r.results():
-                    name = q['name']
-                    version = result[1]
-                    total = int(result[2])
-                    logger.info(f"app query result for {name}, {version}, query_id: {r.query_id} = {total}")
-                    temp_collector.add_result(r.query_id, name, version, total)
+    async def collect_application_query_results(self):
+        # to ensure we run/collect results and only swap them in right at the end
+        snapshot = application_metrics.new_snapshot()
 
-            except Exception as e:
-                logger.error(f"failed to do app query rollup on query id {q_id}, {e}")
-                traceback.print_exc(file=sys.stdout)
+        # the queries are independent of each other, so run them side by side - but only max_concurrency
+        # at a time, so the FileWave server isn't flooded
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        await asyncio.gather(*[self._collect_one_query_result(q_id, q, semaphore, snapshot)
+                               for q_id, q in self.app_queries.items()])
 
         # Because running the inventory queries can take a non-trivial amount of time, we must
-        # ensure that swapping the collector in the REGISTRY happens as fast as possible.
+        # ensure that swapping the results in happens in one go.
         # Remember: start_http_server kicks off a thread that will fire independantly of this code.
-        if self.results_collector is not None:
-            REGISTRY.unregister(self.results_collector)
-        REGISTRY.register(temp_collector)
-        self.results_collector = temp_collector
+        with instrumentation.stage(instrumentation.STAGE_PUBLISH):
+            application_metrics.publish(snapshot)
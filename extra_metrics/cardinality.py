@@ -0,0 +1,61 @@
+import zlib
+from prometheus_client import Gauge
+
+cardinality_dropped_series = Gauge('extra_metrics_cardinality_dropped_series',
+                                   'number of per device series left out of the last collection to stay within the series budget',
+                                   ['family'])
+
+cardinality_kept_devices = Gauge('extra_metrics_cardinality_kept_devices',
+                                 'number of devices that have their own series in the last collection',
+                                 ['family'])
+
+
+class CardinalityGovernor:
+    """
+    Decides which devices get their own series in the per device metric families, so that the
+    amount of per device detail stays usable on large fleets.
+
+    - shard_count/shard_index: only devices whose id hashes (crc32) into this shard are kept, this is
+      stable from one collection to the next and lets several exporters/jobs split a fleet between them
+    - max_devices: of the devices in the shard, only the max_devices with the most outstanding critical
+      patches are kept (ties go to the lowest device id, so the choice is stable too); 0 means no limit
+
+    The devices that are left out are meant to be rolled up into an 'Other' series by the caller,
+    wherever the values can be added up.
+    """
+    OTHER_LABEL = "Other"
+
+    def __init__(self, max_devices=0, shard_count=1, shard_index=0):
+        if shard_count < 1 or not 0 <= shard_index < shard_count:
+            raise ValueError(f"shard_index must be between 0 and {shard_count - 1}")
+        self.max_devices = max_devices
+        self.shard_count = shard_count
+        self.shard_index = shard_index
+
+    def is_unlimited(self):
+        return self.max_devices <= 0 and self.shard_count == 1
+
+    def in_shard(self, device_id):
+        if self.shard_count == 1:
+            return True
+        return zlib.crc32(str(device_id).encode('utf-8')) % self.shard_count == self.shard_index
+
+    def select(self, family, scores, series_per_device=1):
+        """
+        Given a dictionary of device id -> score (outstanding critical patches), returns the set of
+        device ids that should have their own series in this family, or None if all of them should.
+        """
+        if self.is_unlimited():
+            cardinality_kept_devices.labels(family).set(len(scores))
+            cardinality_dropped_series.labels(family).set(0)
+            return None
+
+        candidates = [device_id for device_id in scores.keys() if self.in_shard(device_id)]
+        if self.max_devices > 0 and len(candidates) > self.max_devices:
+            candidates.sort(key=lambda device_id: (-scores[device_id], device_id))
+            candidates = candidates[:self.max_devices]
+
+        kept = set(candidates)
+        cardinality_kept_devices.labels(family).set(len(kept))
+        cardinality_dropped_series.labels(family).set((len(scores) - len(kept)) * series_per_device)
+        return kept
@@ -1,3 +1,6 @@
+import numpy as np
+import pandas as pd
+
 
 class ClientCompliance:
     # 0 - zero errors, all ok
@@ -75,3 +78,55 @@ class ClientCompliance:
         }
 
         return mappings[state_value]
+
+
+class ClientComplianceBatch:
+    """
+    The column-wise twin of ClientCompliance; it takes a whole column (list, Series or array) for each of
+    the constructor arguments of ClientCompliance and every method returns an array of states, one per
+    device.  Missing values can be None or NaN.
+
+    The results are exactly those of ClientCompliance applied row by row, test_compliance checks this.
+    The only difference is that a missing patch count is 'unknown' here, where ClientCompliance raises
+    a TypeError (the per device collector always has a count, zero if nothing is outstanding).
+    """
+    def __init__(self, last_checkin_date, total_disk, free_disk, last_checkin_days, outstanding_critical_patches, outstanding_standard_patches):
+        self.has_checkin_date = ~pd.isna(np.asarray(last_checkin_date, dtype=object))
+        self.total_disk = ClientComplianceBatch._as_float(total_disk)
+        self.free_disk = ClientComplianceBatch._as_float(free_disk)
+        self.last_checkin_days = ClientComplianceBatch._as_float(last_checkin_days)
+        self.outstanding_critical_patches = ClientComplianceBatch._as_float(outstanding_critical_patches)
+        self.outstanding_standard_patches = ClientComplianceBatch._as_float(outstanding_standard_patches)
+
+    @staticmethod
+    def _as_float(values):
+        # None becomes NaN
+        return np.asarray(values, dtype=np.float64)
+
+    def get_patch_compliance(self):
+        crit = self.outstanding_critical_patches
+        normal = self.outstanding_standard_patches
+        # NaN compares as False, so missing counts end up as unknown
+        return np.select([(crit == 0) & (normal == 0), crit > 0, normal > 0],
+                         [ClientCompliance.STATE_OK, ClientCompliance.STATE_ERROR, ClientCompliance.STATE_WARNING],
+                         ClientCompliance.STATE_UNKNOWN).astype(np.int8)
+
+    def get_checkin_compliance(self):
+        days = self.last_checkin_days
+        return np.select([np.isnan(days), days < 7, days < 14],
+                         [ClientCompliance.STATE_UNKNOWN, ClientCompliance.STATE_OK, ClientCompliance.STATE_WARNING],
+                         ClientCompliance.STATE_ERROR).astype(np.int8)
+
+    def get_disk_compliance(self):
+        free = self.free_disk
+        total = self.total_disk
+        has_space = (free > 0) & (total > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            space_left_pcnt = (free / total) * 100.0
+        return np.select([~has_space, space_left_pcnt >= 20, space_left_pcnt < 5],
+                         [ClientCompliance.STATE_UNKNOWN, ClientCompliance.STATE_OK, ClientCompliance.STATE_ERROR],
+                         ClientCompliance.STATE_WARNING).astype(np.int8)
+
+    def get_compliance_state(self):
+        worst = np.maximum.reduce([self.get_checkin_compliance(), self.get_disk_compliance(), self.get_patch_compliance()])
+        return np.where(self.has_checkin_date, worst, ClientCompliance.STATE_OK).astype(np.int8)
@@ -13,10 +13,32 @@ def read_config_helper(cfg):
 
 class ExtraMetricsConfiguration:
     DEFAULT_CFG_FILE_LOCATION = '/usr/local/etc/filewave/extra_metrics.ini'
+    DEFAULT_DEFINITION_CACHE_LOCATION = '/usr/local/etc/filewave/extra_metrics_definitions.json'
+    DEFAULT_SNAPSHOT_LOCATION = '/usr/local/etc/filewave/extra_metrics_snapshot.bin'
+    # devices are kept up to date by /client/ events, the full query of every device is only a reconciliation
+    DEFAULT_DEVICE_RECONCILIATION_SECONDS = 3600
     KEY_FW_SERVER_HOSTNAME = 'fw_server_hostname'
     KEY_FW_SERVER_API_KEY = 'fw_server_api_key'
     KEY_POLLING_DELAY = 'fw_query_polling_delay_seconds'
     KEY_VERIFY_TLS = 'fw_verify_tls'
+    KEY_HTTP_POOL_SIZE = 'fw_http_pool_size'
+    KEY_HTTP_MAX_RETRIES = 'fw_http_max_retries'
+    KEY_HTTP_BACKOFF_FACTOR = 'fw_http_backoff_factor'
+    KEY_DEFINITION_CACHE_FILE = 'fw_definition_cache_file'
+    KEY_DEFINITION_CACHE_TTL = 'fw_definition_cache_ttl_seconds'
+    KEY_SOFTWARE_UPDATE_PAGE_SIZE = 'fw_software_update_page_size'
+    KEY_APP_QUERY_CONCURRENCY = 'fw_app_query_concurrency'
+    KEY_COLLECTION_DEBOUNCE = 'fw_collection_debounce_seconds'
+    KEY_COLLECTION_MIN_SPACING = 'fw_collection_min_spacing_seconds'
+    KEY_SOFTWARE_UPDATE_PAGE_CONCURRENCY = 'fw_software_update_page_concurrency'
+    KEY_DEVICE_SERIES_LIMIT = 'fw_device_series_limit'
+    KEY_DEVICE_SERIES_SHARD_COUNT = 'fw_device_series_shard_count'
+    KEY_DEVICE_SERIES_SHARD_INDEX = 'fw_device_series_shard_index'
+    KEY_DEVICE_ROLLUPS = 'fw_device_rollups'
+    KEY_COMPUTE_WORKERS = 'fw_compute_workers'
+    KEY_ROLLUP_PROCESSES = 'fw_rollup_processes'
+    KEY_SNAPSHOT_FILE = 'fw_snapshot_file'
+    KEY_SNAPSHOT_MAX_AGE = 'fw_snapshot_max_age_seconds'
 
     def __init__(self):
         self.config = configparser.ConfigParser()
@@ -61,8 +83,147 @@ class ExtraMetricsConfiguration:
     def set_polling_delay_seconds(self, value):
         self._set_value(ExtraMetricsConfiguration.KEY_POLLING_DELAY, str(value))
 
+    def get_collector_polling_delay_seconds(self, collector_name, default=None):
+        # each collector can have its own interval, e.g. fw_devices_polling_delay_seconds
+        value = self._get_value(f"fw_{collector_name}_polling_delay_seconds")
+        if value is not None:
+            return int(value)
+        return default if default is not None else self.get_polling_delay_seconds()
+
+    def set_collector_polling_delay_seconds(self, collector_name, value):
+        self._set_value(f"fw_{collector_name}_polling_delay_seconds", str(value))
+
     def get_verify_tls(self):
         return self.section.getboolean(ExtraMetricsConfiguration.KEY_VERIFY_TLS, True)
 
     def set_verify_tls(self, value):
         self._set_value(ExtraMetricsConfiguration.KEY_VERIFY_TLS, "on" if value else "off")
+
+    def get_http_pool_size(self):
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_HTTP_POOL_SIZE, 10))
+
+    def set_http_pool_size(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_HTTP_POOL_SIZE, str(value))
+
+    def get_http_max_retries(self):
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_HTTP_MAX_RETRIES, 3))
+
+    def set_http_max_retries(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_HTTP_MAX_RETRIES, str(value))
+
+    def get_http_backoff_factor(self):
+        return float(self._get_value(ExtraMetricsConfiguration.KEY_HTTP_BACKOFF_FACTOR, 0.5))
+
+    def set_http_backoff_factor(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_HTTP_BACKOFF_FACTOR, str(value))
+
+    def get_definition_cache_file(self):
+        return self._get_value(ExtraMetricsConfiguration.KEY_DEFINITION_CACHE_FILE,
+                               ExtraMetricsConfiguration.DEFAULT_DEFINITION_CACHE_LOCATION)
+
+    def set_definition_cache_file(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_DEFINITION_CACHE_FILE, value)
+
+    def get_definition_cache_ttl_seconds(self):
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_DEFINITION_CACHE_TTL, 3600))
+
+    def set_definition_cache_ttl_seconds(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_DEFINITION_CACHE_TTL, str(value))
+
+    def get_snapshot_file(self):
+        # where the metrics are kept across restarts, an empty value turns that off
+        value = self._get_value(ExtraMetricsConfiguration.KEY_SNAPSHOT_FILE,
+                                ExtraMetricsConfiguration.DEFAULT_SNAPSHOT_LOCATION)
+        return value if len(value) > 0 else None
+
+    def set_snapshot_file(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_SNAPSHOT_FILE, value if value is not None else "")
+
+    def get_snapshot_max_age_seconds(self):
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_SNAPSHOT_MAX_AGE, 86400))
+
+    def set_snapshot_max_age_seconds(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_SNAPSHOT_MAX_AGE, str(value))
+
+    def get_software_update_page_size(self):
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_SOFTWARE_UPDATE_PAGE_SIZE, 1000))
+
+    def set_software_update_page_size(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_SOFTWARE_UPDATE_PAGE_SIZE, str(value))
+
+    def get_software_update_page_concurrency(self):
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_SOFTWARE_UPDATE_PAGE_CONCURRENCY, 4))
+
+    def set_software_update_page_concurrency(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_SOFTWARE_UPDATE_PAGE_CONCURRENCY, str(value))
+
+    def get_app_query_concurrency(self):
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_APP_QUERY_CONCURRENCY, 4))
+
+    def set_app_query_concurrency(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_APP_QUERY_CONCURRENCY, str(value))
+
+    def get_collection_debounce_seconds(self):
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_COLLECTION_DEBOUNCE, 10))
+
+    def set_collection_debounce_seconds(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_COLLECTION_DEBOUNCE, str(value))
+
+    def get_collection_min_spacing_seconds(self):
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_COLLECTION_MIN_SPACING, 60))
+
+    def set_collection_min_spacing_seconds(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_COLLECTION_MIN_SPACING, str(value))
+
+    def get_device_series_limit(self):
+        # 0 means every device gets its own series
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_DEVICE_SERIES_LIMIT, 0))
+
+    def set_device_series_limit(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_DEVICE_SERIES_LIMIT, str(value))
+
+    def get_device_series_shard_count(self):
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_DEVICE_SERIES_SHARD_COUNT, 1))
+
+    def set_device_series_shard_count(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_DEVICE_SERIES_SHARD_COUNT, str(value))
+
+    def get_device_series_shard_index(self):
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_DEVICE_SERIES_SHARD_INDEX, 0))
+
+    def set_device_series_shard_index(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_DEVICE_SERIES_SHARD_INDEX, str(value))
+
+    def get_compute_workers(self):
+        # threads the collectors crunch their data in, 0 does it on the event loop
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_COMPUTE_WORKERS, 2))
+
+    def set_compute_workers(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_COMPUTE_WORKERS, str(value))
+
+    def get_rollup_processes(self):
+        # worker processes for the device rollups of very large fleets, 0 counts them in this process
+        return int(self._get_value(ExtraMetricsConfiguration.KEY_ROLLUP_PROCESSES, 0))
+
+    def set_rollup_processes(self, value):
+        self._set_value(ExtraMetricsConfiguration.KEY_ROLLUP_PROCESSES, str(value))
+
+    def get_device_rollups(self):
+        """
+        Extra device rollups, as a list of (name, [columns]); in the ini file each rollup is
+        name: column[, column...] and rollups are separated by ;, e.g.
+        fw_device_rollups = os_version: OperatingSystem_name, OperatingSystem_version; upstream: Client_current_upstream_host
+        """
+        rollups = []
+        for entry in self._get_value(ExtraMetricsConfiguration.KEY_DEVICE_ROLLUPS, "").split(";"):
+            if ":" not in entry:
+                continue
+            name, columns = entry.split(":", 1)
+            columns = [c.strip() for c in columns.split(",") if len(c.strip()) > 0]
+            if len(name.strip()) > 0 and len(columns) > 0:
+                rollups.append((name.strip(), columns))
+        return rollups
+
+    def set_device_rollups(self, rollups):
+        self._set_value(ExtraMetricsConfiguration.KEY_DEVICE_ROLLUPS,
+                        "; ".join(f"{name}: {', '.join(columns)}" for name, columns in rollups))
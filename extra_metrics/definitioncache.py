@@ -0,0 +1,139 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from prometheus_client import Counter
+from extra_metrics.logs import logger
+
+definition_cache_requests = Counter('extra_metrics_definition_cache_requests',
+                                    'lookups against the cache of inventory query definitions/groups, by kind and hit/miss',
+                                    ['kind', 'result'])
+
+
+def query_ids_from_event(payload):
+    '''
+    Picks the inventory query id(s) out of an /inventory/inventory_query_changed payload, returns
+    None when the payload doesn't say which queries changed.
+    '''
+    if isinstance(payload, dict):
+        for key in ("ids", "query_ids", "id", "query_id"):
+            if key in payload:
+                return query_ids_from_event(payload[key])
+        return None
+    if isinstance(payload, list):
+        ids = [query_ids_from_event(item) for item in payload]
+        if len(ids) == 0 or any(i is None for i in ids):
+            return None
+        return [q_id for sub_list in ids for q_id in sub_list]
+    if isinstance(payload, int) or (isinstance(payload, str) and payload.isdigit()):
+        return [int(payload)]
+    return None
+
+
+class DefinitionCache:
+    """
+    A time-to-live cache for the data that describes the inventory queries; the groups tree, the list of
+    all queries and each query definition.  This data almost never changes, so it's kept across cycles
+    and persisted to disk so that a restart doesn't have to fetch it all again.
+
+    Entries expire after ttl_seconds, and are invalidated precisely when the server tells us (via ZMQ)
+    that an inventory query changed; the groups go then too, the server doesn't say which group changed.
+
+    Changes only mark the cache dirty; save() writes the file, once per cycle and off the event loop.
+    """
+    KEY_QUERIES = "queries"
+
+    def __init__(self, path=None, ttl_seconds=3600, clock=time.time):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for_definition(query_id):
+        return f"definition/{query_id}"
+
+    @staticmethod
+    def key_for_group(group_name):
+        return f"group/{group_name}"
+
+    @staticmethod
+    def _kind_of(key):
+        return key.split("/")[0]
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and self.clock() - entry["stored"] < self.ttl_seconds:
+            definition_cache_requests.labels(self._kind_of(key), 'hit').inc()
+            return entry["value"]
+        definition_cache_requests.labels(self._kind_of(key), 'miss').inc()
+        return None
+
+    def put(self, key, value):
+        if value is None:
+            return
+        self._entries[key] = {"stored": self.clock(), "value": value}
+        self._dirty = True
+
+    def invalidate(self, key):
+        if self._entries.pop(key, None) is not None:
+            self._dirty = True
+
+    def invalidate_queries(self, query_ids=None):
+        # the list of queries always goes, a changed query might have moved in/out of our group
+        self._entries.pop(DefinitionCache.KEY_QUERIES, None)
+        if query_ids is None:
+            self._entries = {k: v for k, v in self._entries.items() if self._kind_of(k) != "definition"}
+        else:
+            for q_id in query_ids:
+                self._entries.pop(DefinitionCache.key_for_definition(q_id), None)
+        self._dirty = True
+
+    def invalidate_groups(self):
+        self._entries = {k: v for k, v in self._entries.items() if self._kind_of(k) != "group"}
+        self._dirty = True
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r') as f:
+                self._entries = json.load(f)
+            logger.info(f"loaded {len(self._entries)} cached query definitions from {self.path}")
+            return True
+        except (OSError, ValueError) as e:
+            logger.warning(f"unable to load the query definition cache from {self.path}, {e}")
+            self._entries = {}
+        return False
+
+    def save(self):
+        """
+        Writes the cache if anything changed since the last save, returns True when it did.  Safe to
+        call from a worker thread while the event loop carries on using the cache.
+        """
+        if self.path is None:
+            return False
+        with self._lock:
+            if not self._dirty:
+                return False
+            # the entries are only ever replaced, never changed in place; a shallow copy is enough
+            entries = dict(self._entries)
+            self._dirty = False
+
+            # write-then-rename, so a crash never leaves a half written cache behind
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"unable to save the query definition cache to {self.path}, {e}")
+                self._dirty = True
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return False
+            return True
@@ -1,172 +1,279 @@
-from prometheus_client import Gauge
-import pandas as pd
+from prometheus_client import REGISTRY
 import datetime
-from extra_metrics.compliance import ClientCompliance
+from datetime import timezone
+import logging
+import numpy as np
+import threading
+from extra_metrics import instrumentation
+from extra_metrics.cardinality import CardinalityGovernor
+from extra_metrics.compliance import ClientCompliance, ClientComplianceBatch
+from extra_metrics.devicetable import DeviceTable
+from extra_metrics.exposition import DEVICE_REGISTRY
 from extra_metrics.logs import logger
-
-device_checkin_days = Gauge('extra_metrics_devices_by_checkin_days',
+from extra_metrics.rollup import RollupDimension, RollupEngine
+from extra_metrics.schema import missing_columns
+from extra_metrics.snapshot import SnapshotCollector
+from extra_metrics.timestamps import age_in_days
+from extra_metrics.workers import INLINE
+
+# every metric of this module is published as one snapshot per collection
+device_metrics = SnapshotCollector()
+# ... apart from the per device ones, which are served on /metrics/devices
+per_device_metrics = SnapshotCollector()
+
+device_checkin_days = device_metrics.gauge('extra_metrics_devices_by_checkin_days',
                             'various interesting stats on a per device basis, days since checked, compliance status',
                             ["days", ])
 
-device_client_modelnumber = Gauge('extra_metrics_per_device_modelnum',
+device_client_modelnumber = per_device_metrics.gauge('extra_metrics_per_device_modelnum',
                            'provides a value of the model number per device',
                            ["device_name"])
 
-device_client_compliance = Gauge('extra_metrics_per_device_compliance',
+device_client_compliance = device_metrics.gauge('extra_metrics_per_device_compliance',
                            'provides a value of the compliance state per device, used for device health graph',
                            ["compliance"])
 
-device_client_version = Gauge('extra_metrics_per_device_client_version',
+device_client_version = device_metrics.gauge('extra_metrics_per_device_client_version',
                            'number of devices rolled up by client version',
                            ["fw_client_version"])
 
-device_client_platform = Gauge('extra_metrics_per_device_platform',
+device_client_platform = device_metrics.gauge('extra_metrics_per_device_platform',
                            'number of devices rolled up by platform',
                            ["platform"])
 
-device_client_tracked = Gauge('extra_metrics_per_device_tracked',
+device_client_tracked = device_metrics.gauge('extra_metrics_per_device_tracked',
                            'number of devices being tracked',
                            ["tracked"])
 
-device_client_locked = Gauge('extra_metrics_per_device_locked',
+device_client_locked = device_metrics.gauge('extra_metrics_per_device_locked',
                            'number of devices locked',
                            ["locked"])
 
+device_client_rollup = device_metrics.gauge('extra_metrics_devices_by_rollup',
+                           'number of devices rolled up by the fields of each configured rollup (fw_device_rollups), fields are separated by /',
+                           ["rollup", "value"])
 
-class PerDeviceStatus:
-    def __init__(self, fw_query):
-        self.fw_query = fw_query
-
-    def _rollup_by_single_column_count_client_filewave_id(self, df, column_name):
-        return df.groupby([column_name], as_index=False)["Client_filewave_id"].count()
-
-    def _set_metric_pair(self, metric, item):
-        label_value = item[0]
-        total_count = item[1]
-        metric.labels(label_value).set(total_count)
-        return (label_value, total_count)
+REGISTRY.register(device_metrics)
+DEVICE_REGISTRY.register(per_device_metrics)
 
-    def collect_client_data(self, soft_patches):
-        Client_device_name = 0
-        Client_free_disk_space = 2
-        Client_filewave_id = 10
-        Client_last_check_in = 17
-        DesktopClient_filewave_model_number = 18
-        Client_total_disk_space = 24
-        OperatingSystem_name = 13
+# the rollups that are always computed, and the metric each one is published to
+DEFAULT_ROLLUPS = [
+    (RollupDimension("client_version", ["DesktopClient_filewave_client_version"]), device_client_version),
+    (RollupDimension("platform", ["OperatingSystem_name"]), device_client_platform),
+    (RollupDimension("tracked", ["Client_is_tracking_enabled"]), device_client_tracked),
+    (RollupDimension("locked", ["Client_filewave_client_locked"]), device_client_locked),
+]
 
-        j = self.fw_query.get_client_info_j()
 
-        try:
-            assert j["fields"]
-            assert j["fields"][Client_device_name] == "Client_device_name", f"field {Client_device_name} is expected to be the Client's name"
-            assert j["fields"][Client_last_check_in] == "Client_last_check_in", f"field {Client_last_check_in} is expected to be the Client's last check in date/time"
-            assert j["fields"][Client_filewave_id] == "Client_filewave_id", f"field {Client_filewave_id} is expected to be the Client's filewave_id"
-            assert j["fields"][OperatingSystem_name] == "OperatingSystem_name", f"field {OperatingSystem_name} is supposed to be OperatingSystem_name"
-
-            buckets = [0, 0, 0, 0]
-            now = datetime.datetime.now()
-
-            df = pd.DataFrame(j["values"], columns=j["fields"])
-
-            # devices by client_version
-            for item in self._rollup_by_single_column_count_client_filewave_id(df, "DesktopClient_filewave_client_version").to_numpy():
-                version = item[0]
-                total_count = item[1]
-                if version is None:
-                    version = "Not Reported"
-                device_client_version.labels(version).set(total_count)
-                logger.info(f"device client version: {version}, {total_count}")
-
-            # roll up devices per platform
-            for item in self._rollup_by_single_column_count_client_filewave_id(df, "OperatingSystem_name").to_numpy():
-                (a, b) = self._set_metric_pair(device_client_platform, item)
-                logger.info(f"device platform: {a}, {b}")
-
-            # roll up devices by 'tracking enabled' or not
-            for item in self._rollup_by_single_column_count_client_filewave_id(df, "Client_is_tracking_enabled").to_numpy():
-                (a, b) = self._set_metric_pair(device_client_tracked, item)
-                logger.info(f"device by tracking: {a}, {b}")
-
-            # and by locked state
-            for item in self._rollup_by_single_column_count_client_filewave_id(df, "Client_filewave_client_locked").to_numpy():
-                (a, b) = self._set_metric_pair(device_client_locked, item)
-                logger.info(f"device by locked: {a}, {b}")
-
-            # a bit of logic here, so rollup isn't via pandas...
-            device_count_by_compliance = {
-                ClientCompliance.STATE_OK: 0,
-                ClientCompliance.STATE_ERROR: 0,
-                ClientCompliance.STATE_WARNING: 0,
-                ClientCompliance.STATE_UNKNOWN: 0
-            }
-
-            for v in j["values"]:
-                # if there is no last check in date, we want to assume it's NEVER checked in
-                checkin_days = 999
-                if v[Client_last_check_in] is not None:
-                    checkin_date = datetime.datetime.strptime(
-                        v[Client_last_check_in], '%Y-%m-%dT%H:%M:%S.%fZ')
-                    delta = now - checkin_date
-                    checkin_days = delta.days
-
-                total_crit = 0
-                total_normal = 0
-
-                # for devices with a filewave_id
-                client_fw_id = v[Client_filewave_id]
-                if client_fw_id is None:
-                    logger.warning(f"one of the device records doesn't have a client_fw_id; the json data is: {v}")
+class PerDeviceStatus:
+    # the client info columns read by collect_client_data, on top of the ones the rollups need
+    CLIENT_INFO_COLUMNS = [
+        "Client_device_name",
+        "Client_free_disk_space",
+        "Client_filewave_id",
+        "Client_last_check_in",
+        "DesktopClient_filewave_model_number",
+        "Client_total_disk_space",
+        "OperatingSystem_name",
+    ]
+    # changed devices are re-queried this many at a time
+    MAX_IDS_PER_QUERY = 500
+
+    def __init__(self, fw_query, governor=None, rollups=None, compute=None, rollup_processes=0):
+        self.fw_query = fw_query
+        self.governor = governor if governor is not None else CardinalityGovernor()
+        # the pandas/numpy work runs here, off the event loop
+        self.compute = compute if compute is not None else INLINE
+        # any extra rollups (RollupDimension) are published as extra_metrics_devices_by_rollup
+        self.extra_rollups = list(rollups) if rollups is not None else []
+        self.rollup_metrics = {dimension.name: metric for dimension, metric in DEFAULT_ROLLUPS}
+        self.rollup_engine = RollupEngine([dimension for dimension, _ in DEFAULT_ROLLUPS] + self.extra_rollups,
+                                          processes=rollup_processes)
+        # the devices as of the last query, and the rollup counts over them
+        self.device_table = DeviceTable()
+        self.rollup_counts = {}
+        self._table_lock = threading.Lock()
+
+    def client_info_columns(self):
+        columns = list(PerDeviceStatus.CLIENT_INFO_COLUMNS)
+        for dimension in self.rollup_engine.dimensions:
+            columns += dimension.columns
+        return list(dict.fromkeys(columns))
+
+    def mark_dirty(self, client_ids):
+        # these devices are re-queried by the next collect_changed_devices
+        self.device_table.mark_dirty(client_ids)
+
+    def _apply_rollups(self, results, sign):
+        for name, rows in results.items():
+            counts = self.rollup_counts.setdefault(name, {})
+            for values, count in rows:
+                total = counts.get(values, 0) + sign * count
+                if total == 0:
+                    counts.pop(values, None)
                 else:
-                    per_device_state = soft_patches.get_perdevice_state(client_fw_id)
-                    if per_device_state is not None:
-                        total_crit = per_device_state.get_counter(True).total_not_completed()
-                        total_normal = per_device_state.get_counter(False).total_not_completed()
-
-                # If we have a model number, store it in the metrics
-                fw_model_number = 0
-                if v[DesktopClient_filewave_model_number] is not None:
-                    fw_model_number = v[DesktopClient_filewave_model_number]
-                device_client_modelnumber.labels(v[Client_device_name]).set(fw_model_number)
-
-                comp_check = ClientCompliance(
-                    v[Client_last_check_in],
-                    v[Client_total_disk_space],
-                    v[Client_free_disk_space],
-                    checkin_days,
-                    total_crit,
-                    total_normal
-                )
-
-                state = comp_check.get_compliance_state()
-                if v[OperatingSystem_name] == "Chrome OS":
-                    logger.debug(f"state {ClientCompliance.get_compliance_state_str(state)} found for name: {v[Client_device_name]},\
-last check in: {v[Client_last_check_in]},\
-total disk: {v[Client_total_disk_space]},\
-free disk: {v[Client_free_disk_space]},\
-checkin days: {checkin_days},\
-total crit/noral: {total_crit}/{total_normal},\
-checkin compliance: {comp_check.get_checkin_compliance()}, disk compliance: {comp_check.get_checkin_compliance()}, patch compliance: {comp_check.get_patch_compliance()}")
-                    logger.debug("\r\n")
+                    counts[values] = total
+
+    def _publish_rollups(self, snapshot):
+        for name, counts in self.rollup_counts.items():
+            try:
+                # the same order as the rollup engine; by value
+                items = sorted(counts.items())
+            except TypeError:
+                items = list(counts.items())
+            metric = self.rollup_metrics.get(name)
+            for values, total_count in items:
+                if metric is not None:
+                    snapshot.set(metric, [values[0]], total_count)
+                else:
+                    snapshot.set(device_client_rollup, [name, "/".join(str(v) for v in values)], total_count)
+                logger.info(f"device rollup {name}: {values}, {total_count}")
+
+    async def collect_client_data(self, soft_patches):
+        """
+        The full collection; queries every device.  With collect_changed_devices keeping the device
+        table up to date in between, this is the reconciliation that catches anything missed.
+        """
+        # the full query covers every change the server has told us about so far
+        self.device_table.take_dirty()
+        df = await self.fw_query.get_client_info_df()
 
-                device_count_by_compliance[state] += 1
+        try:
+            assert df is not None, "no client info was returned from the FileWave server"
+            # columns are looked up by name, so their position in the query doesn't matter
+            missing = missing_columns(df, PerDeviceStatus.CLIENT_INFO_COLUMNS)
+            assert len(missing) == 0, f"the client info is missing the fields {missing}"
 
-                if(checkin_days <= 1):
-                    buckets[0] += 1
-                elif checkin_days < 7:
-                    buckets[1] += 1
-                elif checkin_days < 30:
-                    buckets[2] += 1
-                else:
-                    buckets[3] += 1
+            instrumentation.add_rows(len(df))
 
-            for key, value in device_count_by_compliance.items():
-                device_client_compliance.labels(ClientCompliance.get_compliance_state_str(key)).set(value)
+            snapshot, device_snapshot = await self.compute.run(self._refresh_all_devices, df, soft_patches)
 
-            device_checkin_days.labels('Less than 1').set(buckets[0])
-            device_checkin_days.labels('Less than 7').set(buckets[1])
-            device_checkin_days.labels('Less than 30').set(buckets[2])
-            device_checkin_days.labels('More than 30').set(buckets[3])
+            with instrumentation.stage(instrumentation.STAGE_PUBLISH):
+                device_metrics.publish(snapshot)
+                per_device_metrics.publish(device_snapshot)
 
         except AssertionError as e1:
             logger.error("The validation/assertions failed: %s" % (e1,))
+
+    async def collect_changed_devices(self, soft_patches):
+        """
+        Re-queries only the devices marked dirty (by /client/ events) and adjusts the device table
+        and rollups for them, then works the metrics out again from the table - so they also pick up
+        the latest patch counts and check in ages.  Does nothing until a full collection has run.
+        """
+        if not self.device_table.is_loaded():
+            return
+
+        client_ids = self.device_table.take_dirty()
+        frames = []
+        for start in range(0, len(client_ids), PerDeviceStatus.MAX_IDS_PER_QUERY):
+            batch = client_ids[start:start + PerDeviceStatus.MAX_IDS_PER_QUERY]
+            df = await self.fw_query.get_client_info_for_ids_df(batch)
+            if df is None or len(missing_columns(df, PerDeviceStatus.CLIENT_INFO_COLUMNS)) > 0:
+                # try them again next time
+                logger.warning(f"no usable client info returned for {len(batch)} changed devices")
+                self.device_table.mark_dirty(batch)
+                continue
+            frames.append((batch, df))
+            instrumentation.add_rows(len(df))
+
+        snapshot, device_snapshot = await self.compute.run(self._refresh_changed_devices, frames, soft_patches)
+
+        with instrumentation.stage(instrumentation.STAGE_PUBLISH):
+            device_metrics.publish(snapshot)
+            per_device_metrics.publish(device_snapshot)
+
+    def _refresh_all_devices(self, df, soft_patches):
+        with self._table_lock:
+            self.device_table.replace_all(df)
+            self.rollup_counts = {}
+            with instrumentation.stage(instrumentation.STAGE_AGGREGATE):
+                # every rollup (client version, platform, tracking, locked and any configured ones) in one pass
+                self._apply_rollups(self.rollup_engine.run(df), 1)
+            return self._build_snapshots(self.device_table.df, soft_patches)
+
+    def _refresh_changed_devices(self, frames, soft_patches):
+        with self._table_lock:
+            with instrumentation.stage(instrumentation.STAGE_AGGREGATE):
+                for client_ids, df in frames:
+                    # take away what the devices counted for before, and add what they count for now
+                    old_rows, new_rows = self.device_table.update(client_ids, df)
+                    self._apply_rollups(self.rollup_engine.run(old_rows), -1)
+                    self._apply_rollups(self.rollup_engine.run(new_rows), 1)
+            return self._build_snapshots(self.device_table.df, soft_patches)
+
+    def _build_snapshots(self, df, soft_patches):
+        # built up off to the side, only published once it's complete
+        snapshot = device_metrics.new_snapshot()
+        device_snapshot = per_device_metrics.new_snapshot()
+
+        now = datetime.datetime.now(timezone.utc)
+
+        with instrumentation.stage(instrumentation.STAGE_AGGREGATE):
+            self._publish_rollups(snapshot)
+
+            # on a big fleet only some devices get their own model number series, picked by outstanding critical patches
+            known_ids = df["Client_filewave_id"].dropna()
+            scores = dict(zip(known_ids.tolist(), soft_patches.get_perdevice_totals_not_completed(known_ids, True).tolist()))
+            kept = self.governor.select("per_device_modelnum", scores)
+
+            # the per device checks below expect missing values as None, not NaN
+            rows = df.astype(object).where(df.notna(), None)
+            device_names = rows["Client_device_name"]
+            last_check_in = rows["Client_last_check_in"]
+            client_fw_ids = rows["Client_filewave_id"]
+
+            # if there is no last check in date, we want to assume it's NEVER checked in
+            checkin_days = age_in_days(last_check_in, now, missing_days=999)
+
+            # for devices with a filewave_id, devices without one count as having nothing outstanding
+            ids = df["Client_filewave_id"]
+            for i in np.flatnonzero(ids.isna().to_numpy()):
+                logger.warning(f"one of the device records doesn't have a client_fw_id; the json data is: {tuple(rows.iloc[i])}")
+            total_crit = soft_patches.get_perdevice_totals_not_completed(ids, True)
+            total_normal = soft_patches.get_perdevice_totals_not_completed(ids, False)
+
+            # If we have a model number, store it in the metrics
+            for device_name, client_fw_id, fw_model_number in zip(device_names, client_fw_ids, rows["DesktopClient_filewave_model_number"]):
+                # a model number can't be added up, so devices that were left out have no 'Other' series here
+                if kept is None or client_fw_id in kept:
+                    device_snapshot.set(device_client_modelnumber, [device_name], fw_model_number if fw_model_number is not None else 0)
+
+            # every device is evaluated in one go, rather than a ClientCompliance per row
+            comp_check = ClientComplianceBatch(
+                last_check_in,
+                rows["Client_total_disk_space"],
+                rows["Client_free_disk_space"],
+                checkin_days,
+                total_crit,
+                total_normal
+            )
+            states = comp_check.get_compliance_state()
+
+            if logger.isEnabledFor(logging.DEBUG):
+                checkin_states = comp_check.get_checkin_compliance()
+                disk_states = comp_check.get_disk_compliance()
+                patch_states = comp_check.get_patch_compliance()
+                for i in np.flatnonzero((rows["OperatingSystem_name"] == "Chrome OS").to_numpy()):
+                    v = rows.iloc[i]
+                    logger.debug(f"state {ClientCompliance.get_compliance_state_str(states[i])} found for name: {v['Client_device_name']},\
+last check in: {v['Client_last_check_in']},\
+total disk: {v['Client_total_disk_space']},\
+free disk: {v['Client_free_disk_space']},\
+checkin days: {checkin_days[i]},\
+total crit/noral: {total_crit[i]}/{total_normal[i]},\
+checkin compliance: {checkin_states[i]}, disk compliance: {disk_states[i]}, patch compliance: {patch_states[i]}")
+                    logger.debug("\r\n")
+
+            device_count_by_compliance = np.bincount(states, minlength=ClientCompliance.STATE_ERROR + 1)
+            for key in [ClientCompliance.STATE_OK, ClientCompliance.STATE_ERROR, ClientCompliance.STATE_WARNING, ClientCompliance.STATE_UNKNOWN]:
+                snapshot.set(device_client_compliance, [ClientCompliance.get_compliance_state_str(key)], device_count_by_compliance[key])
+
+            snapshot.set(device_checkin_days, ['Less than 1'], np.count_nonzero(checkin_days <= 1))
+            snapshot.set(device_checkin_days, ['Less than 7'], np.count_nonzero((checkin_days > 1) & (checkin_days < 7)))
+            snapshot.set(device_checkin_days, ['Less than 30'], np.count_nonzero((checkin_days >= 7) & (checkin_days < 30)))
+            snapshot.set(device_checkin_days, ['More than 30'], np.count_nonzero(checkin_days >= 30))
+
+        # the metric families are built here too, publishing them on the event loop is then just a swap
+        with instrumentation.stage(instrumentation.STAGE_PUBLISH):
+            return device_metrics.prepare(snapshot), per_device_metrics.prepare(device_snapshot)
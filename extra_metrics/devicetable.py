@@ -0,0 +1,71 @@
+import threading
+import pandas as pd
+
+
+def client_ids_from_event(topic, payload):
+    '''
+    Picks the filewave_id(s) of the devices a /client/... event is about out of its payload (or the
+    topic, e.g. /client/123/...); returns an empty list when the event doesn't say.
+    '''
+    if isinstance(payload, dict):
+        for key in ("filewave_ids", "filewave_id", "client_ids", "client_id", "ids", "id"):
+            if key in payload:
+                return client_ids_from_event(None, payload[key])
+    elif isinstance(payload, list):
+        return [client_id for item in payload for client_id in client_ids_from_event(None, item)]
+    elif isinstance(payload, bool):
+        pass
+    elif isinstance(payload, int) or (isinstance(payload, str) and payload.isdigit()):
+        return [int(payload)]
+
+    if topic is not None:
+        return [int(part) for part in topic.split("/") if part.isdigit()]
+    return []
+
+
+class DeviceTable:
+    """
+    The client info of every device as of the last full query, kept up to date in between by
+    re-querying only the devices the FileWave server told us about (see mark_dirty).
+    """
+    def __init__(self, id_column="Client_filewave_id"):
+        self.id_column = id_column
+        self.df = None
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def is_loaded(self):
+        return self.df is not None
+
+    def mark_dirty(self, client_ids):
+        with self._lock:
+            self._dirty.update(client_ids)
+
+    def take_dirty(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        return sorted(dirty)
+
+    def replace_all(self, df):
+        self.df = df.reset_index(drop=True)
+
+    def rows_for(self, client_ids):
+        if self.df is None:
+            return None
+        return self.df[self.df[self.id_column].isin(client_ids)]
+
+    def update(self, client_ids, df):
+        """
+        Swaps the rows of client_ids for the rows in df (the answer to a query for just those devices);
+        devices that are not in df any more (deleted, archived) are dropped.  Returns the rows that
+        were replaced and the rows that replaced them.
+        """
+        old_rows = self.rows_for(client_ids)
+        kept = self.df[~self.df[self.id_column].isin(client_ids)]
+        new_rows = df[df[self.id_column].isin(client_ids)]
+        if len(new_rows) == 0:
+            self.df = kept.reset_index(drop=True)
+        else:
+            new_rows = new_rows.reindex(columns=kept.columns)
+            self.df = pd.concat([kept, new_rows], ignore_index=True)
+        return old_rows, new_rows
@@ -0,0 +1,219 @@
+import gzip
+import hashlib
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest
+from extra_metrics.logs import logger
+from extra_metrics.snapshot import SnapshotGaugeFamily
+
+# The per device metric families are big and don't need scraping as often as the fleet level rollups,
+# so they live in a registry of their own, which is served on /metrics/devices.
+DEVICE_REGISTRY = CollectorRegistry()
+
+
+class RenderedPage:
+    """
+    One rendering of the snapshot families of a registry; the text exposition format, its gzip'd twin
+    and the validators (ETag/Last-Modified) a scraper can use to ask 'has anything changed?'
+    """
+    def __init__(self, body, rendered_at, key=None):
+        self.body = body
+        self.rendered_at = rendered_at
+        # the snapshot families it was rendered from (see MetricsPage)
+        self.key = key
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.last_modified = formatdate(rendered_at, usegmt=True)
+        # compressed once, rather than by every scrape; scrapers (Prometheus) always ask for gzip
+        self.body_gzip = gzip.compress(body, compresslevel=6)
+
+
+class ScrapedPage:
+    """
+    What one scrape is served; the rendered snapshot families followed by the live families, which are
+    rendered (and compressed, if asked for) for this scrape alone.  A gzip stream can be made of several
+    members, so the compressed snapshot part is sent as is with the live part's own member after it.
+
+    The validators are those of the snapshot part; the live part is always current anyway, so a 304
+    means 'the collected data hasn't changed'.  A page without any snapshot families has none.
+    """
+    def __init__(self, snapshot_page, live_body):
+        self.snapshot_page = snapshot_page
+        self.live_body = live_body
+        has_validators = len(snapshot_page.body) > 0
+        self.etag = snapshot_page.etag if has_validators else None
+        self.last_modified = snapshot_page.last_modified if has_validators else None
+        self.rendered_at = snapshot_page.rendered_at
+
+    def parts(self, use_gzip):
+        if use_gzip:
+            live = [gzip.compress(self.live_body, compresslevel=6)] if len(self.live_body) > 0 else []
+            return [self.snapshot_page.body_gzip] + live
+        return [self.snapshot_page.body, self.live_body]
+
+    @property
+    def body(self):
+        return b"".join(self.parts(False))
+
+
+class _Families:
+    # just enough of a registry for generate_latest to render the given families
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+class MetricsPage:
+    """
+    Renders a registry for scrapers, so a scrape costs about the same no matter how many series the
+    collectors publish.
+
+    The families of published snapshots (SnapshotGaugeFamily) never change, so they're rendered (and
+    gzip'd) once and reused until a collector publishes again; the text of each family is kept too, so
+    only the families of that collector are rendered again.  refresh() is called when a collection
+    finishes, so that's done then rather than by the next scrape.  Everything else (the exporter's own
+    metrics; event loop lag, schedulers, the connection pool, process_*...) is small and rendered on
+    every scrape, so it's always current.
+    """
+    def __init__(self, registry=REGISTRY, clock=time.time):
+        self.registry = registry
+        self.clock = clock
+        self._page = None
+        self._family_text = {}
+        self._lock = threading.Lock()
+
+    def _collect(self):
+        snapshot_families, live_families = [], []
+        for family in self.registry.collect():
+            (snapshot_families if isinstance(family, SnapshotGaugeFamily) else live_families).append(family)
+        return snapshot_families, live_families
+
+    def _snapshot_page(self, families):
+        key = tuple(id(family) for family in families)
+        previous = self._page
+        if previous is not None and previous.key == key:
+            return previous
+
+        with self._lock:
+            previous = self._page
+            if previous is not None and previous.key == key:
+                return previous
+
+            family_text = {}
+            for family in families:
+                cached = self._family_text.get(id(family))
+                if cached is None or cached[0] is not family:
+                    cached = (family, generate_latest(_Families([family])))
+                family_text[id(family)] = cached
+            self._family_text = family_text
+
+            body = b"".join(family_text[id(family)][1] for family in families)
+            if previous is not None and previous.body == body:
+                # keep the validators of the previous rendering if nothing changed, so scrapers still get a 304
+                previous.key = key
+                return previous
+            self._page = RenderedPage(body, self.clock(), key)
+            return self._page
+
+    def refresh(self):
+        """
+        Renders the snapshot families again if any of them was published since the last time, returns
+        that rendering.
+        """
+        snapshot_families, _ = self._collect()
+        return self._snapshot_page(snapshot_families)
+
+    def get(self):
+        snapshot_families, live_families = self._collect()
+        return ScrapedPage(self._snapshot_page(snapshot_families), generate_latest(_Families(live_families)))
+
+
+def _accepts_gzip(accept_encoding):
+    for encoding in accept_encoding.split(','):
+        name, _, params = encoding.partition(';')
+        if name.strip().lower() != 'gzip':
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def _is_not_modified(headers, page):
+    if page.etag is None:
+        return False
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(',')]
+        return '*' in tags or page.etag in tags or ('W/' + page.etag) in tags
+
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since is not None:
+        try:
+            return int(page.rendered_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    # set by make_metrics_handler; maps a url path to the MetricsPage served there
+    pages = {}
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        metrics_page = self.pages.get(path)
+        if metrics_page is None:
+            self.send_error(404)
+            return
+
+        page = metrics_page.get()
+        if _is_not_modified(self.headers, page):
+            self.send_response(304)
+            self._send_validators(page)
+            self.end_headers()
+            return
+
+        use_gzip = _accepts_gzip(self.headers.get('Accept-Encoding', ''))
+        parts = page.parts(use_gzip)
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE_LATEST)
+        self.send_header('Content-Length', str(sum(len(part) for part in parts)))
+        self._send_validators(page)
+        self.send_header('Vary', 'Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        for part in parts:
+            self.wfile.write(part)
+
+    def _send_validators(self, page):
+        if page.etag is not None:
+            self.send_header('ETag', page.etag)
+            self.send_header('Last-Modified', page.last_modified)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics http: " + format % args)
+
+
+def make_metrics_handler(pages):
+    return type('BoundMetricsRequestHandler', (MetricsRequestHandler,), {'pages': dict(pages)})
+
+
+def start_metrics_server(port, pages, addr=''):
+    """
+    Serves the cached pages (a dict of url path -> MetricsPage) from a daemon thread, in place of
+    prometheus_client's start_http_server.
+    """
+    httpd = ThreadingHTTPServer((addr, port), make_metrics_handler(pages))
+    httpd.daemon_threads = True
+    t = threading.Thread(target=httpd.serve_forever, name='metrics-http', daemon=True)
+    t.start()
+    return httpd
@@ -1,9 +1,11 @@
-import requests
 from prometheus_client import Histogram
 from .logs import logger
 from extra_metrics.fwrestendpoint import FWRestEndpoints
 from .queries import query_client_info
+from .schema import build_client_info_query
+from .querystream import QueryResultDecoder
 import json
+import time
 
 
 http_request_time_taken = Histogram('extra_metrics_http_request_time_taken',
@@ -21,12 +23,38 @@ http_request_time_taken_get_software_updates_web = http_request_time_taken.label
 
 
 class FWRestQuery(FWRestEndpoints):
-    def __init__(self, hostname, api_key, verify_tls=True):
-        super().__init__(hostname, api_key, verify_tls)
+    STREAM_CHUNK_BYTES = 64 * 1024
+
+    def __init__(self, hostname, api_key, verify_tls=True, connection_pool=None):
+        super().__init__(hostname, api_key, verify_tls, connection_pool)
+        # every column until the collectors say which ones they read, see set_client_info_columns
+        self.client_info_query = query_client_info
+        self.client_info_columns = None
+
+    def set_client_info_columns(self, columns):
+        self.client_info_columns = list(columns)
+        self.client_info_query = build_client_info_query(columns)
+
+    def _stream_query_result_df(self, r):
+        # the body is decoded as it arrives, rather than loading it all and then building a DataFrame from that
+        try:
+            decoder = QueryResultDecoder()
+            for chunk in r.iter_content(chunk_size=FWRestQuery.STREAM_CHUNK_BYTES):
+                decoder.feed(chunk)
+            decoder.close()
+
+            start = time.perf_counter()
+            df = decoder.to_dataframe()
+            # lets the caller split the time taken into network, decode and DataFrame build
+            df.attrs["payload_bytes"] = decoder.num_bytes
+            df.attrs["decode_seconds"] = decoder.decode_seconds
+            df.attrs["frame_seconds"] = time.perf_counter() - start
+            return df
+        finally:
+            r.close()
 
     def get_definition_for_query_id_j(self, query_id):
-        r = requests.get(self.endpoint_inventory_query_definition(query_id),
-                         headers=self._auth_headers(), verify=self.verify_tls)
+        r = self._get(self.endpoint_inventory_query_definition(query_id))
         self._check_status(r, 'get_definition_for_query_id_j')
         if r.status_code == 200:
             return r.json()
@@ -34,14 +62,22 @@ class FWRestQuery(FWRestEndpoints):
         return None
 
     def get_results_for_query_id(self, query_id):
-        r = requests.get(self.endpoint_inventory_query_results(query_id),
-                         headers=self._auth_headers(), verify=self.verify_tls)
+        r = self._get(self.endpoint_inventory_query_results(query_id))
         self._check_status(r, 'get_results_for_query_id')
         return r
 
+    def get_results_for_query_id_df(self, query_id):
+        r = self._get(self.endpoint_inventory_query_results(query_id), stream=True)
+        self._check_status(r, 'get_results_for_query_id_df')
+        if r.status_code == 200:
+            return self._stream_query_result_df(r)
+
+        r.close()
+        return None
+
     def find_group_with_name(self, group_name):
         # get the group, is it there?
-        r = requests.get(self.endpoint_groups_tree(), headers=self._auth_headers(), verify=self.verify_tls)
+        r = self._get(self.endpoint_groups_tree())
         self._check_status(r, 'find_group_with_name')
         if r.status_code == 200:
             for item in r.json()["groups_hierarchy"]:
@@ -55,13 +91,11 @@ class FWRestQuery(FWRestEndpoints):
         if existing_group is not None:
             return existing_group, False
         group_create_data = json.dumps({"name": group_name})
-        requests.post(self.endpoint_reports_groups(), headers=self._auth_headers(), verify=self.verify_tls,
-            data=group_create_data)
+        self._post(self.endpoint_reports_groups(), data=group_create_data)
         return self.find_group_with_name(group_name), True
 
     def get_all_inventory_queries(self):
-        r = requests.get(self.inventory_query_str('query/'),
-                         headers=self._auth_headers(), verify=self.verify_tls)
+        r = self._get(self.inventory_query_str('query/'))
 
         self._check_status(r, 'get_all_inventory_queries')
         if r.status_code == 200:
@@ -71,17 +105,11 @@ class FWRestQuery(FWRestEndpoints):
 
     def create_inventory_query(self, json_str):
         # just create only, don't validate if it exists....
-        return requests.post(self.inventory_query_str('query/'),
-                             headers=self._auth_headers(),
-                             verify=self.verify_tls,
-                             data=json_str)
+        return self._post(self.inventory_query_str('query/'), data=json_str)
 
     @http_request_time_taken_get_client_info.time()
     def get_client_info_j(self):
-        r = requests.post(self.inventory_query_str('query_result/'),
-                          headers=self._auth_headers(),
-                          verify=self.verify_tls,
-                          data=query_client_info)
+        r = self._post(self.inventory_query_str('query_result/'), data=self.client_info_query)
 
         self._check_status(r, 'get_client_info_j')
         if r.status_code == 200:
@@ -89,11 +117,40 @@ class FWRestQuery(FWRestEndpoints):
 
         return None
 
+    @http_request_time_taken_get_client_info.time()
+    def get_client_info_df(self):
+        r = self._post(self.inventory_query_str('query_result/'), data=self.client_info_query, stream=True)
+
+        self._check_status(r, 'get_client_info_df')
+        if r.status_code == 200:
+            return self._stream_query_result_df(r)
+
+        r.close()
+        return None
+
+    @http_request_time_taken_get_client_info.time()
+    def get_client_info_for_ids_df(self, filewave_ids):
+        # the same columns as get_client_info_df, but only for these devices
+        query = build_client_info_query(self.client_info_columns, filewave_ids=filewave_ids)
+        r = self._post(self.inventory_query_str('query_result/'), data=query, stream=True)
+
+        self._check_status(r, 'get_client_info_for_ids_df')
+        if r.status_code == 200:
+            return self._stream_query_result_df(r)
+
+        r.close()
+        return None
+
     @http_request_time_taken_get_software_updates_web.time()
     def get_software_updates_web_ui_j(self):
-        r = requests.get(self.endpoint_web_software_update(), headers=self._auth_headers(), verify=self.verify_tls)
+        r = self._get(self.endpoint_web_software_update())
         self._check_status(r, 'get_software_updates_web_ui_j')
         if r.status_code == 200:
             return r.json()
 
         return None
+
+    def get_software_updates_web_ui_page(self, limit, offset):
+        r = self._get(self.endpoint_web_software_update(limit, offset))
+        self._check_status(r, 'get_software_updates_web_ui_page')
+        return r
@@ -0,0 +1,193 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from extra_metrics import instrumentation
+from extra_metrics.definitioncache import DefinitionCache
+from extra_metrics import responsecache
+from extra_metrics.responsecache import CycleResponseCache
+
+
+class SoftwareUpdatePageError(Exception):
+    """
+    A page of the software updates list couldn't be fetched; the list is incomplete, so whatever was
+    worked out from the other pages mustn't be published.
+    """
+    pass
+
+
+class AsyncFWRestQuery:
+    """
+    The asyncio twin of FWRestQuery - it has the same method surface, but every method is a coroutine.
+
+    The blocking calls of the wrapped query object are run on a small, dedicated pool of threads so
+    the event loop (and therefore the ZMQ event subscriber) keeps running while a request is in flight.
+    Because the wrapped FWRestQuery shares its keep-alive connection pool, the number of worker threads
+    should match the size of that pool.
+
+    The read-only data queries are answered from a response cache; the one of the collector run in
+    progress (see DagExecutor and responsecache.use) so that it and the collectors waiting on it share
+    one request and one payload.  Outside of a run there's a cache of its own, call new_cycle() to
+    forget what it holds.
+
+    If a DefinitionCache is given, the groups tree, the list of queries and the query definitions are
+    served from it across cycles - see MainRuntime.event_callback for how it's invalidated.
+    """
+    def __init__(self, fw_query, max_workers=10, response_cache=None, definition_cache=None):
+        self.fw_query = fw_query
+        self.response_cache = response_cache if response_cache is not None else CycleResponseCache()
+        self.definition_cache = definition_cache
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fw-rest')
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def _call(self, method_name, *args):
+        # look the method up at call time, so mocked methods on the wrapped object are honoured
+        return await self._run(getattr(self.fw_query, method_name), *args)
+
+    async def _fetch(self, method_name, *args):
+        with instrumentation.stage(instrumentation.STAGE_FETCH):
+            return await self._call(method_name, *args)
+
+    async def _fetch_df(self, method_name, *args):
+        start = time.perf_counter()
+        df = await self._call(method_name, *args)
+        if df is not None:
+            # the payload is decoded while it streams in, take the decode/frame time out of the fetch time
+            decode_seconds = df.attrs.get("decode_seconds", 0)
+            frame_seconds = df.attrs.get("frame_seconds", 0)
+            fetch_seconds = time.perf_counter() - start - decode_seconds - frame_seconds
+            instrumentation.observe_stage(instrumentation.STAGE_FETCH, max(fetch_seconds, 0))
+            instrumentation.observe_stage(instrumentation.STAGE_DECODE, decode_seconds)
+            instrumentation.observe_stage(instrumentation.STAGE_FRAME, frame_seconds)
+            instrumentation.add_payload_bytes(df.attrs.get("payload_bytes", 0))
+        return df
+
+    def _response_cache(self):
+        cache = responsecache.current()
+        return cache if cache is not None else self.response_cache
+
+    async def _cached_call(self, method_name, *args):
+        # only the caller that actually fetches the data has it counted in its stats
+        return await self._response_cache().get_or_fetch(method_name, args, lambda: self._fetch(method_name, *args))
+
+    async def _cached_df_call(self, method_name, *args):
+        return await self._response_cache().get_or_fetch(method_name, args, lambda: self._fetch_df(method_name, *args))
+
+    async def _definition_call(self, key, method_name, *args):
+        if self.definition_cache is None:
+            return await self._call(method_name, *args)
+        value = self.definition_cache.get(key)
+        if value is None:
+            value = await self._call(method_name, *args)
+            self.definition_cache.put(key, value)
+        return value
+
+    def new_cycle(self):
+        self.response_cache.new_cycle()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    async def get_current_fw_version_major_minor_patch(self):
+        return await self._call('get_current_fw_version_major_minor_patch')
+
+    async def get_definition_for_query_id_j(self, query_id):
+        return await self._definition_call(DefinitionCache.key_for_definition(query_id),
+                                           'get_definition_for_query_id_j', query_id)
+
+    async def get_results_for_query_id(self, query_id):
+        return await self._cached_call('get_results_for_query_id', query_id)
+
+    async def get_results_for_query_id_df(self, query_id):
+        return await self._cached_df_call('get_results_for_query_id_df', query_id)
+
+    async def find_group_with_name(self, group_name):
+        return await self._definition_call(DefinitionCache.key_for_group(group_name),
+                                           'find_group_with_name', group_name)
+
+    async def ensure_inventory_query_group_exists(self, group_name):
+        if self.definition_cache is not None:
+            group = self.definition_cache.get(DefinitionCache.key_for_group(group_name))
+            if group is not None:
+                return group, False
+
+        group, was_created = await self._call('ensure_inventory_query_group_exists', group_name)
+        if self.definition_cache is not None:
+            self.definition_cache.put(DefinitionCache.key_for_group(group_name), group)
+        return group, was_created
+
+    async def get_all_inventory_queries(self):
+        return await self._definition_call(DefinitionCache.KEY_QUERIES, 'get_all_inventory_queries')
+
+    async def create_inventory_query(self, json_str):
+        r = await self._call('create_inventory_query', json_str)
+        if self.definition_cache is not None:
+            self.definition_cache.invalidate(DefinitionCache.KEY_QUERIES)
+        return r
+
+    async def get_client_info_j(self):
+        return await self._cached_call('get_client_info_j')
+
+    async def get_client_info_df(self):
+        return await self._cached_df_call('get_client_info_df')
+
+    async def get_client_info_for_ids_df(self, filewave_ids):
+        # not cached, the whole point is to see the latest state of these devices
+        return await self._fetch_df('get_client_info_for_ids_df', list(filewave_ids))
+
+    async def get_software_updates_web_ui_j(self):
+        return await self._cached_call('get_software_updates_web_ui_j')
+
+    async def _get_software_updates_page(self, limit, offset):
+        with instrumentation.stage(instrumentation.STAGE_FETCH):
+            r = await self._call('get_software_updates_web_ui_page', limit, offset)
+        if r.status_code != 200:
+            raise SoftwareUpdatePageError(f"the software updates page at offset {offset} failed, status code: {r.status_code}")
+        # decode on the worker thread too, these pages can be big
+        with instrumentation.stage(instrumentation.STAGE_DECODE):
+            j = await self._run(r.json)
+        instrumentation.add_payload_bytes(len(r.content))
+        return j, len(r.content)
+
+    async def iter_software_updates_pages(self, page_size, max_concurrency):
+        """
+        Yields (page, num_bytes) for every page of the software updates extended list.  The first page
+        tells us how many updates there are, the remaining pages are then fetched concurrently - but no
+        more than max_concurrency at a time - and are yielded in the order they complete.
+
+        Raises SoftwareUpdatePageError if any page fails, or if a page other than the last has fewer
+        than page_size updates (the server capped the page size, or the list moved between pages; either
+        way some updates would be missed); the pages still in flight are then cancelled.
+        """
+        first_page = await self._get_software_updates_page(page_size, 0)
+        total = first_page[0].get("count")
+        if total is None:
+            # an unpaginated response, everything was in the first page
+            yield first_page
+            return
+
+        def check_page(page, offset):
+            results = page[0].get("results")
+            if offset + page_size < total and results is not None and len(results) < page_size:
+                raise SoftwareUpdatePageError(f"the software updates page at offset {offset} has {len(results)} updates "
+                                              f"rather than {page_size}, updates would be missed")
+            return page
+
+        yield check_page(first_page, 0)
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def fetch_page(offset):
+            async with semaphore:
+                return check_page(await self._get_software_updates_page(page_size, offset), offset)
+
+        pending = [asyncio.ensure_future(fetch_page(offset)) for offset in range(page_size, total, page_size)]
+        try:
+            for next_page in asyncio.as_completed(pending):
+                yield await next_page
+        finally:
+            for task in pending:
+                task.cancel()
@@ -1,17 +1,112 @@
 import re
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from urllib3.util.retry import Retry
+from prometheus_client.metrics_core import CounterMetricFamily, GaugeMetricFamily
 from .logs import logger
 
 
+class FWConnectionPool:
+    """
+    Keeps one requests.Session per scheme/host/port so that every call made against the FileWave server
+    re-uses a kept-alive (TLS) connection rather than paying for a new handshake each time.
+
+    The pool also acts as a prometheus collector, reporting how many connections were opened and how
+    many requests were sent over them - register it with a REGISTRY to expose those numbers.
+    """
+    def __init__(self, pool_size=10, max_retries=3, backoff_factor=0.5):
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _create_session(self):
+        retry = Retry(total=self.max_retries,
+                      backoff_factor=self.backoff_factor,
+                      status_forcelist=(502, 503, 504),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def session_for(self, url):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._create_session()
+                self._sessions[key] = session
+            return session
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+    def connection_stats(self):
+        # num_connections / num_requests are kept by each urllib3 connection pool for us
+        stats = []
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for (scheme, hostname, port), session in sessions:
+            opened = 0
+            sent = 0
+            adapter = session.get_adapter(f"{scheme}://{hostname}")
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    opened += pool.num_connections
+                    sent += pool.num_requests
+            if port is None:
+                port = 443 if scheme == 'https' else 80
+            stats.append((f"{hostname}:{port}", opened, sent))
+        return stats
+
+    def collect(self):
+        connections = CounterMetricFamily('extra_metrics_http_connections_opened',
+                                          'number of connections opened to the FileWave server',
+                                          labels=['host'])
+        requests_sent = CounterMetricFamily('extra_metrics_http_requests_sent',
+                                            'number of requests sent to the FileWave server',
+                                            labels=['host'])
+        per_connection = GaugeMetricFamily('extra_metrics_http_requests_per_connection',
+                                           'average number of requests sent per opened connection, higher is better',
+                                           labels=['host'])
+        for host, opened, sent in self.connection_stats():
+            connections.add_metric([host], opened)
+            requests_sent.add_metric([host], sent)
+            per_connection.add_metric([host], sent / opened if opened else 0)
+        yield connections
+        yield requests_sent
+        yield per_connection
+
+
 class FWRestEndpoints:
-    def __init__(self, hostname, api_key, verify_tls):
+    def __init__(self, hostname, api_key, verify_tls, connection_pool=None):
         self.hostname = hostname
         self.api_key = api_key
         self.verify_tls = verify_tls
+        self.connection_pool = connection_pool if connection_pool is not None else FWConnectionPool()
         self.major_version = 0
         self.minor_version = 0
         self.patch_version = 0
 
+    def _get(self, url, **kwargs):
+        return self.connection_pool.session_for(url).get(url, headers=self._auth_headers(),
+                                                         verify=self.verify_tls, **kwargs)
+
+    def _post(self, url, data, **kwargs):
+        return self.connection_pool.session_for(url).post(url, headers=self._auth_headers(),
+                                                          verify=self.verify_tls, data=data, **kwargs)
+
     def _check_status(self, r, method_name):
         if r.status_code != 200:
             logger.warning(f"{method_name}, status: {r.status_code}, {r}")
@@ -46,7 +141,7 @@ class FWRestEndpoints:
 
     def get_current_fw_version_major_minor_patch(self):
         # uses /api/config/app to get version information - format is "app_version": "14.0.0<-something>"
-        r = requests.get(self.web_query_str('config/app'), headers=self._auth_headers(), verify=self.verify_tls)
+        r = self._get(self.web_query_str('config/app'))
         self._check_status(r, 'get_current_fw_version')
 
         j_value = r.json()
@@ -77,10 +172,12 @@ class FWRestEndpoints:
             uri = 'reports/v1/groups'  # yes, no slash on end
         return self.web_query_str(uri)
 
-    def endpoint_web_software_update(self):
-        uri = 'updates/extended_list/?limit=10000'
+    def endpoint_web_software_update(self, limit=10000, offset=None):
+        uri = f'updates/extended_list/?limit={limit}'
         if self.is_version_at_least(14, 2, 0):
-            uri = 'updates/v1/extended-list?limit=10000'
+            uri = f'updates/v1/extended-list?limit={limit}'
+        if offset is not None:
+            uri += f'&offset={offset}'
         return self.web_query_str(uri)
 
     def endpoint_inventory_query_definition(self, query_id):
@@ -0,0 +1,156 @@
+import asyncio
+import contextlib
+import contextvars
+import resource
+import sys
+import time
+from prometheus_client import Gauge, Histogram
+
+STAGE_FETCH = "fetch"
+STAGE_DECODE = "decode"
+STAGE_FRAME = "frame"
+STAGE_AGGREGATE = "aggregate"
+STAGE_PUBLISH = "publish"
+
+collector_stage_time_taken = Histogram('extra_metrics_collector_stage_seconds',
+                                       'time taken by each stage of a collector; fetch (network), decode (json), frame (DataFrame build), aggregate (rollups, per row loops) and publish',
+                                       ['collector', 'stage'],
+                                       buckets=(.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, float("inf")))
+
+collector_rows = Gauge('extra_metrics_collector_rows',
+                       'number of rows (devices, updates, query results) processed by the last run of a collector',
+                       ['collector'])
+
+collector_payload_bytes = Gauge('extra_metrics_collector_payload_bytes',
+                                'number of bytes fetched from the FileWave server by the last run of a collector',
+                                ['collector'])
+
+collector_peak_memory_bytes = Gauge('extra_metrics_collector_peak_memory_bytes',
+                                    'peak resident memory of the process during the last run of a collector',
+                                    ['collector'])
+
+collector_last_success = Gauge('extra_metrics_collector_last_success_timestamp_seconds',
+                               'unix time of the last run of a collector that finished without an error',
+                               ['collector'])
+
+event_loop_lag = Gauge('extra_metrics_event_loop_lag_seconds',
+                       'how much later than asked the event loop last woke up a sleeping task; a busy loop is late forwarding FileWave events and answering scrapes')
+
+event_loop_lag_time_taken = Histogram('extra_metrics_event_loop_lag',
+                                      'how much later than asked the event loop woke up a sleeping task, measured several times a second',
+                                      buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, float("inf")))
+
+# the stats of the collector running in the current asyncio task (tasks inherit it from their parent)
+_current_stats = contextvars.ContextVar('extra_metrics_collection_stats', default=None)
+
+# the number of collector runs in progress; the high water mark is only reset when the first one starts
+_active_collections = 0
+
+
+def _reset_peak_memory():
+    # Linux lets a process reset its high water mark, which makes the peak 'per run' rather than 'ever'
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _read_peak_memory():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # no /proc, fall back to the peak over the lifetime of the process
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class CollectionStats:
+    """
+    What one run of a collector did; the time per stage, rows processed and bytes fetched.
+    """
+    def __init__(self, collector):
+        self.collector = collector
+        self.rows = 0
+        self.payload_bytes = 0
+        self.stage_seconds = {}
+
+    def observe(self, stage, seconds):
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0) + seconds
+        collector_stage_time_taken.labels(self.collector, stage).observe(seconds)
+
+
+@contextlib.contextmanager
+def collection(collector):
+    """
+    Wraps one run of a collector; everything that runs inside it (including tasks started from it)
+    reports its stages/rows/bytes to this run.  The gauges are set when the run ends.
+
+    Collectors can run side by side and the high water mark is the process's, so it's only reset when
+    no other collector is running; the peak memory then covers the whole of this run (and possibly a
+    little before it, since the first of the collectors running alongside it started).
+    """
+    global _active_collections
+    stats = CollectionStats(collector)
+    token = _current_stats.set(stats)
+    if _active_collections == 0:
+        _reset_peak_memory()
+    _active_collections += 1
+    try:
+        yield stats
+        collector_last_success.labels(collector).set_to_current_time()
+    finally:
+        _active_collections -= 1
+        _current_stats.reset(token)
+        collector_rows.labels(collector).set(stats.rows)
+        collector_payload_bytes.labels(collector).set(stats.payload_bytes)
+        collector_peak_memory_bytes.labels(collector).set(_read_peak_memory())
+
+
+def current_stats():
+    return _current_stats.get()
+
+
+@contextlib.contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def observe_stage(name, seconds):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.observe(name, seconds)
+
+
+def add_rows(count):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.rows += count
+
+
+def add_payload_bytes(count):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.payload_bytes += count
+
+
+async def monitor_event_loop_lag(interval_seconds=0.25, clock=time.perf_counter):
+    """
+    Runs forever; sleeps for interval_seconds and records how late it woke up.  Anything that hogs
+    the event loop (e.g. pandas work done on the loop rather than in the compute pool) shows up here.
+    """
+    while True:
+        start = clock()
+        await asyncio.sleep(interval_seconds)
+        lag = max(0.0, clock() - start - interval_seconds)
+        event_loop_lag.set(lag)
+        event_loop_lag_time_taken.observe(lag)
@@ -1,17 +1,29 @@
-from prometheus_client import start_http_server
+from prometheus_client import REGISTRY
 from extra_metrics.logs import logger, init_logging
 from extra_metrics.scripts import log_config_summary
-from periodic import Periodic
 import pandas as pd
 import asyncio
+import functools
 import json
 
-from extra_metrics.application import ApplicationQueryManager
-from extra_metrics.softwarepatches import SoftwarePatchStatus
-from extra_metrics.devices import PerDeviceStatus
+from extra_metrics.application import ApplicationQueryManager, application_metrics
+from extra_metrics.cardinality import CardinalityGovernor
+from extra_metrics.softwarepatches import SoftwarePatchStatus, software_patch_metrics, software_patch_device_metrics
+from extra_metrics.devices import PerDeviceStatus, device_metrics, per_device_metrics
+from extra_metrics.devicetable import client_ids_from_event
+from extra_metrics.rollup import RollupDimension
 from extra_metrics.fwrest import FWRestQuery
+from extra_metrics.fwrest_async import AsyncFWRestQuery
+from extra_metrics.fwrestendpoint import FWConnectionPool
+from extra_metrics.definitioncache import DefinitionCache, query_ids_from_event
+from extra_metrics.responsecache import CycleResponseCache
+from extra_metrics.exposition import DEVICE_REGISTRY, MetricsPage, start_metrics_server
 from extra_metrics.fw_zmq_eventsub import ZMQConnector
+from extra_metrics.instrumentation import monitor_event_loop_lag
+from extra_metrics.scheduler import CollectionScheduler, CollectorJob, DagExecutor
+from extra_metrics.snapshotstore import SnapshotStore
 from extra_metrics.config import ExtraMetricsConfiguration, read_config_helper
+from extra_metrics.workers import ComputePool
 
 # TODO: to make associations clickable, direct users into the extra-metrics program, have that inject a real FW query on the fly and then redirect to that.
 
@@ -36,25 +48,116 @@ pd.set_option('display.expand_frame_repr', False)
 class MainRuntime:
     def __init__(self, logger):
         self.cfg = None
+        self.connection_pool = None
+        self.fw_query = None
+        self.fw_query_async = None
+        self.definition_cache = None
         self.zmq_sub = None
         self.app_qm = None
         self.software_patches = None
         self.per_device = None
         self.logger = logger
-        self.rerun_data_collection = True
+        self.metrics_page = None
+        self.device_metrics_page = None
+        self.dag = None
+        self.schedulers = []
+        self.compute = None
+        self.snapshot_store = None
 
     def init_services(self):
         self.cfg = ExtraMetricsConfiguration()
         read_config_helper(self.cfg)
 
+        self.connection_pool = FWConnectionPool(
+            pool_size=self.cfg.get_http_pool_size(),
+            max_retries=self.cfg.get_http_max_retries(),
+            backoff_factor=self.cfg.get_http_backoff_factor())
+        REGISTRY.register(self.connection_pool)
+
+        # the published snapshots are rendered once, when a collector finishes; the rest on every scrape
+        self.metrics_page = MetricsPage(REGISTRY)
+        self.device_metrics_page = MetricsPage(DEVICE_REGISTRY)
+
+        # what was being served before a restart is served again until the collectors have caught up
+        self.snapshot_store = SnapshotStore(self.cfg.get_snapshot_file(), {
+            "applications": application_metrics,
+            "software_patches": software_patch_metrics,
+            "software_patch_devices": software_patch_device_metrics,
+            "devices": device_metrics,
+            "per_device": per_device_metrics
+        }, max_age_seconds=self.cfg.get_snapshot_max_age_seconds())
+        self.snapshot_store.load()
+        REGISTRY.register(self.snapshot_store)
+
         self.fw_query = FWRestQuery(
             hostname=self.cfg.get_fw_api_server_hostname(),
             api_key=self.cfg.get_fw_api_key(),
-            verify_tls=self.cfg.get_verify_tls())
+            verify_tls=self.cfg.get_verify_tls(),
+            connection_pool=self.connection_pool)
+
+        self.definition_cache = DefinitionCache(
+            path=self.cfg.get_definition_cache_file(),
+            ttl_seconds=self.cfg.get_definition_cache_ttl_seconds())
+        self.definition_cache.load()
+
+        # the collectors await the async twin, so the event loop keeps running while they wait on the server
+        self.fw_query_async = AsyncFWRestQuery(self.fw_query,
+                                               max_workers=self.cfg.get_http_pool_size(),
+                                               definition_cache=self.definition_cache)
+
+        self.app_qm = ApplicationQueryManager(self.fw_query_async,
+                                              max_concurrency=self.cfg.get_app_query_concurrency())
+        # the pandas work of the collectors happens off the event loop
+        self.compute = ComputePool(max_workers=self.cfg.get_compute_workers())
+
+        # the budget for the per device series is shared by the software patch and device collectors
+        governor = CardinalityGovernor(max_devices=self.cfg.get_device_series_limit(),
+                                       shard_count=self.cfg.get_device_series_shard_count(),
+                                       shard_index=self.cfg.get_device_series_shard_index())
+        self.software_patches = SoftwarePatchStatus(self.fw_query_async,
+                                                    page_size=self.cfg.get_software_update_page_size(),
+                                                    max_concurrency=self.cfg.get_software_update_page_concurrency(),
+                                                    governor=governor,
+                                                    compute=self.compute)
+        self.per_device = PerDeviceStatus(self.fw_query_async, governor=governor, compute=self.compute,
+                                          rollup_processes=self.cfg.get_rollup_processes(),
+                                          rollups=[RollupDimension(name, columns) for name, columns in self.cfg.get_device_rollups()])
+        # the client info query only asks for the columns these two collectors read
+        self.fw_query.set_client_info_columns(SoftwarePatchStatus.CLIENT_INFO_COLUMNS + self.per_device.client_info_columns())
+
+        # each collector has its own interval and the events that make it run early.
+        # WARNING; the per_device class relies on data collected from software updates, hence the dependency.
+        jobs = [
+            CollectorJob("applications", self.collect_application_data,
+                         interval_seconds=self.cfg.get_collector_polling_delay_seconds("applications"),
+                         topics=["/api/auditlog"]),
+            CollectorJob("software_patches", self.software_patches.collect_patch_data_status,
+                         interval_seconds=self.cfg.get_collector_polling_delay_seconds("software_patches"),
+                         topics=["/server/update_model_finished"]),
+            CollectorJob("devices", lambda: self.per_device.collect_client_data(self.software_patches),
+                         interval_seconds=self.cfg.get_collector_polling_delay_seconds(
+                             "devices", default=ExtraMetricsConfiguration.DEFAULT_DEVICE_RECONCILIATION_SECONDS),
+                         topics=["/server/update_model_finished"],
+                         depends_on=["software_patches"]),
+            # in between the full device queries; only the devices the server told us about are re-queried
+            CollectorJob("device_changes", lambda: self.per_device.collect_changed_devices(self.software_patches),
+                         interval_seconds=self.cfg.get_collector_polling_delay_seconds("device_changes"),
+                         topics=["/client/"]),
+        ]
 
-        self.app_qm = ApplicationQueryManager(self.fw_query)
-        self.software_patches = SoftwarePatchStatus(self.fw_query)
-        self.per_device = PerDeviceStatus(self.fw_query)
+        # each run of a collector has its own responses, shared only with the collectors waiting on it
+        self.dag = DagExecutor(jobs, new_response_cache=CycleResponseCache)
+
+        # data is collected when it's due, or soon after the FileWave server tells us something changed
+        self.schedulers = [
+            CollectionScheduler(
+                job.name,
+                functools.partial(self.run_collector, job.name),
+                interval_seconds=job.interval_seconds,
+                debounce_seconds=self.cfg.get_collection_debounce_seconds(),
+                min_spacing_seconds=self.cfg.get_collection_min_spacing_seconds())
+            for job in jobs
+        ]
 
         self.zmq_sub = ZMQConnector(self.cfg, lambda topic, payload: self.event_callback(topic, payload))
 
@@ -78,24 +181,60 @@ class MainRuntime:
                 logger.info(f"topic: {topic}")
                 logger.info(f"payload: {pretty_print_json}")
 
+        if topic.startswith("/client/"):
+            client_ids = client_ids_from_event(topic, payload)
+            if len(client_ids) > 0:
+                # only these devices are re-queried, the next full query is a while off
+                self.per_device.mark_dirty(client_ids)
+                self.trigger_collectors(topic)
+
+        if topic.startswith("/inventory/inventory_query_changed"):
+            query_ids = query_ids_from_event(payload)
+            logger.info(f"inventory queries changed: {query_ids if query_ids is not None else 'all'}")
+            self.definition_cache.invalidate_queries(query_ids)
+            # the query groups are part of the same tree; a renamed or deleted group mustn't be served until the ttl runs out
+            self.definition_cache.invalidate_groups()
+
         if topic in interesting_topics:
             if topic == "/api/auditlog" and "Report Created" not in payload["message"]:
                 return
 
-            # set a flag in state indicating that the data collection should run imminently
-            logger.info(f"topic {topic} fired; will re-queue data collection")
-            self.rerun_data_collection = True
+            # a new report/query could belong to our group, so the cached list of queries is out of date
+            if topic == "/api/auditlog":
+                self.definition_cache.invalidate_queries([])
 
-    async def validate_and_collect_data(self):
-        self.app_qm.validate_query_definitions()
-        self.app_qm.collect_application_query_results()
+            self.trigger_collectors(topic)
 
-        self.software_patches.collect_patch_data_status()
-        # WARNING; the per_device class relies on data collected from software updates, keep
-        # this order of execution.
-        self.per_device.collect_client_data(self.software_patches)
+    def trigger_collectors(self, topic):
+        # bursts of events are coalesced by the schedulers into a single run of each collector
+        for scheduler in self.schedulers:
+            if self.dag.jobs[scheduler.name].is_triggered_by(topic):
+                logger.info(f"topic {topic} fired; will re-queue {scheduler.name} data collection")
+                scheduler.trigger(topic)
 
-        self.rerun_data_collection = False
+    async def collect_application_data(self):
+        await self.app_qm.validate_query_definitions()
+        await self.app_qm.collect_application_query_results()
+
+    async def refresh_metrics_page(self):
+        # rendering the new snapshots takes a while, keep it off the event loop (and off the next scrape)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.metrics_page.refresh)
+        await loop.run_in_executor(None, self.device_metrics_page.refresh)
+
+    async def save_state(self):
+        # once per collector run and off the event loop; the metrics snapshots and any query definitions
+        # that were fetched or invalidated
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.snapshot_store.save)
+        await loop.run_in_executor(None, self.definition_cache.save)
+
+    async def run_collector(self, name):
+        try:
+            await self.dag.run_job(name)
+        finally:
+            await self.refresh_metrics_page()
+            await self.save_state()
 
 
 async def create_program_and_run_it():
@@ -103,7 +242,12 @@ async def create_program_and_run_it():
 
     prog = MainRuntime(logger)
     prog.init_services()
-    start_http_server(8000)
+    # the per device families are big, they get their own path so they can be scraped less often
+    start_metrics_server(8000, {
+        "/": prog.metrics_page,
+        "/metrics": prog.metrics_page,
+        "/metrics/devices": prog.device_metrics_page
+    })
 
     host = prog.cfg.get_fw_api_server_hostname()
     poll_interval = prog.cfg.get_polling_delay_seconds()
@@ -119,13 +263,7 @@ async def create_program_and_run_it():
         logger.error("Unable to reach FileWave server, aborting...")
         return
 
-    p = Periodic(poll_interval, prog.validate_and_collect_data)
-    await p.start()
-
-    while(True):
-        if prog.rerun_data_collection:
-            await prog.validate_and_collect_data()
-        await asyncio.sleep(1)
+    await asyncio.gather(monitor_event_loop_lag(), *[scheduler.run_forever() for scheduler in prog.schedulers])
 
 
 def serve_and_process():
@@ -136,8 +274,7 @@ async def create_program_and_run_tests():
     init_logging()
     prog = MainRuntime(logger)
     prog.init_services()
-    prog.software_patches.collect_patch_data_status()
-    prog.per_device.collect_client_data(prog.software_patches)
+    await prog.dag.run(["software_patches", "devices"])
 
 
 def run_tests():
@@ -1,10 +1,26 @@
-import pkg_resources
 import json
 
+try:
+    from importlib.resources import files
+except ImportError:
+    # before python 3.9; pkg_resources is slow to import (it scans every installed distribution), so only then
+    files = None
+
 
 def get_package_resource_string(package_path, filename):
+    if files is not None:
+        return files(package_path).joinpath(filename).read_bytes()
+    import pkg_resources
     return pkg_resources.resource_string(package_path, filename)
 
 
 def get_package_resource_json(package_path, filename):
     return json.loads(get_package_resource_string(package_path, filename).decode('utf-8'))
+
+
+def list_package_resources(package_path):
+    # the names of the files in a package directory, e.g. list_package_resources("extra_metrics.dashboards")
+    if files is not None:
+        return sorted(entry.name for entry in files(package_path).iterdir() if entry.is_file())
+    import pkg_resources
+    return pkg_resources.resource_listdir(package_path, "")
@@ -0,0 +1,203 @@
+import codecs
+import json
+import re
+import time
+import pandas as pd
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class QueryResultDecodeError(Exception):
+    pass
+
+
+class QueryResultDecoder:
+    """
+    Incrementally decodes an inventory query_result payload, which has the shape:
+
+        {"offset": 0, "fields": ["Client_device_name", ...], "values": [[...], [...], ...], ...}
+
+    Bytes are fed in as they arrive from the server, each row of "values" is decoded as soon as it
+    is complete and rows are moved into per-column lists every chunk_rows rows.  This means the whole
+    body is never held in memory, nor is a full list-of-lists built before pandas gets the data - the
+    transient overhead is one chunk of rows.
+
+    All other top level keys (offset, total_results, ...) are kept in 'extra'.
+    """
+    _STATE_START = 0
+    _STATE_KEY = 1
+    _STATE_COLON = 2
+    _STATE_VALUE = 3
+    _STATE_ROWS = 4
+    _STATE_DONE = 5
+
+    def __init__(self, chunk_rows=5000):
+        self.chunk_rows = chunk_rows
+        self.fields = None
+        self.columns = None
+        self.extra = {}
+        self.num_rows = 0
+        self.num_bytes = 0
+        # the time spent decoding, as opposed to waiting for the data to arrive
+        self.decode_seconds = 0
+        self._chunk = []
+        self._buffer = ""
+        self._key = None
+        self._state = QueryResultDecoder._STATE_START
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json_decoder = json.JSONDecoder()
+
+    def feed(self, data):
+        start = time.perf_counter()
+        if isinstance(data, bytes):
+            self.num_bytes += len(data)
+            data = self._text_decoder.decode(data)
+        else:
+            self.num_bytes += len(data)
+        self._buffer += data
+        self._parse(final=False)
+        self.decode_seconds += time.perf_counter() - start
+
+    def close(self):
+        start = time.perf_counter()
+        self._buffer += self._text_decoder.decode(b'', final=True)
+        self._parse(final=True)
+        self.decode_seconds += time.perf_counter() - start
+        if self._state != QueryResultDecoder._STATE_DONE:
+            raise QueryResultDecodeError("the query result payload ended before it was complete")
+        if self.fields is None:
+            raise QueryResultDecodeError("the query result payload has no 'fields'")
+        return self
+
+    def to_dataframe(self):
+        if self.columns is None:
+            return pd.DataFrame([], columns=self.fields)
+        # build by position, so duplicate field names survive, then label the columns
+        df = pd.DataFrame(dict(enumerate(self.columns)), copy=False)
+        df.columns = self.fields
+        return df
+
+    def _flush_chunk(self):
+        if len(self._chunk) == 0:
+            return
+        if self.columns is None:
+            self.columns = [[] for _ in self._chunk[0]]
+        for column, values in zip(self.columns, zip(*self._chunk)):
+            column.extend(values)
+        self.num_rows += len(self._chunk)
+        self._chunk = []
+
+    def _decode_value(self, pos, final):
+        # returns (value, end) or None if the buffer doesn't yet hold the complete value
+        try:
+            value, end = self._json_decoder.raw_decode(self._buffer, pos)
+        except json.JSONDecodeError as e:
+            if final:
+                raise QueryResultDecodeError(f"invalid query result payload: {e}")
+            return None
+        # a number at the very end of the buffer might be cut short, wait for what follows it
+        if not final and _WHITESPACE.match(self._buffer, end).end() == len(self._buffer):
+            return None
+        return value, end
+
+    def _decode_batch_of_rows(self, pos):
+        # Decoding row by row costs a Python call per row, so first try to decode every complete row
+        # in the buffer with one call, cut at the last '],'.  That cut can land inside a string or a
+        # nested list of the last row; rather than rely on the batch then not being valid JSON, every
+        # row has to be a list with one value per field - anything else falls back to one row at a time.
+        if self.fields is None:
+            return None
+        cut = self._buffer.rfind('],', pos)
+        if cut < 0:
+            return None
+        try:
+            rows = json.loads('[' + self._buffer[pos:cut + 1] + ']')
+        except json.JSONDecodeError:
+            return None
+        num_fields = len(self.fields)
+        if any(not isinstance(row, list) or len(row) != num_fields for row in rows):
+            return None
+        self._chunk.extend(rows)
+        if len(self._chunk) >= self.chunk_rows:
+            self._flush_chunk()
+        return cut + 2
+
+    def _parse(self, final):
+        pos = 0
+        buf_len = len(self._buffer)
+        while True:
+            pos = _WHITESPACE.match(self._buffer, pos).end()
+            if pos >= buf_len or self._state == QueryResultDecoder._STATE_DONE:
+                break
+            c = self._buffer[pos]
+
+            if self._state == QueryResultDecoder._STATE_START:
+                if c != '{':
+                    raise QueryResultDecodeError("a query result payload must be a JSON object")
+                pos += 1
+                self._state = QueryResultDecoder._STATE_KEY
+
+            elif self._state == QueryResultDecoder._STATE_KEY:
+                if c == '}':
+                    pos += 1
+                    self._state = QueryResultDecoder._STATE_DONE
+                elif c == ',':
+                    pos += 1
+                else:
+                    decoded = self._decode_value(pos, final)
+                    if decoded is None:
+                        break
+                    self._key, pos = decoded
+                    self._state = QueryResultDecoder._STATE_COLON
+
+            elif self._state == QueryResultDecoder._STATE_COLON:
+                if c != ':':
+                    raise QueryResultDecodeError(f"expected ':' after the key {self._key} in a query result payload")
+                pos += 1
+                self._state = QueryResultDecoder._STATE_VALUE
+
+            elif self._state == QueryResultDecoder._STATE_VALUE:
+                if self._key == "values":
+                    if c != '[':
+                        raise QueryResultDecodeError("'values' in a query result payload must be a list")
+                    pos += 1
+                    self._state = QueryResultDecoder._STATE_ROWS
+                else:
+                    decoded = self._decode_value(pos, final)
+                    if decoded is None:
+                        break
+                    value, pos = decoded
+                    if self._key == "fields":
+                        self.fields = value
+                    else:
+                        self.extra[self._key] = value
+                    self._state = QueryResultDecoder._STATE_KEY
+
+            elif self._state == QueryResultDecoder._STATE_ROWS:
+                if c == ']':
+                    pos += 1
+                    self._flush_chunk()
+                    self._state = QueryResultDecoder._STATE_KEY
+                elif c == ',':
+                    pos += 1
+                else:
+                    batch_end = self._decode_batch_of_rows(pos)
+                    if batch_end is not None:
+                        pos = batch_end
+                        continue
+                    decoded = self._decode_value(pos, final)
+                    if decoded is None:
+                        break
+                    row, pos = decoded
+                    self._chunk.append(row)
+                    if len(self._chunk) >= self.chunk_rows:
+                        self._flush_chunk()
+
+        self._buffer = self._buffer[pos:]
+
+
+def decode_query_result(chunks, chunk_rows=5000):
+    decoder = QueryResultDecoder(chunk_rows)
+    for chunk in chunks:
+        decoder.feed(chunk)
+    return decoder.close()
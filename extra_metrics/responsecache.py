@@ -0,0 +1,71 @@
+import asyncio
+import contextlib
+import contextvars
+from prometheus_client import Counter
+
+response_cache_requests = Counter('extra_metrics_response_cache_requests',
+                                  'lookups against the per-cycle response cache, by method and hit/miss',
+                                  ['method', 'result'])
+
+# the cache of the collector run in the current asyncio task (tasks inherit it from their parent)
+_current_cache = contextvars.ContextVar('extra_metrics_response_cache', default=None)
+
+
+class CycleResponseCache:
+    """
+    A single-flight cache of server responses that lives for one collection cycle.
+
+    The first caller for a key starts the request, every other caller (concurrent or later in the
+    same cycle) awaits that same request and receives the same decoded payload - so callers must
+    treat the payload as read-only.  Failed requests (an exception, or None; which is what the query
+    methods return for a non-200 response) are not kept, the next caller will try again.
+    """
+    def __init__(self):
+        self._entries = {}
+
+    def new_cycle(self):
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get_or_fetch(self, method_name, args, fetch):
+        key = (method_name,) + tuple(args)
+        entry = self._entries.get(key)
+        if entry is None:
+            response_cache_requests.labels(method_name, 'miss').inc()
+            entry = asyncio.ensure_future(fetch())
+            self._entries[key] = entry
+        else:
+            response_cache_requests.labels(method_name, 'hit').inc()
+
+        try:
+            # shield; one caller being cancelled must not cancel the request for everyone else
+            result = await asyncio.shield(entry)
+        except Exception:
+            self._forget(key, entry)
+            raise
+        if result is None:
+            # the callers already waiting on it share the failure, later ones try again
+            self._forget(key, entry)
+        return result
+
+    def _forget(self, key, entry):
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+
+
+@contextlib.contextmanager
+def use(cache):
+    """
+    Within the block (and the tasks started from it) the responses are shared through cache.
+    """
+    token = _current_cache.set(cache)
+    try:
+        yield cache
+    finally:
+        _current_cache.reset(token)
+
+
+def current():
+    return _current_cache.get()
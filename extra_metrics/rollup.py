@@ -0,0 +1,164 @@
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from extra_metrics.logs import logger
+
+
+class RollupDimension:
+    """
+    A count of devices grouped by one or more columns of the client info query, e.g.
+    RollupDimension("platform", ["OperatingSystem_name"]) or
+    RollupDimension("platform_version", ["OperatingSystem_name", "OperatingSystem_version"]).
+
+    Like a groupby/count, rows with a missing value in any of the columns are not counted.
+    """
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = list(columns)
+
+    def __repr__(self):
+        return f"RollupDimension({self.name!r}, {self.columns!r})"
+
+
+def _count_codes(codes, sizes):
+    """
+    Counts each combination of codes (one array per column, -1 is a missing value); returns the flat
+    indexes (see np.ravel_multi_index) of the combinations that occur and how often they do.
+    """
+    keep = np.ones(len(codes[0]), dtype=bool)
+    for c in codes:
+        keep &= c >= 0
+
+    # one flat index per row; the first column varies slowest, which keeps the groupby ordering
+    flat = np.ravel_multi_index([c[keep] for c in codes], sizes)
+    num_cells = int(np.prod(sizes))
+    if num_cells <= 4 * len(flat) + 1024:
+        counts = np.bincount(flat, minlength=num_cells)
+        indexes = np.flatnonzero(counts)
+        return indexes, counts[indexes]
+    # too many combinations for a dense count (e.g. several high cardinality columns)
+    return np.unique(flat, return_counts=True)
+
+
+def _count_partition(shm_name, shape, partition, num_partitions, dimensions):
+    """
+    Runs in a worker process; counts the rows of one partition (filewave_id % num_partitions) of the
+    codes in shared memory.  Row 0 is the filewave_id (-1 when missing, those aren't counted), the
+    other rows are the codes of each column.  dimensions is a list of (code rows, sizes).
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = np.ndarray(shape, dtype=np.int64, buffer=shm.buf)
+        ids = data[0]
+        rows = np.flatnonzero((ids >= 0) & (ids % num_partitions == partition))
+        results = [_count_codes([data[r][rows] for r in code_rows], sizes) for code_rows, sizes in dimensions]
+        # the view has to go before the shared memory can be closed
+        del data, ids
+        return results
+    finally:
+        shm.close()
+
+
+class RollupEngine:
+    """
+    Computes every dimension's counts from one pass over the data; each column is factorized once
+    (no matter how many dimensions use it) and each dimension is then a single bincount over the
+    combined codes, rather than a groupby per dimension.
+
+    The results are in the same order a groupby would give them; sorted by the values of the columns.
+
+    With processes > 0, fleets of at least min_partitioned_rows devices are counted by a pool of
+    worker processes instead; the rows are split by filewave_id, each worker counts its own share
+    of the codes (which it reads from shared memory, nothing is pickled but the counts) and the
+    partial counts are added up here.
+    """
+    def __init__(self, dimensions, count_column="Client_filewave_id", processes=0, min_partitioned_rows=200000):
+        self.dimensions = list(dimensions)
+        self.count_column = count_column
+        self.processes = processes
+        self.min_partitioned_rows = min_partitioned_rows
+        self.executor = None
+
+    def _get_executor(self):
+        # started on first use and kept; spawn, as the parent has threads (event loop, compute pool)
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"))
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def run(self, df):
+        """
+        Returns {dimension name: [(tuple of column values, count), ...]}.  Dimensions that refer to a
+        column that isn't in the data are left out (and logged).
+        """
+        dimensions = []
+        for dimension in self.dimensions:
+            missing = [c for c in dimension.columns if c not in df.columns]
+            if len(missing) > 0:
+                logger.warning(f"the rollup {dimension.name} refers to columns that are not in the client info: {missing}")
+                continue
+            dimensions.append(dimension)
+
+        factorized = {}
+        for dimension in dimensions:
+            for column in dimension.columns:
+                if column not in factorized:
+                    factorized[column] = pd.factorize(df[column], sort=True)
+        sizes = {column: max(len(uniques), 1) for column, (_, uniques) in factorized.items()}
+
+        # only rows with a value in the count column are counted, the same as groupby(...)[count_column].count()
+        counted = df[self.count_column].notna().to_numpy() if self.count_column in df.columns else np.ones(len(df), dtype=bool)
+
+        if self.processes > 0 and len(df) >= self.min_partitioned_rows and self.count_column in df.columns:
+            counts = self._count_partitioned(df, dimensions, factorized, sizes)
+        else:
+            codes = {column: np.where(counted, column_codes, -1) for column, (column_codes, _) in factorized.items()}
+            counts = [_count_codes([codes[c] for c in d.columns], [sizes[c] for c in d.columns]) for d in dimensions]
+
+        results = {}
+        for dimension, (indexes, totals) in zip(dimensions, counts):
+            dimension_sizes = [sizes[c] for c in dimension.columns]
+            rows = []
+            for index, count in zip(indexes.tolist(), totals.tolist()):
+                positions = np.unravel_index(index, dimension_sizes)
+                values = tuple(factorized[c][1][p] for c, p in zip(dimension.columns, positions))
+                rows.append((values, int(count)))
+            results[dimension.name] = rows
+        return results
+
+    def _count_partitioned(self, df, dimensions, factorized, sizes):
+        columns = list(factorized.keys())
+        ids = pd.to_numeric(df[self.count_column], errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+
+        shape = (1 + len(columns), len(df))
+        shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+        try:
+            data = np.ndarray(shape, dtype=np.int64, buffer=shm.buf)
+            data[0] = ids
+            for i, column in enumerate(columns):
+                data[1 + i] = factorized[column][0]
+            del data
+
+            work = [([1 + columns.index(c) for c in d.columns], [sizes[c] for c in d.columns]) for d in dimensions]
+            executor = self._get_executor()
+            futures = [executor.submit(_count_partition, shm.name, shape, partition, self.processes, work)
+                       for partition in range(self.processes)]
+            partials = [f.result() for f in futures]
+        finally:
+            shm.close()
+            shm.unlink()
+
+        # add up the partial counts of each dimension
+        counts = []
+        for i in range(len(dimensions)):
+            indexes = np.concatenate([p[i][0] for p in partials])
+            totals = np.concatenate([p[i][1] for p in partials])
+            merged, inverse = np.unique(indexes, return_inverse=True)
+            counts.append((merged, np.bincount(inverse, weights=totals, minlength=len(merged)).astype(np.int64)))
+        return counts
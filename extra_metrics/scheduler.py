@@ -0,0 +1,225 @@
+import asyncio
+import sys
+import time
+import traceback
+from prometheus_client import Counter, Gauge, Histogram
+from extra_metrics import instrumentation, responsecache
+from extra_metrics.logs import logger
+
+scheduler_pending_triggers = Gauge('extra_metrics_scheduler_pending_triggers',
+                                   'number of triggers waiting to be served by the next collection run',
+                                   ['collector'])
+
+scheduler_lag = Histogram('extra_metrics_scheduler_lag_seconds',
+                          'time between the first trigger of a collection run and that run starting',
+                          ['collector'])
+
+scheduler_skipped_triggers = Counter('extra_metrics_scheduler_skipped_triggers',
+                                     'triggers that were coalesced into a collection run that was already pending',
+                                     ['collector'])
+
+scheduler_runs = Counter('extra_metrics_scheduler_runs',
+                         'collection runs started by the scheduler, by the reason of the first trigger',
+                         ['collector', 'reason'])
+
+
+class CollectionScheduler:
+    """
+    Decides when a collection runs; either because it's due (every interval_seconds) or because
+    something triggered it, e.g. a FileWave server event.
+
+    - triggers arriving within debounce_seconds of the first one are coalesced into a single run
+    - there is never more than one run at a time, triggers that arrive during a run queue exactly
+      one follow up run
+    - there are at least min_spacing_seconds between the end of one run and the start of the next
+    """
+    REASON_INTERVAL = "interval"
+
+    def __init__(self, name, collect, interval_seconds, debounce_seconds=10, min_spacing_seconds=60, clock=time.monotonic):
+        self.name = name
+        self.collect = collect
+        self.interval_seconds = interval_seconds
+        self.debounce_seconds = debounce_seconds
+        self.min_spacing_seconds = min_spacing_seconds
+        self.clock = clock
+        self.is_running = False
+        self.last_finished = None
+        self.next_due = clock()
+        self._pending_since = None
+        self._pending_reason = None
+        self._pending_count = 0
+        self._wake = None
+
+    def trigger(self, reason):
+        if self._pending_since is None:
+            self._pending_since = self.clock()
+            self._pending_reason = reason
+        else:
+            scheduler_skipped_triggers.labels(self.name).inc()
+        self._pending_count += 1
+        scheduler_pending_triggers.labels(self.name).set(self._pending_count)
+        if self._wake is not None:
+            self._wake.set()
+
+    def _start_at(self):
+        # a run that's simply due doesn't need to wait for more triggers to come along
+        debounce = 0 if self._pending_reason == CollectionScheduler.REASON_INTERVAL else self.debounce_seconds
+        start_at = self._pending_since + debounce
+        if self.last_finished is not None:
+            start_at = max(start_at, self.last_finished + self.min_spacing_seconds)
+        return start_at
+
+    async def _wait(self, timeout):
+        # sleeps until the timeout passes, or trigger() is called
+        try:
+            await asyncio.wait_for(self._wake.wait(), max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def run_once(self):
+        lag = self.clock() - self._pending_since
+        scheduler_lag.labels(self.name).observe(lag)
+        scheduler_runs.labels(self.name, self._pending_reason).inc()
+        logger.info(f"collection {self.name} starting, triggered by {self._pending_reason} ({self._pending_count} triggers, lag {lag:.1f} sec)")
+
+        self._pending_since = None
+        self._pending_reason = None
+        self._pending_count = 0
+        scheduler_pending_triggers.labels(self.name).set(0)
+
+        self.is_running = True
+        try:
+            await self.collect()
+        except Exception as e:
+            logger.error(f"collection {self.name} failed, {e}")
+            traceback.print_exc(file=sys.stdout)
+        finally:
+            self.is_running = False
+            self.last_finished = self.clock()
+            self.next_due = self.last_finished + self.interval_seconds
+
+    async def run_forever(self):
+        self._wake = asyncio.Event()
+        while True:
+            now = self.clock()
+            if self._pending_since is None:
+                if now >= self.next_due:
+                    self.trigger(CollectionScheduler.REASON_INTERVAL)
+                else:
+                    await self._wait(self.next_due - now)
+                continue
+
+            start_at = self._start_at()
+            if now < start_at:
+                await self._wait(start_at - now)
+                continue
+
+            await self.run_once()
+
+
+class CollectorJob:
+    """
+    Describes one collector; what to run, how often, which FileWave server event topics should
+    trigger it and which other collectors have to run before it.
+    """
+    def __init__(self, name, collect, interval_seconds, topics=None, depends_on=None):
+        self.name = name
+        self.collect = collect
+        self.interval_seconds = interval_seconds
+        self.topics = topics if topics is not None else []
+        self.depends_on = depends_on if depends_on is not None else []
+
+    def is_triggered_by(self, topic):
+        return any(topic.startswith(t) for t in self.topics)
+
+
+class DagExecutor:
+    """
+    Runs collectors while respecting their declared dependencies - independent collectors run
+    concurrently, a collector whose dependency is running (or about to) waits for it to finish.
+
+    If new_response_cache is given, each run of a collector gets a new response cache from it (see
+    responsecache.use), which is shared with the collectors that wait on that run through depends_on;
+    a collector that runs twice never gets the responses of its previous run back.
+    """
+    def __init__(self, jobs, new_response_cache=None):
+        self.jobs = {job.name: job for job in jobs}
+        self.new_response_cache = new_response_cache
+        self._active = {}
+        self._response_caches = {}
+        self.order = self._topological_order()
+
+    def _topological_order(self):
+        order = []
+        visiting = set()
+
+        def visit(name, path):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"collector dependencies have a cycle: {' -> '.join(path + [name])}")
+            if name not in self.jobs:
+                raise ValueError(f"collector {path[-1]} depends on {name}, which doesn't exist")
+            visiting.add(name)
+            for dep in self.jobs[name].depends_on:
+                visit(dep, path + [name])
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.jobs:
+            visit(name, [])
+        return order
+
+    def is_active(self, name):
+        return name in self._active
+
+    def _response_cache_for(self, name):
+        # the responses of a dependency's run are shared with the collectors waiting on it, and only them
+        for dep in self.jobs[name].depends_on:
+            if dep in self._response_caches:
+                return self._response_caches[dep]
+        return self.new_response_cache() if self.new_response_cache is not None else None
+
+    async def run_job(self, name, after=()):
+        # if this collector is already waiting/running, share that run rather than starting another
+        if name in self._active:
+            return await asyncio.shield(self._active[name])
+
+        future = asyncio.get_running_loop().create_future()
+        self._active[name] = future
+        self._response_caches[name] = self._response_cache_for(name)
+        try:
+            waits = [self._active[dep] for dep in self.jobs[name].depends_on if dep in self._active]
+            # a failed dependency is logged by whoever ran it; carry on with the data we have
+            await asyncio.gather(*[asyncio.shield(w) for w in waits + list(after)], return_exceptions=True)
+            with instrumentation.collection(name), responsecache.use(self._response_caches[name]):
+                await self.jobs[name].collect()
+            future.set_result(None)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._active[name]
+            del self._response_caches[name]
+            # mark the outcome as retrieved, so asyncio doesn't complain about an unobserved exception
+            if not future.cancelled():
+                future.exception()
+
+    async def run(self, names=None):
+        """
+        Runs the named collectors (default is all of them) concurrently, in dependency order.
+        """
+        names = self.order if names is None else [n for n in self.order if n in names]
+        tasks = {}
+        for name in names:
+            after = [tasks[dep] for dep in self.jobs[name].depends_on if dep in tasks]
+            tasks[name] = asyncio.ensure_future(self.run_job(name, after))
+
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for name, result in zip(tasks.keys(), results):
+            if isinstance(result, Exception):
+                logger.error(f"collector {name} failed, {result}")
@@ -0,0 +1,60 @@
+import json
+from extra_metrics.logs import logger
+from extra_metrics.queries import query_client_info
+
+'''
+Query results name their columns <component>_<column>, e.g. Client_last_check_in, in the order of the
+"fields" of the query.  Collectors refer to columns by those names and declare the ones they read, so
+the client info query only asks the server for what is actually used.
+'''
+
+
+def field_name(field):
+    return f"{field['component']}_{field['column']}"
+
+
+def field_from_name(name):
+    # the components (Client, DesktopClient, OperatingSystem, ...) have no _ in them, columns can
+    component, sep, column = name.partition("_")
+    if len(sep) == 0 or len(component) == 0 or len(column) == 0:
+        raise ValueError(f"{name} is not a <component>_<column> field name")
+    return {"column": column, "component": component}
+
+
+def build_client_info_query(columns=None, filewave_ids=None):
+    """
+    The client info query (same criteria as query_client_info), asking only for the given columns;
+    in the order of query_client_info, with any columns it doesn't have on the end.  None asks for
+    every column of query_client_info.
+
+    With filewave_ids, only those devices are asked for; a nested group of filewave_id = ... criteria,
+    any one of which has to match.
+    """
+    query = json.loads(query_client_info)
+    if filewave_ids is not None:
+        query["criteria"]["expressions"].append({
+            "expressions": [
+                {"column": "filewave_id", "component": "Client", "operator": "=", "qualifier": int(filewave_id)}
+                for filewave_id in filewave_ids
+            ],
+            "logic": "one"
+        })
+    if columns is None:
+        return json.dumps(query)
+
+    wanted = list(dict.fromkeys(columns))
+    fields = [f for f in query["fields"] if field_name(f) in wanted]
+    known = set(field_name(f) for f in fields)
+    for name in wanted:
+        if name in known:
+            continue
+        try:
+            fields.append(field_from_name(name))
+        except ValueError as e:
+            logger.warning(f"left out of the client info query: {e}")
+    query["fields"] = fields
+    return json.dumps(query)
+
+
+def missing_columns(df, columns):
+    return [c for c in columns if c not in df.columns]
@@ -1,13 +1,12 @@
 from extra_metrics.config import ExtraMetricsConfiguration, read_config_helper
-from extra_metrics.fwrest import FWRestQuery
 from extra_metrics.logs import logger, init_logging
+from extra_metrics.package import get_package_resource_string, list_package_resources
 import extra_metrics.platform as platform
 
 import os
 import click
 import shutil
 import subprocess
-import pkg_resources
 import sys
 import errno
 
@@ -150,6 +149,9 @@ def install_into_environment(config_path, api_key, external_dns_name, polling_in
         else:
             present_warning = True
 
+    # not imported until here; it brings in pandas and requests, which --help and a config write don't need
+    from extra_metrics.fwrest import FWRestQuery
+
     q = FWRestQuery(cfg.get_fw_api_server_hostname(), cfg.get_fw_api_key(), cfg.get_verify_tls())
     major, minor, patch = validate_runtime_requirements(q)
     log_config_summary(cfg, major, minor, patch)
@@ -187,10 +189,10 @@ def provision_launch_of_extra_metrics_on_host():
             full_extra_metrics_run_path = os.path.join(exec_path, full_extra_metrics_run_path)
 
     if sys.platform == "darwin":
-        data = pkg_resources.resource_string("extra_metrics.cfg", "com.filewave.extra-metrics.plist").decode('utf-8')
+        data = get_package_resource_string("extra_metrics.cfg", "com.filewave.extra-metrics.plist").decode('utf-8')
         provisioning_file = os.path.join("/Library/LaunchDaemons", "com.filewave.extra-metrics.plist")
     else:
-        data = pkg_resources.resource_string("extra_metrics.cfg", "extra_metrics_supervisord.conf").decode('utf-8')
+        data = get_package_resource_string("extra_metrics.cfg", "extra_metrics_supervisord.conf").decode('utf-8')
         provisioning_file = os.path.join(supervisord_dir, "extra_metrics_supervisord.conf")
 
     with open(provisioning_file, "w+") as f:
@@ -208,9 +210,9 @@ def provision_dashboards_into_grafana(fw_server_dns_name):
         return
 
     # check each file is there... overwrite regardless (helps on upgrade I suppose)
-    for dashboard_file in pkg_resources.resource_listdir("extra_metrics", "dashboards"):
+    for dashboard_file in list_package_resources("extra_metrics.dashboards"):
         if dashboard_file.endswith(".json"):
-            data = pkg_resources.resource_string(
+            data = get_package_resource_string(
                 "extra_metrics.dashboards", dashboard_file).decode('utf-8')
             provisioning_file = os.path.join(
                 grafana_dashboard_deployment_dir, dashboard_file)
@@ -229,9 +231,9 @@ def provision_prometheus_scrape_configuration():
             f"The Prometheus directory ({prometheus_dir}) does not exist; is this version 14+ of FileWave?")
         return
 
-    for yaml_file in pkg_resources.resource_listdir("extra_metrics", "cfg"):
+    for yaml_file in list_package_resources("extra_metrics.cfg"):
         if yaml_file.endswith(".yml"):
-            data = pkg_resources.resource_string(
+            data = get_package_resource_string(
                 "extra_metrics.cfg", yaml_file)
             provisioning_file = os.path.join(prometheus_dir, yaml_file)
             with open(provisioning_file, 'wb') as f:
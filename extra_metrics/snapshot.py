@@ -0,0 +1,119 @@
+import time
+from prometheus_client.metrics_core import GaugeMetricFamily
+
+
+class SnapshotGaugeFamily(GaugeMetricFamily):
+    """
+    The metric family of a SnapshotGauge in a published snapshot; it never changes once it's built, so
+    its rendering can be reused by every scrape until the next snapshot is published.
+    """
+    pass
+
+
+class SnapshotGauge:
+    """
+    The definition of a gauge that's published through a SnapshotCollector; it has no values itself,
+    those live in a MetricsSnapshot.
+    """
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = list(labelnames)
+
+
+class MetricsSnapshot:
+    """
+    The values of every gauge of a SnapshotCollector for one collection cycle.  Fill it in with set()
+    and hand it to SnapshotCollector.publish() once it's complete, after that it must not change.
+    """
+    def __init__(self, gauges):
+        self._values = {gauge.name: {} for gauge in gauges}
+        self._families = None
+
+    def set(self, gauge, label_values, value):
+        # like Gauge.labels(...).set(), setting the same labels twice keeps the last value
+        self._values[gauge.name][tuple(str(v) for v in label_values)] = float(value)
+
+    def get(self, gauge, label_values):
+        return self._values[gauge.name].get(tuple(str(v) for v in label_values))
+
+    def series(self, gauge):
+        # {tuple of label values: value}, don't change it
+        return self._values[gauge.name]
+
+    def set_series(self, gauge, label_values, values):
+        # every series of a gauge in one go (e.g. when it's read back from disk), replacing any already set
+        self._values[gauge.name] = dict(zip(label_values, values))
+
+    def num_series(self):
+        return sum(len(series) for series in self._values.values())
+
+    def families(self, gauges):
+        # the metric families are built once, every scrape of this snapshot then reuses them
+        if self._families is None:
+            self._families = []
+            for gauge in gauges:
+                family = SnapshotGaugeFamily(gauge.name, gauge.documentation, labels=gauge.labelnames)
+                for label_values, value in self._values[gauge.name].items():
+                    family.add_metric(list(label_values), value)
+                self._families.append(family)
+        return self._families
+
+
+class SnapshotCollector:
+    """
+    A custom collector that exposes a set of gauges from an immutable snapshot.
+
+    Each collection cycle builds a complete MetricsSnapshot off to the side and publishes it in one go,
+    so a scrape sees either all of the previous cycle or all of the new one - never a mix.  Series that
+    aren't in the new snapshot (deleted devices, renamed updates, ...) simply disappear, rather than
+    hanging around forever as they do with labelled Gauge objects.
+
+    It's declared once at module level, in the same way as the Gauge objects were - register it after
+    its gauges are defined, so the registry knows their names:
+
+        patch_metrics = SnapshotCollector()
+        updates_by_state = patch_metrics.gauge('extra_metrics_..._by_state', 'docs...', ["state"])
+        REGISTRY.register(patch_metrics)
+    """
+    def __init__(self):
+        self.gauges = []
+        self._snapshot = MetricsSnapshot([])
+        # when the data of the current snapshot was collected, None until one is published
+        self.published_at = None
+
+    def gauge(self, name, documentation, labelnames=()):
+        gauge = SnapshotGauge(name, documentation, labelnames)
+        self.gauges.append(gauge)
+        self._snapshot = MetricsSnapshot(self.gauges)
+        return gauge
+
+    def new_snapshot(self):
+        return MetricsSnapshot(self.gauges)
+
+    def prepare(self, snapshot):
+        """
+        Builds the metric families of a complete snapshot; call it where the snapshot was built (the
+        compute pool), then publish() is no more than a reference swap on the event loop.  Nothing may
+        be set() on the snapshot afterwards.
+        """
+        snapshot.families(self.gauges)
+        return snapshot
+
+    def publish(self, snapshot, published_at=None):
+        # does nothing if the snapshot was prepared already
+        snapshot.families(self.gauges)
+        self.published_at = published_at if published_at is not None else time.time()
+        # a single reference assignment, the http server thread picks up one snapshot or the other
+        self._snapshot = snapshot
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def describe(self):
+        # lets the registry check for duplicate names before there are any values
+        return [GaugeMetricFamily(gauge.name, gauge.documentation, labels=gauge.labelnames) for gauge in self.gauges]
+
+    def collect(self):
+        return self._snapshot.families(self.gauges)
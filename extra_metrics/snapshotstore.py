@@ -0,0 +1,193 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import numpy as np
+from prometheus_client.metrics_core import GaugeMetricFamily
+from extra_metrics.logs import logger
+
+'''
+The last published snapshot of each collector, on disk; so after a restart /metrics has data within
+moments, rather than being empty until every collector has finished its first cycle.
+
+The file is:
+    MAGIC, the length of the header (uint64 little endian), the header (JSON), padding to 8 bytes,
+    then the data: for each gauge its label values (uint32 indexes into the header's table of
+    strings, one row per series) and its values (float64).
+The label values of a fleet repeat a lot (platforms, versions, states...), each distinct one is only
+stored once.  The data is read straight out of a memory map of the file.
+'''
+
+MAGIC = b"EMSNAP01"
+_HEADER = struct.Struct("<8sQ")
+
+
+def _aligned(offset):
+    return (offset + 7) & ~7
+
+
+def _read_list(mm, dtype, count, offset):
+    # copied out straight away; the map can't be closed while there are views onto it
+    return np.frombuffer(mm, dtype=dtype, count=count, offset=offset).tolist()
+
+
+class SnapshotStore:
+    """
+    Writes the snapshots of the given collectors ({name: SnapshotCollector}) to path after each cycle
+    (write-then-rename, so a crash never leaves a half written file behind) and publishes them again
+    at startup with load(); the first live cycle then replaces them collector by collector.
+
+    Snapshots older than max_age_seconds aren't restored, nor are gauges whose labels have changed
+    since the file was written (an upgrade).  It's also a prometheus collector of its own; the age of
+    the data each collector is serving and whether it came from disk or a live cycle.
+    """
+    def __init__(self, path, collectors, max_age_seconds=86400, clock=time.time):
+        self.path = path
+        self.collectors = dict(collectors)
+        self.max_age_seconds = max_age_seconds
+        self.clock = clock
+        self._restored = {}
+        self._saved = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Publishes the snapshots found in the file, returns the number of collectors that were restored.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return 0
+        started = time.perf_counter()
+        try:
+            with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                restored = self._restore(mm)
+        except (OSError, ValueError, KeyError, TypeError, struct.error) as e:
+            logger.warning(f"unable to load the metrics snapshot from {self.path}, {e}")
+            return 0
+
+        for name, (snapshot, published_at) in restored.items():
+            self.collectors[name].publish(snapshot, published_at=published_at)
+            self._restored[name] = snapshot
+            self._saved[name] = snapshot
+        logger.info(f"restored the metrics of {len(restored)} collectors from {self.path} in {time.perf_counter() - started:.3f} sec")
+        return len(restored)
+
+    def _restore(self, mm):
+        magic, header_length = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError("not a metrics snapshot file")
+        header = json.loads(mm[_HEADER.size:_HEADER.size + header_length].decode('utf-8'))
+        data_start = _aligned(_HEADER.size + header_length)
+        strings = header["strings"]
+        now = self.clock()
+
+        restored = {}
+        for entry in header["collectors"]:
+            collector = self.collectors.get(entry["name"])
+            if collector is None:
+                continue
+            if now - entry["published_at"] > self.max_age_seconds:
+                logger.info(f"the saved metrics of {entry['name']} are too old to restore")
+                continue
+
+            gauges = {gauge.name: gauge for gauge in collector.gauges}
+            snapshot = collector.new_snapshot()
+            for saved in entry["gauges"]:
+                gauge = gauges.get(saved["name"])
+                if gauge is None or gauge.labelnames != saved["labelnames"]:
+                    logger.info(f"the saved metric {saved['name']} no longer matches its definition, not restored")
+                    continue
+                count, width = saved["count"], len(gauge.labelnames)
+                indexes = _read_list(mm, '<u4', count * width, data_start + saved["labels_offset"])
+                values = _read_list(mm, '<f8', count, data_start + saved["values_offset"])
+                # one list per label, then zipped together into a tuple per series
+                label_values = list(zip(*[[strings[i] for i in indexes[k::width]] for k in range(width)])) if width > 0 else [()] * count
+                snapshot.set_series(gauge, label_values, values)
+            restored[entry["name"]] = (snapshot, entry["published_at"])
+        return restored
+
+    def save(self):
+        """
+        Writes the current snapshot of every collector that has one, if any of them changed since the
+        last save; returns True when the file was written.
+        """
+        if self.path is None:
+            return False
+        with self._lock:
+            current = {name: c.snapshot for name, c in self.collectors.items() if c.published_at is not None}
+            if len(current) == 0 or all(self._saved.get(name) is snapshot for name, snapshot in current.items()):
+                return False
+
+            header, blocks = self._encode(current)
+            header_bytes = json.dumps(header).encode('utf-8')
+            data_start = _aligned(_HEADER.size + len(header_bytes))
+
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(_HEADER.pack(MAGIC, len(header_bytes)))
+                    f.write(header_bytes)
+                    f.write(b"\0" * (data_start - _HEADER.size - len(header_bytes)))
+                    for block in blocks:
+                        f.write(block)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"unable to save the metrics snapshot to {self.path}, {e}")
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return False
+
+            self._saved = current
+            return True
+
+    def _encode(self, snapshots):
+        strings = {}
+        collectors = []
+        blocks = []
+        offset = 0
+        for name, snapshot in snapshots.items():
+            collector = self.collectors[name]
+            gauges = []
+            for gauge in collector.gauges:
+                series = snapshot.series(gauge)
+                indexes = np.array([strings.setdefault(v, len(strings)) for labels in series.keys() for v in labels], dtype='<u4')
+                values = np.array(list(series.values()), dtype='<f8')
+                labels_block = indexes.tobytes() + b"\0" * (_aligned(indexes.nbytes) - indexes.nbytes)
+                gauges.append({
+                    "name": gauge.name,
+                    "labelnames": gauge.labelnames,
+                    "count": len(series),
+                    "labels_offset": offset,
+                    "values_offset": offset + len(labels_block)
+                })
+                blocks += [labels_block, values.tobytes()]
+                offset += len(labels_block) + values.nbytes
+            collectors.append({"name": name, "published_at": collector.published_at, "gauges": gauges})
+
+        header = {"saved_at": self.clock(), "strings": list(strings.keys()), "collectors": collectors}
+        return header, blocks
+
+    def describe(self):
+        return [self._age_family()]
+
+    def collect(self):
+        age = self._age_family()
+        now = self.clock()
+        for name, collector in self.collectors.items():
+            if collector.published_at is None:
+                continue
+            source = "disk" if self._restored.get(name) is collector.snapshot else "live"
+            age.add_metric([name, source], max(now - collector.published_at, 0))
+        return [age]
+
+    @staticmethod
+    def _age_family():
+        return GaugeMetricFamily('extra_metrics_snapshot_age_seconds',
+                                 'seconds since the data each collector is serving was collected, '
+                                 'and whether it was restored from disk at startup or comes from a live cycle',
+                                 labels=['collector', 'source'])
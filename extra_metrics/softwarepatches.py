@@ -1,38 +1,165 @@
-from prometheus_client import Gauge
+from prometheus_client import REGISTRY
 import pandas as pd
 import datetime
+import numpy as np
+import threading
+import time
 from datetime import timezone
+from extra_metrics import instrumentation
+from extra_metrics.cardinality import CardinalityGovernor
+from extra_metrics.exposition import DEVICE_REGISTRY
+from extra_metrics.fwrest_async import SoftwareUpdatePageError
 from extra_metrics.logs import logger
+from extra_metrics.snapshot import SnapshotCollector
+from extra_metrics.timestamps import age_in_days
+from extra_metrics.workers import INLINE
 
-software_updates_by_state = Gauge('extra_metrics_software_updates_by_state',
+# every metric of this module is published as one snapshot per collection
+software_patch_metrics = SnapshotCollector()
+# ... apart from the per device ones, which are served on /metrics/devices
+software_patch_device_metrics = SnapshotCollector()
+
+software_updates_by_state = software_patch_metrics.gauge('extra_metrics_software_updates_by_state',
     'buckets of all the software updates by state - the value is the number of devices in each state, this includes completed updates',
     ["state"])
 
-software_updates_by_critical = Gauge('extra_metrics_software_updates_by_critical',
+software_updates_by_critical = software_patch_metrics.gauge('extra_metrics_software_updates_by_critical',
     'lists all the updates, indicating the number of normal vs critical updates currently known by the server',
     ["platform", "is_critical"])
 
-software_updates_by_popularity = Gauge('extra_metrics_software_updates_by_popularity',
+software_updates_by_popularity = software_patch_metrics.gauge('extra_metrics_software_updates_by_popularity',
     'list of software updates and the number of devices still needing the update (unassigned), completed updates are not included in this count',
     ["update_name", "update_id", "state"])
 
-software_updates_by_age = Gauge('extra_metrics_software_updates_by_age',
+software_updates_by_age = software_patch_metrics.gauge('extra_metrics_software_updates_by_age',
     'list of software updates and their age in days, all updates including completed ones are included here.  The value of the metric is the age in days (from now)',
     ["update_name", "update_id", "created_date"])
 
-software_updates_remaining_by_device = Gauge('extra_metrics_software_updates_remaining_by_device',
+software_updates_remaining_by_device = software_patch_device_metrics.gauge('extra_metrics_software_updates_remaining_by_device',
     'list of devices and the number of [critical] updates they have remaining to be installed, completed updates are not included in this count',
     ["device_name", "device_id", "is_update_critical"])
 
+software_updates_pages = software_patch_metrics.gauge('extra_metrics_software_updates_pages',
+    'the number of pages of software updates fetched from the FileWave server in the last collection')
+
+software_updates_bytes = software_patch_metrics.gauge('extra_metrics_software_updates_bytes',
+    'the number of bytes of software update data fetched from the FileWave server in the last collection')
+
+software_updates_changed = software_patch_metrics.gauge('extra_metrics_software_updates_changed',
+    'the number of software updates whose devices were added, changed or removed since the previous collection',
+    ["change"])
+
+REGISTRY.register(software_patch_metrics)
+DEVICE_REGISTRY.register(software_patch_device_metrics)
+
+
+class PatchStateTable:
+    """
+    The patch counts of every device; a dense (device x criticality x state) table of integers,
+    indexed by the device's filewave_id.
+
+    Counts are added in bulk - a whole device_ids list at a time - and are only folded into the table
+    (with a single bincount) when they are read, so the cost per update is appending one array.
+
+    The software patch and device collectors use it from the compute pool threads, so it has a lock.
+    """
+    UNASSIGNED = 0
+    ERROR = 1
+    WARNING = 2
+    ASSIGNED = 3
+    REMAINING = 4
+    COMPLETED = 5
+    NUM_STATES = 6
+
+    def __init__(self, capacity=1024):
+        self.counts = np.zeros((capacity, 2, PatchStateTable.NUM_STATES), dtype=np.int64)
+        self.client_names = {}
+        self._pending = []
+        self.lock = threading.RLock()
+
+    def add(self, device_ids, is_critical, state, weight=1):
+        ids = np.asarray(device_ids, dtype=np.int64)
+        if len(ids) > 0:
+            with self.lock:
+                self._pending.append((ids, int(bool(is_critical)) * PatchStateTable.NUM_STATES + state, weight))
+
+    def _ensure_capacity(self, max_id):
+        capacity = len(self.counts)
+        if max_id < capacity:
+            return
+        while capacity <= max_id:
+            capacity *= 2
+        grown = np.zeros((capacity, 2, PatchStateTable.NUM_STATES), dtype=np.int64)
+        grown[:len(self.counts)] = self.counts
+        self.counts = grown
+
+    def flush(self):
+        with self.lock:
+            if len(self._pending) == 0:
+                return
+            pending, self._pending = self._pending, []
+            self._ensure_capacity(max(int(ids.max()) for ids, _, _ in pending))
+
+            # one flat index per count; device, then criticality, then state - the layout of self.counts
+            cells_per_device = 2 * PatchStateTable.NUM_STATES
+            size = len(self.counts) * cells_per_device
+            flat = self.counts.reshape(-1)
+            for weight in set(w for _, _, w in pending):
+                index = np.concatenate([ids * cells_per_device + cell for ids, cell, w in pending if w == weight])
+                flat += np.bincount(index, minlength=size) * weight
+
+    def get(self, client_id, is_critical, state):
+        client_id = int(client_id)
+        with self.lock:
+            self.flush()
+            if client_id < 0 or client_id >= len(self.counts):
+                return 0
+            return int(self.counts[client_id, int(bool(is_critical)), state])
+
+    def set(self, client_id, is_critical, state, value):
+        client_id = int(client_id)
+        with self.lock:
+            self.flush()
+            self._ensure_capacity(client_id)
+            self.counts[client_id, int(bool(is_critical)), state] = value
+
+    def column(self, client_ids, is_critical, state):
+        """
+        Looks up one count for many devices; missing/unknown ids get 0.
+        """
+        ids = np.asarray(client_ids, dtype=np.float64)
+        with self.lock:
+            self.flush()
+            known = ~np.isnan(ids) & (ids >= 0) & (ids < len(self.counts))
+            values = np.zeros(len(ids), dtype=np.int64)
+            values[known] = self.counts[ids[known].astype(np.int64), int(bool(is_critical)), state]
+        return values
+
+    def totals_not_completed(self, client_ids, is_critical):
+        # the same as PatchStateCounts.total_not_completed, for many devices at once
+        return self.column(client_ids, is_critical, PatchStateTable.ASSIGNED) - self.column(client_ids, is_critical, PatchStateTable.COMPLETED)
+
+
+def _state_property(state):
+    return property(lambda self: self.table.get(self.client_id, self.is_critical, state),
+                    lambda self, value: self.table.set(self.client_id, self.is_critical, state, value))
+
 
 class PatchStateCounts:
-    def __init__(self):
-        self.unassigned = 0
-        self.error = 0
-        self.warning = 0
-        self.assigned = 0
-        self.remaining = 0
-        self.completed = 0
+    """
+    The counts of one device, for either its critical or normal updates - a view onto a PatchStateTable.
+    """
+    unassigned = _state_property(PatchStateTable.UNASSIGNED)
+    error = _state_property(PatchStateTable.ERROR)
+    warning = _state_property(PatchStateTable.WARNING)
+    assigned = _state_property(PatchStateTable.ASSIGNED)
+    remaining = _state_property(PatchStateTable.REMAINING)
+    completed = _state_property(PatchStateTable.COMPLETED)
+
+    def __init__(self, table, client_id, is_critical):
+        self.table = table
+        self.client_id = client_id
+        self.is_critical = is_critical
 
     def total(self):
         return self.assigned
@@ -48,11 +175,19 @@ class PatchStateCounts:
 
 
 class PerDevicePatchState:
-    def __init__(self, client_id):
+    def __init__(self, table, client_id):
+        self.table = table
         self.client_id = client_id
-        self.client_name = None
-        self.count_crits = PatchStateCounts()
-        self.count_normal = PatchStateCounts()
+        self.count_crits = PatchStateCounts(table, client_id, True)
+        self.count_normal = PatchStateCounts(table, client_id, False)
+
+    @property
+    def client_name(self):
+        return self.table.client_names.get(self.client_id)
+
+    @client_name.setter
+    def client_name(self, value):
+        self.table.client_names[self.client_id] = value
 
     def get_counter(self, is_update_critcal):
         if is_update_critcal:
@@ -60,48 +195,225 @@ class PerDevicePatchState:
         return self.count_normal
 
 
+# the device id lists of an update, in the order of the states they are counted against
+_UPDATE_DEVICE_STATES = [
+    (PatchStateTable.UNASSIGNED, lambda item: item["unassigned_devices"]),
+    (PatchStateTable.COMPLETED, lambda item: item["assigned_devices"]["completed"]),
+    (PatchStateTable.REMAINING, lambda item: item["assigned_devices"]["remaining"]),
+    (PatchStateTable.ASSIGNED, lambda item: item["assigned_devices"]["assigned"]),
+    (PatchStateTable.WARNING, lambda item: item["assigned_devices"]["warning"]),
+    (PatchStateTable.ERROR, lambda item: item["assigned_devices"]["error"]),
+]
+
+
+class UpdateContribution:
+    """
+    What a single update added to the per device state; kept so it can be taken away again when the
+    update changes or disappears.  The fingerprint is a hash of the criticality and every device id list.
+    """
+    def __init__(self, item):
+        self.is_critical = item["critical"]
+        self.device_ids = [(state, list(get_devices(item)["device_ids"])) for state, get_devices in _UPDATE_DEVICE_STATES]
+        self.fingerprint = UpdateContribution.fingerprint_of(item)
+
+    @staticmethod
+    def key_of(item):
+        return (item.get("unique_hash"), item["id"])
+
+    @staticmethod
+    def fingerprint_of(item):
+        return hash((bool(item["critical"]),) + tuple(tuple(get_devices(item)["device_ids"]) for _, get_devices in _UPDATE_DEVICE_STATES))
+
+    def apply(self, table, weight=1):
+        for state, device_ids in self.device_ids:
+            table.add(device_ids, self.is_critical, state, weight)
+
+
 class SoftwarePatchStatus:
-    def __init__(self, fw_query):
+    # the client info columns read by collect_patch_data_per_device
+    CLIENT_INFO_COLUMNS = ["Client_filewave_client_name", "Client_filewave_id"]
+
+    def __init__(self, fw_query, page_size=1000, max_concurrency=4, governor=None, compute=None):
         self.fw_query = fw_query
-        # a dictionary of the PerDevicePatchState
-        self.state_by_device = {}
+        self.page_size = page_size
+        self.max_concurrency = max_concurrency
+        self.governor = governor if governor is not None else CardinalityGovernor()
+        # the pandas/numpy work runs here, off the event loop
+        self.compute = compute if compute is not None else INLINE
+        # the patch counts of every device, see get_perdevice_state for a per device view
+        self.patch_state = PatchStateTable()
+        # what each update (by unique_hash/id) contributed to patch_state, so only changes need applying
+        self.update_contributions = {}
+
+    def apply_update_to_perdevice_state(self, item):
+        """
+        Brings the per device state up to date with one update; nothing is done if its device lists
+        are the same as last time, otherwise the old contribution is taken away and the new one added.
+        Returns the kind of change, or None.
+        """
+        key = UpdateContribution.key_of(item)
+        previous = self.update_contributions.get(key)
+        if previous is not None and previous.fingerprint == UpdateContribution.fingerprint_of(item):
+            return None
 
-    def reset_perdevice_state(self):
-        self.state_by_device = {}
+        contribution = UpdateContribution(item)
+        if previous is not None:
+            previous.apply(self.patch_state, weight=-1)
+        contribution.apply(self.patch_state)
+        self.update_contributions[key] = contribution
+        return "changed" if previous is not None else "added"
+
+    def remove_updates_from_perdevice_state(self, keep_keys):
+        # updates the server no longer lists stop counting against devices
+        removed = [key for key in self.update_contributions if key not in keep_keys]
+        for key in removed:
+            self.update_contributions.pop(key).apply(self.patch_state, weight=-1)
+        return len(removed)
 
     def get_perdevice_counters(self, client_id, is_update_critical):
         return self.get_perdevice_state(client_id).get_counter(is_update_critical)
 
     def get_perdevice_state(self, client_id):
-        if client_id not in self.state_by_device:
-            self.state_by_device[client_id] = PerDevicePatchState(client_id)
-        return self.state_by_device.get(client_id, None)
-
-    def apply_unassigned_counts_to_perdevice_state(self, devices_dict, is_update_critical):
-        for cid in devices_dict["device_ids"]:
-            self.get_perdevice_counters(cid, is_update_critical).unassigned += 1
-
-    def apply_assigned_counts_to_perdevice_state(self, assigned_dict, is_update_critical):
-        for cid in assigned_dict["completed"]["device_ids"]:
-            self.get_perdevice_counters(cid, is_update_critical).completed += 1
-        for cid in assigned_dict["remaining"]["device_ids"]:
-            self.get_perdevice_counters(cid, is_update_critical).remaining += 1
-        for cid in assigned_dict["assigned"]["device_ids"]:
-            self.get_perdevice_counters(cid, is_update_critical).assigned += 1
-        for cid in assigned_dict["warning"]["device_ids"]:
-            self.get_perdevice_counters(cid, is_update_critical).warning += 1
-        for cid in assigned_dict["error"]["device_ids"]:
-            self.get_perdevice_counters(cid, is_update_critical).error += 1
-
-    def collect_patch_data_status(self):
-        j = self.fw_query.get_software_updates_web_ui_j()
-        if j is None:
-            return
+        return PerDevicePatchState(self.patch_state, client_id)
 
-        if "results" not in j or len(j["results"]) == 0:
-            logger.info("no results for software update patch status received from FileWave server")
-            return None
+    def get_perdevice_totals_not_completed(self, client_ids, is_update_critical):
+        return self.patch_state.totals_not_completed(client_ids, is_update_critical)
+
+    def _process_page(self, results, values, seen_updates, changes):
+        """
+        Folds one page of updates into the per device state and appends a row per update to values,
+        returns the time it took.
+        """
+        page_start = time.perf_counter()
 
+        for item in results:
+            key = UpdateContribution.key_of(item)
+            if key in seen_updates:
+                # the list moved between pages and this update is on two of them; count it once
+                continue
+            seen_updates.add(key)
+
+            update_id = item['update_id']
+            update_pk = item['id']
+            acc = item["assigned_devices"]
+            update_name = item["name"]
+            creation_date = item["creation_date"]
+            platform = item["platform"]
+            if platform == "macOS" or platform == "0":
+                update_name += f" ({update_id})"
+
+            is_critical = item["critical"]
+            num_requested = item["count_requested"]
+            num_unassigned = item["unassigned_devices"]["count"]
+            num_remaining = acc["remaining"]["count"]
+            num_assigned = acc["assigned"]["count"]
+            num_completed = acc["completed"]["count"]
+            num_warning = acc["warning"]["count"]
+            num_error = acc["error"]["count"]
+            is_completed = num_requested > 0 and num_unassigned == 0 and num_remaining == 0
+
+            # only updates whose devices changed since the last collection touch the per device state
+            change = self.apply_update_to_perdevice_state(item)
+            if change is not None:
+                changes[change] += 1
+
+            values.append([
+                update_name,
+                update_id,
+                update_pk,
+                creation_date,
+                None,   # age_in_days, worked out for every update at once in _summarise_updates
+                is_critical,
+                platform,
+                num_requested,
+                num_unassigned,
+                num_assigned,
+                num_completed,
+                num_remaining,
+                num_warning,
+                num_error,
+                is_completed
+            ])
+        return time.perf_counter() - page_start
+
+    def _summarise_updates(self, values, columns, now, snapshot, seen_updates, changes, aggregate_seconds):
+        """
+        Once every page arrived; drops the updates that have gone and fills in the snapshot with the
+        rollups over all updates.  Returns the DataFrame of updates.
+        """
+        # only once every page arrived is it known which updates have gone
+        remove_start = time.perf_counter()
+        changes["removed"] = self.remove_updates_from_perdevice_state(seen_updates)
+        aggregate_seconds += time.perf_counter() - remove_start
+        for change, count in changes.items():
+            snapshot.set(software_updates_changed, [change], count)
+
+        instrumentation.observe_stage(instrumentation.STAGE_AGGREGATE, aggregate_seconds)
+        instrumentation.add_rows(len(values))
+
+        with instrumentation.stage(instrumentation.STAGE_FRAME):
+            df = pd.DataFrame(values, columns=columns)
+            # updates without a creation date are counted as 99 days old
+            df["age_in_days"] = age_in_days(df["creation_date"], now, missing_days=99)
+
+        with instrumentation.stage(instrumentation.STAGE_AGGREGATE):
+            platform_mapping = {
+                "0": "macOS",
+                "1": "Microsoft"
+            }
+
+            # for platform/criticality
+            df_crit = df.groupby(['platform', 'critical'])
+            for key, item in df_crit:
+                platform_str = key[0]
+                if platform_str in platform_mapping:
+                    platform_str = platform_mapping[platform_str]
+                is_crit = key[1]
+                total_count = item['update_id'].count()
+                snapshot.set(software_updates_by_critical, [platform_str, is_crit], total_count)
+
+            # calculate the outstanding updates, e.g. patches with highest number of clients outstanding, which is:
+            #       unassigned + assigned + remaining
+            # df_not_completed = df.loc[df['is_completed'] == False]
+            per_update_totals = df.groupby(["update_name", "update_pk"], as_index=False)
+            for key, item in per_update_totals:
+                update_name = key[0]
+                update_pk = str(key[1])
+                num_not_started = item['unassigned'].sum()
+                num_outstanding = item['remaining'].sum()
+                num_completed = item['completed'].sum()
+                num_with_error_or_warning = item['warning'].sum() + item['error'].sum()
+
+                # print(f"update: {update_name} / {update_pk}, in progress: {num_outstanding}")
+                snapshot.set(software_updates_by_popularity, [update_name, update_pk, "Not Started"], num_not_started)
+                snapshot.set(software_updates_by_popularity, [update_name, update_pk, "In Progress"], num_outstanding)
+                snapshot.set(software_updates_by_popularity, [update_name, update_pk, "Completed"], num_completed)
+                snapshot.set(software_updates_by_popularity, [update_name, update_pk, "Errors/Warnings"], num_with_error_or_warning)
+
+                # each group holds a single update, so pick the scalar values out of it
+                snapshot.set(software_updates_by_age, [update_name, update_pk, item['creation_date'].iloc[0]], item['age_in_days'].iloc[0])
+
+            t = df.sum(0, numeric_only=True)
+
+            # total number of devices requesting software...
+            snapshot.set(software_updates_by_state, ['Requested'], t['requested'])
+            # total number not assigned to any device, even though its requested
+            snapshot.set(software_updates_by_state, ['Unassigned'], t['unassigned'])
+            # breakdown of totals for patches that have been assigned...
+            # assigned -> remaining (installing) -> completed
+            #          -> error|warning
+            snapshot.set(software_updates_by_state, ['Assigned'], t['assigned'])
+            snapshot.set(software_updates_by_state, ['Remaining'], t['remaining'])
+            snapshot.set(software_updates_by_state, ['Completed'], t['completed'])
+            snapshot.set(software_updates_by_state, ['Warning'], t['warning'])
+            snapshot.set(software_updates_by_state, ['Error'], t['error'])
+
+        # nothing more is set on the snapshot; build its metric families here rather than on the event loop
+        with instrumentation.stage(instrumentation.STAGE_PUBLISH):
+            software_patch_metrics.prepare(snapshot)
+        return df
+
+    async def collect_patch_data_status(self):
         values = [
         ]
 
@@ -178,11 +490,16 @@ class SoftwarePatchStatus:
             "is_completed"
         ]
 
-        res = j["results"]
-
         now = datetime.datetime.now(timezone.utc)
 
-        self.reset_perdevice_state()
+        # built up off to the side, only published once it's complete
+        snapshot = software_patch_metrics.new_snapshot()
+
+        num_pages = 0
+        num_bytes = 0
+        aggregate_seconds = 0
+        seen_updates = set()
+        changes = {"added": 0, "changed": 0, "removed": 0}
 
         '''
         IMPORTANT:
@@ -191,142 +508,108 @@ class SoftwarePatchStatus:
         - is_completed = num_requested > 0 and num_unassigned == 0 and num_remaining == 0
         '''
 
-        for item in res:
-            update_id = item['update_id']
-            update_pk = item['id']
-            acc = item["assigned_devices"]
-            update_name = item["name"]
-            creation_date = item["creation_date"]
-            platform = item["platform"]
-            if platform == "macOS" or platform == "0":
-                update_name += f" ({update_id})"
-
-            is_critical = item["critical"]
-            num_requested = item["count_requested"]
-            num_unassigned = item["unassigned_devices"]["count"]
-            num_remaining = acc["remaining"]["count"]
-            num_assigned = acc["assigned"]["count"]
-            num_completed = acc["completed"]["count"]
-            num_warning = acc["warning"]["count"]
-            num_error = acc["error"]["count"]
-            is_completed = num_requested > 0 and num_unassigned == 0 and num_remaining == 0
+        # pages arrive in the order they complete, each one is folded into the per device state as it arrives
+        try:
+            async for j, page_bytes in self.fw_query.iter_software_updates_pages(self.page_size, self.max_concurrency):
+                num_pages += 1
+                num_bytes += page_bytes
+                if "results" not in j:
+                    raise SoftwareUpdatePageError(f"a page of software updates came back without any results: {list(j.keys())}")
+                if len(j["results"]) == 0:
+                    continue
+
+                # the page is folded in off the event loop, but one page at a time
+                aggregate_seconds += await self.compute.run(self._process_page, j["results"], values, seen_updates, changes)
+        except SoftwareUpdatePageError as e:
+            # without every page it's not known which updates have gone, nor what the totals are; nothing
+            # is removed from the per device state and the previous snapshots stay published
+            logger.warning(f"the software update patch status is incomplete, not published: {e}")
+            return None
 
-            self.apply_unassigned_counts_to_perdevice_state(item["unassigned_devices"], is_critical)
-            self.apply_assigned_counts_to_perdevice_state(acc, is_critical)
+        snapshot.set(software_updates_pages, [], num_pages)
+        snapshot.set(software_updates_bytes, [], num_bytes)
 
-            age_in_days = 99
-            if creation_date is not None:
-                try:
-                    date_value = datetime.datetime.strptime(creation_date, '%Y-%m-%dT%H:%M:%S%z')
-                except ValueError:
-                    date_value = datetime.datetime.strptime(creation_date, '%Y-%m-%dT%H:%M:%S.%f%z')
-                delta = now - date_value
-                age_in_days = delta.days
+        if len(values) == 0:
+            logger.info("no results for software update patch status received from FileWave server")
+            # every page arrived and none listed an update; the updates of earlier cycles have all gone
+            changes["removed"] = await self.compute.run(self.remove_updates_from_perdevice_state, seen_updates)
+            for change, count in changes.items():
+                snapshot.set(software_updates_changed, [change], count)
+            if changes["removed"] > 0:
+                await self.collect_patch_data_per_device()
+            software_patch_metrics.publish(await self.compute.run(software_patch_metrics.prepare, snapshot))
+            return None
 
-            values.append([
-                update_name,
-                update_id,
-                update_pk,
-                creation_date,
-                age_in_days,
-                is_critical,
-                platform,
-                num_requested,
-                num_unassigned,
-                num_assigned,
-                num_completed,
-                num_remaining,
-                num_warning,
-                num_error,
-                is_completed
-            ])
+        df = await self.compute.run(self._summarise_updates, values, columns, now, snapshot, seen_updates, changes, aggregate_seconds)
 
-        df = pd.DataFrame(values, columns=columns)
+        await self.collect_patch_data_per_device()
 
-        platform_mapping = {
-            "0": "macOS",
-            "1": "Microsoft"
-        }
+        with instrumentation.stage(instrumentation.STAGE_PUBLISH):
+            software_patch_metrics.publish(snapshot)
+        return df
 
-        # for platform/criticality
-        df_crit = df.groupby(['platform', 'critical'])
-        for key, item in df_crit:
-            platform_str = key[0]
-            if platform_str in platform_mapping:
-                platform_str = platform_mapping[platform_str]
-            is_crit = key[1]
-            total_count = item['update_id'].count()
-            software_updates_by_critical.labels(platform_str, is_crit).set(total_count)
-
-        # calculate the outstanding updates, e.g. patches with highest number of clients outstanding, which is:
-        #       unassigned + assigned + remaining
-        # df_not_completed = df.loc[df['is_completed'] == False]
-        per_update_totals = df.groupby(["update_name", "update_pk"], as_index=False)
-        for key, item in per_update_totals:
-            update_name = key[0]
-            update_pk = str(key[1])
-            num_not_started = item['unassigned'].sum()
-            num_outstanding = item['remaining'].sum()
-            num_completed = item['completed'].sum()
-            num_with_error_or_warning = item['warning'].sum() + item['error'].sum()
-
-            # print(f"update: {update_name} / {update_pk}, in progress: {num_outstanding}")
-            software_updates_by_popularity.labels(update_name, update_pk, "Not Started").set(num_not_started)
-            software_updates_by_popularity.labels(update_name, update_pk, "In Progress").set(num_outstanding)
-            software_updates_by_popularity.labels(update_name, update_pk, "Completed").set(num_completed)
-            software_updates_by_popularity.labels(update_name, update_pk, "Errors/Warnings").set(num_with_error_or_warning)
-
-            software_updates_by_age.labels(update_name, update_pk, item['creation_date']).set(item['age_in_days'])
-
-        t = df.sum(0, numeric_only=True)
-
-        # total number of devices requesting software...
-        software_updates_by_state.labels('Requested').set(t['requested'])
-        # total number not assigned to any device, even though its requested
-        software_updates_by_state.labels('Unassigned').set(t['unassigned'])
-        # breakdown of totals for patches that have been assigned...
-        # assigned -> remaining (installing) -> completed
-        #          -> error|warning
-        software_updates_by_state.labels('Assigned').set(t['assigned'])
-        software_updates_by_state.labels('Remaining').set(t['remaining'])
-        software_updates_by_state.labels('Completed').set(t['completed'])
-        software_updates_by_state.labels('Warning').set(t['warning'])
-        software_updates_by_state.labels('Error').set(t['error'])
-
-        self.collect_patch_data_per_device()
-
-        return j
-
-    def collect_patch_data_per_device(self):
-        j = self.fw_query.get_client_info_j()
-        if j is None:
-            logger.warning("No info returned from the get_client_info_j query - thats not good")
+    async def collect_patch_data_per_device(self):
+        df = await self.fw_query.get_client_info_df()
+        if df is None:
+            logger.warning("No info returned from the get_client_info_df query - thats not good")
             return
 
-        if "values" not in j or len(j["values"]) == 0:
+        if len(df) == 0:
             logger.info("no results for software update patch status per device received from FileWave server")
             return None
 
-        if "fields" not in j:
-            logger.info("no fields meta data for software update patch status per device received from FileWave server")
-            return None
+        instrumentation.add_rows(len(df))
+        snapshot = await self.compute.run(self._build_device_snapshot, df)
+
+        with instrumentation.stage(instrumentation.STAGE_PUBLISH):
+            software_patch_device_metrics.publish(snapshot)
 
-        # use a list of devices, pick up the data from the software update / patching module and fill 
+    def _build_device_snapshot(self, df):
+        # use a list of devices, pick up the data from the software update / patching module and fill
         # in the metric.
-        df = pd.DataFrame(j["values"], columns=j["fields"])
-        ru = df.groupby(["Client_filewave_client_name", "Client_filewave_id"], as_index=False)
-        for key, item in ru:
-            client_name = key[0]
-            client_id = int(key[1])
-
-            obj = self.get_perdevice_state(client_id)
-            obj.client_name = client_name
-            # gets the critical patch count
-            per_device_critical = obj.get_counter(True)
-            # gets the non-critical patch count
-            per_device_normal = obj.get_counter(False)
-
-            logger.info(f"patches, device: {client_name}/{client_id}, critical: {per_device_critical.total()}, normal: {per_device_normal.total()}")
-
-            software_updates_remaining_by_device.labels(client_name, client_id, True).set(per_device_critical.total_assigned_and_unassigned())
-            software_updates_remaining_by_device.labels(client_name, client_id, False).set(per_device_normal.total_assigned_and_unassigned())
+        snapshot = software_patch_device_metrics.new_snapshot()
+
+        with instrumentation.stage(instrumentation.STAGE_AGGREGATE):
+            devices = df[SoftwarePatchStatus.CLIENT_INFO_COLUMNS].dropna().drop_duplicates()
+            devices = devices.sort_values(["Client_filewave_client_name", "Client_filewave_id"])
+            client_names = devices["Client_filewave_client_name"].tolist()
+            client_ids = devices["Client_filewave_id"].to_numpy(dtype=np.int64)
+            # only the devices in the current client info; deleted devices don't pile up
+            self.patch_state.client_names = dict(zip(client_ids.tolist(), client_names))
+
+            # every device's counts are looked up in one go, rather than one at a time
+            table = self.patch_state
+            critical_total = table.column(client_ids, True, PatchStateTable.ASSIGNED)
+            normal_total = table.column(client_ids, False, PatchStateTable.ASSIGNED)
+            critical_remaining = critical_total + table.column(client_ids, True, PatchStateTable.UNASSIGNED)
+            normal_remaining = normal_total + table.column(client_ids, False, PatchStateTable.UNASSIGNED)
+            critical_not_completed = critical_total - table.column(client_ids, True, PatchStateTable.COMPLETED)
+
+            # on a big fleet only some devices get their own series, picked by outstanding critical patches
+            kept = self.governor.select("software_updates_remaining_by_device",
+                                        dict(zip(client_ids.tolist(), critical_not_completed.tolist())),
+                                        series_per_device=2)
+            other_critical = 0
+            other_normal = 0
+
+            for client_name, client_id, crit_total, norm_total, crit_remaining, norm_remaining in zip(
+                    client_names, client_ids.tolist(), critical_total.tolist(), normal_total.tolist(),
+                    critical_remaining.tolist(), normal_remaining.tolist()):
+                logger.info(f"patches, device: {client_name}/{client_id}, critical: {crit_total}, normal: {norm_total}")
+
+                if kept is None or client_id in kept:
+                    snapshot.set(software_updates_remaining_by_device, [client_name, client_id, True], crit_remaining)
+                    snapshot.set(software_updates_remaining_by_device, [client_name, client_id, False], norm_remaining)
+                else:
+                    other_critical += crit_remaining
+                    other_normal += norm_remaining
+
+            # the devices that were left out are still counted, as a single 'Other' device
+            if kept is not None and len(kept) < len(devices):
+                other = CardinalityGovernor.OTHER_LABEL
+                snapshot.set(software_updates_remaining_by_device, [other, other, True], other_critical)
+                snapshot.set(software_updates_remaining_by_device, [other, other, False], other_normal)
+
+        # the metric families are built here too, publishing them on the event loop is then just a swap
+        with instrumentation.stage(instrumentation.STAGE_PUBLISH):
+            return software_patch_device_metrics.prepare(snapshot)
@@ -1,6 +1,8 @@
 import json
 import pandas as pd
 
+from extra_metrics.querystream import decode_query_result
+
 from extra_metrics.test.test_queries import \
     MAIN_GROUP_ID, MAIN_GROUP_NAME, MAIN_GROUP_PARENT_ID
 
@@ -21,6 +23,29 @@ class FakeRequest:
     def json(self):
         return json.loads(self.data)
 
+    @property
+    def status_code(self):
+        return 200
+
+    @property
+    def content(self):
+        return self.data.encode('utf-8')
+
+
+class FailedRequest(FakeRequest):
+    def __init__(self):
+        super().__init__('{"detail": "server error"}')
+
+    @property
+    def status_code(self):
+        return 500
+
+
+def stream_into_dataframe(string_data, chunk_size=37):
+    # feed the data in small pieces, the same way a streamed response would arrive
+    chunks = [string_data[i:i + chunk_size].encode('utf-8') for i in range(0, len(string_data), chunk_size)]
+    return decode_query_result(chunks, chunk_rows=2).to_dataframe()
+
 
 class FakeQueryInterface:
     TEST_QUERY_APPS = 1
@@ -39,6 +64,29 @@ class FakeQueryInterface:
         if self.create_inventory_callback:  # pragma: no branch
             self.create_inventory_callback(json_obj)
 
+    def get_client_info_j(self):
+        raise Exception("not implemented - please mock this")
+
+    def get_client_info_df(self):
+        j = self.get_client_info_j()
+        if j is None:
+            return None
+        return stream_into_dataframe(json.dumps(j))
+
+    def get_client_info_for_ids_df(self, filewave_ids):
+        j = self.get_client_info_j()
+        if j is None:
+            return None
+        id_index = j["fields"].index("Client_filewave_id")
+        values = [row for row in j["values"] if row[id_index] in filewave_ids]
+        return stream_into_dataframe(json.dumps({"fields": j["fields"], "values": values}))
+
+    def get_results_for_query_id_df(self, query_id):
+        r = self.get_results_for_query_id(query_id)
+        if r is None:
+            return None
+        return stream_into_dataframe(r.data)
+
     def get_software_updates_web_ui_j(self):
         t = '''{
             "results": [
@@ -46,6 +94,17 @@ class FakeQueryInterface:
         }'''
         return json.loads(t)
 
+    def get_software_updates_web_ui_page(self, limit, offset):
+        # paginates whatever get_software_updates_web_ui_j returns, the same way the server would
+        results = self.get_software_updates_web_ui_j()["results"]
+        page = {
+            "count": len(results),
+            "next": None,
+            "previous": None,
+            "results": results[offset:offset + limit]
+        }
+        return FakeRequest(json.dumps(page))
+
     def ensure_inventory_query_group_exists(self, name_of_query):
         assert name_of_query is not None
         my_data = '''{
@@ -1,22 +1,44 @@
+import asyncio
+import threading
+import time
 import unittest
 from prometheus_client import REGISTRY
 
 from extra_metrics.test.fake_mocks import FakeQueryInterface
 from extra_metrics.test.test_queries import MAIN_GROUP_ID
+from extra_metrics.fwrest_async import AsyncFWRestQuery
 from extra_metrics.application import (
     ApplicationQueryManager,
     ApplicationUsageRollup
 )
 
 
+class SlowQueryInterface(FakeQueryInterface):
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def get_results_for_query_id_df(self, query_id):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.in_flight, self.max_in_flight)
+        time.sleep(0.05)
+        with self.lock:
+            self.in_flight -= 1
+        # every query returns the same rows as the acrobat reader query
+        return super().get_results_for_query_id_df(101)
+
+
 class ExtraMetricsTestCase(unittest.TestCase):
     def setUp(self):
-        self.fw_query = FakeQueryInterface()
+        self.fw_query = AsyncFWRestQuery(FakeQueryInterface())
 
     def test_app_manager_rolls_queries_and_populates_metrics(self):
         app_mgr = ApplicationQueryManager(self.fw_query)
-        app_mgr.validate_query_definitions()
-        app_mgr.collect_application_query_results()
+        asyncio.run(app_mgr.validate_query_definitions())
+        asyncio.run(app_mgr.collect_application_query_results())
 
         after = REGISTRY.get_sample_value('extra_metrics_application_version',
                                           labels={"query_name": "Adobe Acrobat Reader Win",
@@ -35,10 +57,10 @@ class ExtraMetricsTestCase(unittest.TestCase):
 
     def test_app_manager_collecting_twice_doesnt_cause_totals_to_double(self):
         app_mgr = ApplicationQueryManager(self.fw_query)
-        app_mgr.validate_query_definitions()
+        asyncio.run(app_mgr.validate_query_definitions())
 
-        app_mgr.collect_application_query_results()
-        app_mgr.collect_application_query_results()
+        asyncio.run(app_mgr.collect_application_query_results())
+        asyncio.run(app_mgr.collect_application_query_results())
 
         after = REGISTRY.get_sample_value('extra_metrics_application_version',
                                           labels={"query_name": "Adobe Acrobat Reader Win",
@@ -48,21 +70,21 @@ class ExtraMetricsTestCase(unittest.TestCase):
     def test_app_manager_query_validation(self):
         app_mgr = ApplicationQueryManager(self.fw_query)
         self.assertEqual(len(app_mgr.app_queries), 0)
-        app_mgr.validate_query_definitions()
+        asyncio.run(app_mgr.validate_query_definitions())
         self.assertEqual(len(app_mgr.app_queries), 2)
 
     def test_app_manager_invalid_query_cannot_validate(self):
         app_mgr = ApplicationQueryManager(self.fw_query)
-        self.assertFalse(app_mgr.is_query_valid(
-            FakeQueryInterface.TEST_QUERY_DATA_INVALID))
-        self.assertFalse(app_mgr.is_query_valid(
-            FakeQueryInterface.TEST_QUERY_DATA_ALMOST_VALID1))
-        self.assertFalse(app_mgr.is_query_valid(
-            FakeQueryInterface.TEST_QUERY_DATA_ALMOST_VALID2))
+        self.assertFalse(asyncio.run(app_mgr.is_query_valid(
+            FakeQueryInterface.TEST_QUERY_DATA_INVALID)))
+        self.assertFalse(asyncio.run(app_mgr.is_query_valid(
+            FakeQueryInterface.TEST_QUERY_DATA_ALMOST_VALID1)))
+        self.assertFalse(asyncio.run(app_mgr.is_query_valid(
+            FakeQueryInterface.TEST_QUERY_DATA_ALMOST_VALID2)))
 
     def test_app_manager_doesnt_load_crap_queries(self):
         app_mgr = ApplicationQueryManager(self.fw_query)
-        app_mgr.retrieve_all_queries_in_group(MAIN_GROUP_ID)
+        asyncio.run(app_mgr.retrieve_all_queries_in_group(MAIN_GROUP_ID))
         self.assertEqual(len(app_mgr.app_queries), 2)
         self.assertTrue(120 not in app_mgr.app_queries.keys())
         self.assertTrue(101 in app_mgr.app_queries.keys())
@@ -70,18 +92,18 @@ class ExtraMetricsTestCase(unittest.TestCase):
 
     def test_app_mgr_accepts_valid_inventory_query(self):
         app_mgr = ApplicationQueryManager(self.fw_query)
-        result = app_mgr.is_query_valid(55)
+        result = asyncio.run(app_mgr.is_query_valid(55))
         self.assertTrue(result)
 
     def test_app_mgr_rejects_invalid_inventory_query(self):
         app_mgr = ApplicationQueryManager(self.fw_query)
-        result = app_mgr.is_query_valid(66)
+        result = asyncio.run(app_mgr.is_query_valid(66))
         self.assertFalse(result)
 
     def test_app_rollup(self):
         thing = ApplicationUsageRollup(FakeQueryInterface.TEST_QUERY_APPS, [
             "Application_name", "Application_version"], "Client_device_id")
-        thing.exec(self.fw_query)
+        asyncio.run(thing.exec(self.fw_query))
 
         # examine the rollup results to prove this worked
         r = thing.results()
@@ -112,8 +134,24 @@ class ExtraMetricsTestCase(unittest.TestCase):
             nonlocal loaded_data
             loaded_data.append(json_data)
 
-        my_query = FakeQueryInterface(test_query_load)
+        my_query = AsyncFWRestQuery(FakeQueryInterface(test_query_load))
         app_mgr = ApplicationQueryManager(my_query)
-        app_mgr.create_default_queries_in_group(MAIN_GROUP_ID)
+        asyncio.run(app_mgr.create_default_queries_in_group(MAIN_GROUP_ID))
 
         self.assertEqual(9, len(loaded_data))
+
+    def test_app_queries_run_concurrently_up_to_the_limit(self):
+        fake = SlowQueryInterface()
+        app_mgr = ApplicationQueryManager(AsyncFWRestQuery(fake), max_concurrency=2)
+        asyncio.run(app_mgr.validate_query_definitions())
+        # pretend there are more queries in the group
+        app_mgr.app_queries = {q_id: app_mgr.app_queries[101] for q_id in range(1001, 1005)}
+
+        def latency_count():
+            return REGISTRY.get_sample_value('extra_metrics_http_request_time_taken_count',
+                                             labels={"method": "app_query_Adobe Acrobat Reader Win"}) or 0
+
+        before = latency_count()
+        asyncio.run(app_mgr.collect_application_query_results())
+        self.assertEqual(2, fake.max_in_flight)
+        self.assertEqual(4, latency_count() - before)
@@ -0,0 +1,71 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock
+from prometheus_client import REGISTRY
+
+from extra_metrics.cardinality import CardinalityGovernor
+from extra_metrics.exposition import DEVICE_REGISTRY
+from extra_metrics.fwrest_async import AsyncFWRestQuery
+from extra_metrics.package import get_package_resource_json
+from extra_metrics.softwarepatches import SoftwarePatchStatus
+from extra_metrics.test.fake_mocks import FakeQueryInterface
+
+
+class CardinalityGovernorTestCase(unittest.TestCase):
+    def test_unlimited_keeps_everything(self):
+        governor = CardinalityGovernor()
+        self.assertIsNone(governor.select("test_unlimited", {1: 0, 2: 5}))
+        self.assertEqual(0, REGISTRY.get_sample_value('extra_metrics_cardinality_dropped_series', labels={"family": "test_unlimited"}))
+
+    def test_top_k_keeps_the_devices_with_most_critical_patches(self):
+        governor = CardinalityGovernor(max_devices=2)
+        kept = governor.select("test_top_k", {1: 0, 2: 5, 3: 1, 4: 5}, series_per_device=2)
+        self.assertEqual({2, 4}, kept)
+        self.assertEqual(4, REGISTRY.get_sample_value('extra_metrics_cardinality_dropped_series', labels={"family": "test_top_k"}))
+
+        # ties go to the lowest device id
+        self.assertEqual({1, 3}, governor.select("test_top_k", {3: 1, 1: 1, 4: 1}))
+
+    def test_shards_split_the_fleet_without_overlap(self):
+        scores = {device_id: 0 for device_id in range(1000)}
+        shards = [CardinalityGovernor(shard_count=4, shard_index=i).select("test_shard", scores) for i in range(4)]
+
+        self.assertEqual(set(scores.keys()), set().union(*shards))
+        self.assertEqual(1000, sum(len(s) for s in shards))
+        # the same device always lands in the same shard
+        self.assertEqual(shards[2], CardinalityGovernor(shard_count=4, shard_index=2).select("test_shard", scores))
+
+    def test_bad_shard_index_is_rejected(self):
+        with self.assertRaises(ValueError):
+            CardinalityGovernor(shard_count=2, shard_index=2)
+
+    def test_devices_left_out_are_rolled_up_into_other(self):
+        fw_query = FakeQueryInterface()
+        fw_query.get_software_updates_web_ui_j = MagicMock(
+            return_value=get_package_resource_json("extra_metrics.test", "software-update-testdata.json"))
+        fw_query.get_client_info_j = MagicMock(return_value={
+            "fields": ["Client_filewave_client_name", "Client_filewave_id"],
+            "values": [[f"device-{device_id}", device_id] for device_id in [1, 4, 5, 50, 88, 109]]
+        })
+
+        def remaining_by_device():
+            samples = {}
+            for metric in DEVICE_REGISTRY.collect():
+                if metric.name == 'extra_metrics_software_updates_remaining_by_device':
+                    for sample in metric.samples:
+                        samples[(sample.labels["device_id"], sample.labels["is_update_critical"])] = sample.value
+            return samples
+
+        asyncio.run(SoftwarePatchStatus(AsyncFWRestQuery(fw_query)).collect_patch_data_status())
+        everything = remaining_by_device()
+
+        asyncio.run(SoftwarePatchStatus(AsyncFWRestQuery(fw_query), governor=CardinalityGovernor(max_devices=2)).collect_patch_data_status())
+        limited = remaining_by_device()
+
+        self.assertEqual(12, len(everything))
+        self.assertEqual(6, len(limited))
+        self.assertIn(("Other", "True"), limited)
+        # nothing is lost, the totals are the same
+        for critical in ["True", "False"]:
+            self.assertEqual(sum(v for k, v in everything.items() if k[1] == critical),
+                             sum(v for k, v in limited.items() if k[1] == critical))
@@ -1,5 +1,6 @@
+import random
 import unittest
-from extra_metrics.compliance import ClientCompliance
+from extra_metrics.compliance import ClientCompliance, ClientComplianceBatch
 from datetime import date
 
 test_date = date.today()
@@ -84,3 +85,42 @@ class TestClientComplianceCase(unittest.TestCase):
         self.assertTrue(c2.get_checkin_compliance() > c1.get_disk_compliance())
         self.assertEqual(c2.get_compliance_state(),
                          ClientCompliance.STATE_ERROR)
+
+
+class TestClientComplianceBatchCase(unittest.TestCase):
+    def test_batch_matches_the_per_device_checks(self):
+        rng = random.Random(42)
+        # the interesting values are right around the thresholds
+        disk_sizes = [None, 0, -1, 1, 100, 250.5, 500107862016]
+        free_pcnt = [None, 0, -1, 4.9, 5, 19.99, 20, 20.01, 50, 100]
+        day_choices = [None, 0, 1, 6, 7, 13, 14, 30, 999]
+        patch_choices = [-1, 0, 1, 7]
+
+        rows = []
+        for _ in range(5000):
+            total = rng.choice(disk_sizes)
+            pcnt = rng.choice(free_pcnt)
+            free = None if total is None or pcnt is None else total * pcnt / 100.0
+            if rng.random() < 0.05:
+                free = rng.choice([None, 0, 1])
+            rows.append((rng.choice([None, test_date]), total, free, rng.choice(day_choices),
+                         rng.choice(patch_choices), rng.choice(patch_choices)))
+
+        batch = ClientComplianceBatch(*[list(column) for column in zip(*rows)])
+        checks = {
+            "get_patch_compliance": batch.get_patch_compliance(),
+            "get_checkin_compliance": batch.get_checkin_compliance(),
+            "get_disk_compliance": batch.get_disk_compliance(),
+            "get_compliance_state": batch.get_compliance_state(),
+        }
+
+        for i, row in enumerate(rows):
+            c = ClientCompliance(*row)
+            for method, states in checks.items():
+                self.assertEqual(getattr(c, method)(), states[i], f"{method} differs for {row}")
+
+    def test_batch_takes_missing_values_as_none_or_nan(self):
+        batch = ClientComplianceBatch([test_date, test_date], [None, float("nan")], [10, 10], [None, float("nan")], [0, 0], [0, 0])
+        self.assertEqual([ClientCompliance.STATE_UNKNOWN] * 2, list(batch.get_disk_compliance()))
+        self.assertEqual([ClientCompliance.STATE_UNKNOWN] * 2, list(batch.get_checkin_compliance()))
+        self.assertEqual([ClientCompliance.STATE_UNKNOWN] * 2, list(batch.get_compliance_state()))
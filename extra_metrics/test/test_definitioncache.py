@@ -0,0 +1,107 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from extra_metrics.application import ApplicationQueryManager
+from extra_metrics.definitioncache import DefinitionCache, query_ids_from_event
+from extra_metrics.fwrest_async import AsyncFWRestQuery
+from extra_metrics.test.fake_mocks import FakeQueryInterface
+
+
+class CountingQueryInterface(FakeQueryInterface):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def ensure_inventory_query_group_exists(self, name_of_query):
+        self.calls.append("ensure_inventory_query_group_exists")
+        return super().ensure_inventory_query_group_exists(name_of_query)
+
+    def get_all_inventory_queries(self):
+        self.calls.append("get_all_inventory_queries")
+        return super().get_all_inventory_queries()
+
+    def get_definition_for_query_id_j(self, q_id):
+        self.calls.append(f"get_definition_for_query_id_j/{q_id}")
+        return super().get_definition_for_query_id_j(q_id)
+
+
+class DefinitionCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = DefinitionCache(ttl_seconds=60, clock=lambda: self.now)
+
+    def test_entries_expire_after_the_ttl(self):
+        self.cache.put("definition/1", {"id": 1})
+        self.assertEqual({"id": 1}, self.cache.get("definition/1"))
+        self.now += 61
+        self.assertIsNone(self.cache.get("definition/1"))
+
+    def test_none_is_never_cached(self):
+        self.cache.put("definition/1", None)
+        self.assertIsNone(self.cache.get("definition/1"))
+
+    def test_invalidating_a_query_is_precise(self):
+        self.cache.put(DefinitionCache.KEY_QUERIES, [{"id": 1}, {"id": 2}])
+        self.cache.put(DefinitionCache.key_for_definition(1), {"id": 1})
+        self.cache.put(DefinitionCache.key_for_definition(2), {"id": 2})
+        self.cache.put(DefinitionCache.key_for_group("apps"), {"id": 5})
+
+        self.cache.invalidate_queries([1])
+        self.assertIsNone(self.cache.get(DefinitionCache.KEY_QUERIES))
+        self.assertIsNone(self.cache.get(DefinitionCache.key_for_definition(1)))
+        self.assertIsNotNone(self.cache.get(DefinitionCache.key_for_definition(2)))
+        self.assertIsNotNone(self.cache.get(DefinitionCache.key_for_group("apps")))
+
+        self.cache.invalidate_queries(None)
+        self.assertIsNone(self.cache.get(DefinitionCache.key_for_definition(2)))
+        self.assertIsNotNone(self.cache.get(DefinitionCache.key_for_group("apps")))
+
+        self.cache.put(DefinitionCache.key_for_definition(2), {"id": 2})
+        self.cache.invalidate_groups()
+        self.assertIsNone(self.cache.get(DefinitionCache.key_for_group("apps")))
+        self.assertIsNotNone(self.cache.get(DefinitionCache.key_for_definition(2)))
+
+    def test_cache_survives_a_restart(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "definitions.json")
+            cache = DefinitionCache(path=path, ttl_seconds=60)
+            cache.put(DefinitionCache.key_for_definition(101), {"id": 101})
+            cache.put(DefinitionCache.key_for_definition(102), {"id": 102})
+            # nothing is written until the end of the cycle, and then only once
+            self.assertEqual([], os.listdir(tmp_dir))
+            self.assertTrue(cache.save())
+            self.assertFalse(cache.save())
+
+            restarted = DefinitionCache(path=path, ttl_seconds=60)
+            self.assertTrue(restarted.load())
+            self.assertEqual({"id": 101}, restarted.get(DefinitionCache.key_for_definition(101)))
+            self.assertEqual(["definitions.json"], os.listdir(tmp_dir))
+
+    def test_query_ids_are_found_in_event_payloads(self):
+        self.assertEqual([12], query_ids_from_event({"id": 12}))
+        self.assertEqual([12, 13], query_ids_from_event({"ids": [12, "13"]}))
+        self.assertEqual([7], query_ids_from_event({"query_id": "7"}))
+        self.assertIsNone(query_ids_from_event({"something": "else"}))
+        self.assertIsNone(query_ids_from_event(b"not json"))
+
+    def test_steady_state_cycles_make_no_definition_calls(self):
+        fake = CountingQueryInterface()
+        fw_query = AsyncFWRestQuery(fake, definition_cache=DefinitionCache(ttl_seconds=60))
+        app_mgr = ApplicationQueryManager(fw_query)
+
+        asyncio.run(app_mgr.validate_query_definitions())
+        self.assertIn("get_all_inventory_queries", fake.calls)
+        self.assertEqual(2, len(app_mgr.app_queries))
+
+        fake.calls = []
+        asyncio.run(app_mgr.validate_query_definitions())
+        self.assertEqual([], fake.calls)
+        self.assertEqual(2, len(app_mgr.app_queries))
+
+        fw_query.definition_cache.invalidate_queries([101])
+        asyncio.run(app_mgr.validate_query_definitions())
+        self.assertIn("get_definition_for_query_id_j/101", fake.calls)
+        self.assertNotIn("get_definition_for_query_id_j/105", fake.calls)
+        self.assertNotIn("ensure_inventory_query_group_exists", fake.calls)
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import random
+import unittest
+from unittest.mock import MagicMock
+from prometheus_client import REGISTRY, generate_latest
+
+from extra_metrics.devices import PerDeviceStatus
+from extra_metrics.devicetable import client_ids_from_event
+from extra_metrics.exposition import DEVICE_REGISTRY
+from extra_metrics.fwrest_async import AsyncFWRestQuery
+from extra_metrics.rollup import RollupDimension
+from extra_metrics.schema import build_client_info_query
+from extra_metrics.softwarepatches import SoftwarePatchStatus
+from extra_metrics.test.fake_mocks import FakeQueryInterface
+
+
+def make_client_info(fields, num_devices, seed):
+    rng = random.Random(seed)
+    values = []
+    for device_id in range(num_devices):
+        row = {f: None for f in fields}
+        row.update({
+            "Client_device_name": f"device-{device_id}",
+            "Client_filewave_client_name": f"device-{device_id}",
+            "Client_filewave_id": device_id,
+            "OperatingSystem_name": rng.choice(["macOS", "Windows", "Chrome OS"]),
+            "DesktopClient_filewave_client_version": rng.choice(["14.1", "14.2", None]),
+            "Client_is_tracking_enabled": rng.choice([True, False]),
+            "Client_filewave_client_locked": rng.choice([True, False]),
+        })
+        values.append(row)
+    return values
+
+
+class ChangedDevicesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.per_device = PerDeviceStatus(None, rollups=[RollupDimension("test_os_lock", ["OperatingSystem_name", "Client_filewave_client_locked"])])
+        self.fields = list(dict.fromkeys(SoftwarePatchStatus.CLIENT_INFO_COLUMNS + self.per_device.client_info_columns()))
+        self.rows = make_client_info(self.fields, 40, seed=5)
+        self.fw_query = FakeQueryInterface()
+        self.fw_query.get_client_info_j = MagicMock(side_effect=lambda: {
+            "fields": self.fields, "values": [[row[f] for f in self.fields] for row in self.rows]})
+        self.per_device.fw_query = AsyncFWRestQuery(self.fw_query)
+        self.soft_patches = SoftwarePatchStatus(None)
+
+    def device_metrics(self):
+        lines = (generate_latest(REGISTRY) + generate_latest(DEVICE_REGISTRY)).decode().splitlines()
+        return sorted(line for line in lines if line.startswith("extra_metrics_per_device_") or line.startswith("extra_metrics_devices_by_rollup"))
+
+    def test_refreshing_changed_devices_gives_the_same_metrics_as_a_full_query(self):
+        asyncio.run(self.per_device.collect_client_data(self.soft_patches))
+
+        # device 3 is now locked and runs Windows, device 5 is gone (archived) and device 40 is new
+        self.rows[3].update({"OperatingSystem_name": "Windows", "Client_filewave_client_locked": True})
+        del self.rows[5]
+        self.rows.append(dict(self.rows[0], Client_device_name="device-40", Client_filewave_client_name="device-40", Client_filewave_id=40))
+
+        self.per_device.mark_dirty([3, 5, 40])
+        asyncio.run(self.per_device.collect_changed_devices(self.soft_patches))
+        incremental = self.device_metrics()
+        self.assertEqual(1, self.fw_query.get_client_info_j.call_count - 1, "only one targeted query should have been made")
+
+        # a new query wrapper; the old one would answer from this cycle's cache
+        full = PerDeviceStatus(AsyncFWRestQuery(self.fw_query), rollups=self.per_device.extra_rollups)
+        asyncio.run(full.collect_client_data(self.soft_patches))
+        self.assertEqual(self.device_metrics(), incremental)
+        self.assertIn('extra_metrics_per_device_modelnum{device_name="device-40"} 0.0', incremental)
+        self.assertNotIn('extra_metrics_per_device_modelnum{device_name="device-5"} 0.0', incremental)
+
+    def test_nothing_happens_before_the_first_full_query(self):
+        self.per_device.mark_dirty([1])
+        asyncio.run(self.per_device.collect_changed_devices(self.soft_patches))
+        self.assertEqual(0, self.fw_query.get_client_info_j.call_count)
+
+
+class ClientEventTestCase(unittest.TestCase):
+    def test_device_ids_are_found_in_the_payload_or_topic(self):
+        self.assertEqual([12], client_ids_from_event("/client/changed", {"filewave_id": 12}))
+        self.assertEqual([1, 2], client_ids_from_event("/client/changed", {"client_ids": [1, "2"]}))
+        self.assertEqual([33], client_ids_from_event("/client/33/inventory", b"not json"))
+        self.assertEqual([], client_ids_from_event("/client/changed", {"message": "hello"}))
+
+    def test_the_targeted_query_asks_for_just_those_devices(self):
+        query = json.loads(build_client_info_query(["Client_filewave_id"], filewave_ids=[4, 7]))
+        group = query["criteria"]["expressions"][-1]
+        self.assertEqual("one", group["logic"])
+        self.assertEqual([4, 7], [e["qualifier"] for e in group["expressions"]])
+        self.assertEqual("all", query["criteria"]["logic"])
@@ -0,0 +1,139 @@
+import gzip
+import unittest
+import urllib.error
+import urllib.request
+from prometheus_client import CollectorRegistry, Gauge
+
+from extra_metrics.exposition import MetricsPage, start_metrics_server
+from extra_metrics.snapshot import SnapshotCollector
+
+
+class MetricsPageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.gauge = Gauge('test_exposition_devices', 'number of devices', registry=self.registry)
+        self.gauge.set(10)
+        self.page = MetricsPage(self.registry)
+        self.page.refresh()
+        self.httpd = start_metrics_server(0, {"/metrics": self.page}, addr='127.0.0.1')
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/metrics"
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def fetch(self, url=None, headers=None):
+        request = urllib.request.Request(url or self.url, headers=headers or {})
+        try:
+            with urllib.request.urlopen(request) as r:
+                return r.status, r.headers, r.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, b''
+
+    def test_live_metrics_are_current_on_every_scrape(self):
+        status, headers, body = self.fetch()
+        self.assertEqual(200, status)
+        self.assertIn(b'test_exposition_devices 10.0', body)
+
+        # not just when a collection finishes
+        self.gauge.set(20)
+        self.assertIn(b'test_exposition_devices 20.0', self.fetch()[2])
+
+    def test_snapshot_families_are_rendered_once_per_publish(self):
+        metrics = SnapshotCollector()
+        by_device = metrics.gauge('test_exposition_by_device', 'a value per device', ["device_name"])
+        self.registry.register(metrics)
+        snapshot = metrics.new_snapshot()
+        snapshot.set(by_device, ["mac-1"], 1)
+        metrics.publish(snapshot)
+
+        body = self.page.refresh().body
+        self.assertIn(b'test_exposition_by_device{device_name="mac-1"} 1.0', body)
+        family = metrics.snapshot.families(metrics.gauges)[0]
+        rendered = self.page._family_text[id(family)][1]
+        self.page.refresh()
+        self.assertIs(rendered, self.page._family_text[id(family)][1])
+
+        snapshot = metrics.new_snapshot()
+        snapshot.set(by_device, ["mac-2"], 2)
+        metrics.publish(snapshot)
+        body = self.fetch()[2]
+        self.assertIn(b'test_exposition_by_device{device_name="mac-2"} 2.0', body)
+        self.assertNotIn(b'mac-1', body)
+
+        # a page of nothing but snapshots is served as is until one of them is published again
+        device_registry = CollectorRegistry()
+        device_registry.register(metrics)
+        device_page = MetricsPage(device_registry)
+        self.assertIs(device_page.get().snapshot_page, device_page.get().snapshot_page)
+
+    def publish(self, metrics, by_device, value):
+        snapshot = metrics.new_snapshot()
+        snapshot.set(by_device, ["mac-1"], value)
+        metrics.publish(snapshot)
+        self.page.refresh()
+
+    def make_snapshot_collector(self):
+        metrics = SnapshotCollector()
+        by_device = metrics.gauge('test_exposition_by_device', 'a value per device', ["device_name"])
+        self.registry.register(metrics)
+        return metrics, by_device
+
+    def test_gzip_is_served_when_accepted(self):
+        metrics, by_device = self.make_snapshot_collector()
+        self.publish(metrics, by_device, 1)
+
+        status, headers, body = self.fetch(headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(200, status)
+        self.assertEqual("gzip", headers["Content-Encoding"])
+        # the pre-compressed snapshot part and the live part are members of one gzip stream
+        body = gzip.decompress(body)
+        self.assertIn(b'test_exposition_by_device{device_name="mac-1"} 1.0', body)
+        self.assertIn(b'test_exposition_devices 10.0', body)
+
+        status, headers, body = self.fetch(headers={"Accept-Encoding": "gzip;q=0"})
+        self.assertIsNone(headers["Content-Encoding"])
+        self.assertIn(b'test_exposition_devices 10.0', body)
+
+    def test_conditional_requests(self):
+        # without any snapshot families there's nothing to validate against
+        self.assertIsNone(self.fetch()[1]["ETag"])
+
+        metrics, by_device = self.make_snapshot_collector()
+        self.publish(metrics, by_device, 1)
+        status, headers, body = self.fetch()
+        etag = headers["ETag"]
+
+        self.assertEqual(304, self.fetch(headers={"If-None-Match": etag})[0])
+        self.assertEqual(304, self.fetch(headers={"If-Modified-Since": headers["Last-Modified"]})[0])
+
+        # the validators only follow the collected data, the live metrics are current on every scrape anyway
+        self.gauge.set(30)
+        self.assertEqual(304, self.fetch(headers={"If-None-Match": etag})[0])
+
+        # an identical snapshot keeps its validators
+        self.publish(metrics, by_device, 1)
+        self.assertEqual(304, self.fetch(headers={"If-None-Match": etag})[0])
+
+        self.publish(metrics, by_device, 2)
+        status, headers, body = self.fetch(headers={"If-None-Match": etag})
+        self.assertEqual(200, status)
+        self.assertNotEqual(etag, headers["ETag"])
+
+    def test_unknown_paths_are_not_found(self):
+        self.assertEqual(404, self.fetch(url=self.url + "/nope")[0])
+
+    def test_each_registry_is_served_on_its_own_path(self):
+        device_registry = CollectorRegistry()
+        Gauge('test_exposition_per_device', 'a value per device', ["device_name"], registry=device_registry).labels("mac-1").set(1)
+        httpd = start_metrics_server(0, {"/metrics": self.page, "/metrics/devices": MetricsPage(device_registry)}, addr='127.0.0.1')
+        try:
+            base = f"http://127.0.0.1:{httpd.server_address[1]}"
+            status, headers, body = self.fetch(base + "/metrics")
+            self.assertNotIn(b'test_exposition_per_device', body)
+            status, headers, body = self.fetch(base + "/metrics/devices")
+            self.assertIn(b'test_exposition_per_device{device_name="mac-1"} 1.0', body)
+            self.assertNotIn(b'test_exposition_devices', body)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
@@ -1,5 +1,6 @@
 import unittest
 from extra_metrics.fwrest import FWRestQuery
+from extra_metrics.fwrestendpoint import FWConnectionPool
 # from extra_metrics.config import read_config_helper
 
 
@@ -68,3 +69,44 @@ class FWQueryTestCase(unittest.TestCase):
         self.assertEqual('https://test/api/reports/v1/groups-tree', fq.endpoint_groups_tree())
         self.assertEqual('https://test/api/reports/v1/groups', fq.endpoint_reports_groups())
         self.assertEqual('https://test/api/updates/v1/extended-list?limit=10000', fq.endpoint_web_software_update())
+        self.assertEqual('https://test/api/updates/v1/extended-list?limit=500&offset=1000', fq.endpoint_web_software_update(500, 1000))
+
+    def test_query_owns_a_connection_pool(self):
+        fq = FWRestQuery("a", "b")
+        self.assertIsNotNone(fq.connection_pool)
+
+        shared_pool = FWConnectionPool()
+        fq1 = FWRestQuery("a", "b", connection_pool=shared_pool)
+        fq2 = FWRestQuery("a", "b", connection_pool=shared_pool)
+        self.assertIs(fq1.connection_pool, fq2.connection_pool)
+
+
+class FWConnectionPoolTestCase(unittest.TestCase):
+    def test_one_session_per_host_and_port(self):
+        pool = FWConnectionPool()
+        inv = pool.session_for("https://a:20445/inv/api/v1/query/1")
+        self.assertIs(inv, pool.session_for("https://a:20445/inv/api/v1/query_result/"))
+        web = pool.session_for("https://a/api/config/app")
+        self.assertIsNot(inv, web)
+        self.assertIsNot(web, pool.session_for("https://b/api/config/app"))
+
+    def test_pool_settings_are_applied_to_the_adapter(self):
+        pool = FWConnectionPool(pool_size=4, max_retries=2, backoff_factor=1.5)
+        adapter = pool.session_for("https://a/api/").get_adapter("https://a/api/")
+        self.assertEqual(4, adapter._pool_maxsize)
+        self.assertEqual(2, adapter.max_retries.total)
+        self.assertEqual(1.5, adapter.max_retries.backoff_factor)
+
+    def test_stats_are_reported_per_host(self):
+        pool = FWConnectionPool()
+        pool.session_for("https://a:20445/inv/api/v1/query/1")
+        pool.session_for("https://a/api/config/app")
+
+        families = {f.name: f for f in pool.collect()}
+        self.assertIn("extra_metrics_http_connections_opened", families)
+        self.assertIn("extra_metrics_http_requests_sent", families)
+        hosts = [s.labels["host"] for s in families["extra_metrics_http_requests_per_connection"].samples]
+        self.assertEqual(["a:20445", "a:443"], hosts)
+
+        pool.close()
+        self.assertEqual([], pool.connection_stats())
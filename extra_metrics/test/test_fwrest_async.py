@@ -0,0 +1,107 @@
+import asyncio
+import json
+import time
+import unittest
+
+from extra_metrics.fwrest_async import AsyncFWRestQuery, SoftwareUpdatePageError
+from extra_metrics.test.fake_mocks import FailedRequest, FakeQueryInterface, FakeRequest
+
+
+class SlowQueryInterface(FakeQueryInterface):
+    def get_client_info_j(self):
+        time.sleep(0.2)
+        return {"fields": [], "values": []}
+
+
+class PagedQueryInterface(FakeQueryInterface):
+    def __init__(self, total, failing_offset=None, max_limit=None):
+        super().__init__()
+        self.total = total
+        self.failing_offset = failing_offset
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def get_software_updates_web_ui_page(self, limit, offset):
+        self.in_flight += 1
+        self.max_in_flight = max(self.in_flight, self.max_in_flight)
+        time.sleep(0.02)
+        self.in_flight -= 1
+        if offset == self.failing_offset:
+            return FailedRequest()
+        if self.max_limit is not None:
+            limit = min(limit, self.max_limit)
+        results = [{"id": i} for i in range(offset, min(offset + limit, self.total))]
+        return FakeRequest(json.dumps({"count": self.total, "results": results}))
+
+
+class AsyncFWRestQueryTestCase(unittest.TestCase):
+    def test_methods_delegate_to_the_wrapped_query(self):
+        fw_query = AsyncFWRestQuery(FakeQueryInterface())
+        group, was_created = asyncio.run(fw_query.ensure_inventory_query_group_exists("bob"))
+        self.assertFalse(was_created)
+        self.assertEqual(4, len(asyncio.run(fw_query.get_all_inventory_queries())))
+        self.assertIsNone(asyncio.run(fw_query.get_definition_for_query_id_j(FakeQueryInterface.TEST_QUERY_DATA_INVALID)))
+        r = asyncio.run(fw_query.get_results_for_query_id(FakeQueryInterface.TEST_QUERY_APPS))
+        self.assertEqual(3, len(r.json()["values"]))
+
+    def test_the_event_loop_keeps_running_during_a_request(self):
+        fw_query = AsyncFWRestQuery(SlowQueryInterface())
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        async def run():
+            t = asyncio.ensure_future(ticker())
+            j = await fw_query.get_client_info_j()
+            t.cancel()
+            return j
+
+        j = asyncio.run(run())
+        self.assertEqual([], j["values"])
+        self.assertGreater(ticks, 5)
+
+    def test_software_update_pages_are_fetched_with_bounded_concurrency(self):
+        fake = PagedQueryInterface(total=95)
+        fw_query = AsyncFWRestQuery(fake)
+
+        async def run():
+            ids = []
+            num_pages = 0
+            async for page, num_bytes in fw_query.iter_software_updates_pages(10, 3):
+                num_pages += 1
+                self.assertGreater(num_bytes, 0)
+                ids.extend(item["id"] for item in page["results"])
+            return num_pages, ids
+
+        num_pages, ids = asyncio.run(run())
+        self.assertEqual(10, num_pages)
+        self.assertEqual(list(range(95)), sorted(ids))
+        self.assertLessEqual(fake.max_in_flight, 3)
+        self.assertGreater(fake.max_in_flight, 1)
+
+    def test_a_failed_page_is_an_error_rather_than_a_gap(self):
+        fw_query = AsyncFWRestQuery(PagedQueryInterface(total=95, failing_offset=50))
+
+        async def run():
+            ids = []
+            async for page, _ in fw_query.iter_software_updates_pages(10, 3):
+                ids.extend(item["id"] for item in page["results"])
+            return ids
+
+        with self.assertRaises(SoftwareUpdatePageError):
+            asyncio.run(run())
+
+    def test_a_capped_page_size_is_an_error_rather_than_a_gap(self):
+        fw_query = AsyncFWRestQuery(PagedQueryInterface(total=175, max_limit=40))
+
+        async def run():
+            async for _ in fw_query.iter_software_updates_pages(50, 3):
+                pass
+
+        with self.assertRaises(SoftwareUpdatePageError):
+            asyncio.run(run())
@@ -9,7 +9,7 @@ class FWRESTTestCaseWithMocks(unittest.TestCase):
         self.fq = FWRestQuery("a", "b")
         self.json_for_success = '{ "groups_hierarchy": [ { "name": "bob" }, { "name": "tim" }, { "name": "nobody" } ] }'     
 
-        self.mock_get_patcher = patch('extra_metrics.fwrest.requests.get')
+        self.mock_get_patcher = patch('extra_metrics.fwrestendpoint.requests.Session.get')
         self.mock_get = self.mock_get_patcher.start()
 
     def tearDown(self):
@@ -98,7 +98,7 @@ class FWRESTTestCaseWithMocks(unittest.TestCase):
             data = kwargs["data"]
 
         # lets try one that does NOT exist
-        with patch('extra_metrics.fwrest.requests.post') as post_mock:
+        with patch('extra_metrics.fwrestendpoint.requests.Session.post') as post_mock:
             post_mock.side_effect = capture_the_post_vars
             (new_group, was_created) = self.fq.ensure_inventory_query_group_exists("sam")
             self.assertIsInstance(data, str)
@@ -115,7 +115,7 @@ class FWRESTTestCaseWithMocks(unittest.TestCase):
         result = self.fq.get_all_inventory_queries()
         self.assertIsNone(result)
 
-    @patch('extra_metrics.fwrest.requests.post')
+    @patch('extra_metrics.fwrestendpoint.requests.Session.post')
     def test_get_client_info_j_success_and_failure(self, post_mock):
         post_mock.return_value = Mock(status_code=200)
         post_mock.return_value.json.return_value = "this isn't actually json but wont matter"
@@ -135,3 +135,37 @@ class FWRESTTestCaseWithMocks(unittest.TestCase):
         self.assertRaises(Exception, self.fq.get_software_updates_web_ui_j)
         self.mock_get.return_value.status_code = 205
         self.assertIsNone(self.fq.get_software_updates_web_ui_j())
+
+    @patch('extra_metrics.fwrestendpoint.requests.Session.post')
+    def test_get_client_info_df_streams_the_response(self, post_mock):
+        body = json.dumps({"fields": ["Client_device_name", "Client_filewave_id"],
+                           "values": [["bob", 1], ["tim", 2]]}).encode('utf-8')
+        post_mock.return_value = Mock(status_code=200)
+        post_mock.return_value.iter_content.return_value = [body[i:i + 7] for i in range(0, len(body), 7)]
+        df = self.fq.get_client_info_df()
+        self.assertTrue(post_mock.call_args.kwargs["stream"])
+        self.assertEqual(["bob", "tim"], list(df["Client_device_name"]))
+        post_mock.return_value.close.assert_called()
+
+        post_mock.return_value.status_code = 205
+        self.assertIsNone(self.fq.get_client_info_df())
+
+    @patch('extra_metrics.fwrestendpoint.requests.Session.post')
+    def test_client_info_asks_only_for_the_columns_in_use(self, post_mock):
+        post_mock.return_value = Mock(status_code=200)
+        self.fq.get_client_info_j()
+        self.assertEqual(25, len(json.loads(post_mock.call_args.kwargs["data"])["fields"]))
+
+        self.fq.set_client_info_columns(["Client_filewave_id", "Client_device_name", "Client_filewave_id"])
+        self.fq.get_client_info_j()
+        query = json.loads(post_mock.call_args.kwargs["data"])
+        self.assertEqual([{"column": "device_name", "component": "Client"}, {"column": "filewave_id", "component": "Client"}],
+                         query["fields"])
+        self.assertEqual("Client", query["main_component"])
+        self.assertEqual(2, len(query["criteria"]["expressions"]))
+
+    def test_get_results_for_query_id_df(self):
+        self.mock_get.return_value = Mock(status_code=200)
+        self.mock_get.return_value.iter_content.return_value = [b'{"fields": ["a"], ', b'"values": [[1], [2]]}']
+        df = self.fq.get_results_for_query_id_df(555)
+        self.assertEqual([1, 2], list(df["a"]))
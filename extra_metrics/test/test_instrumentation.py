@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock, patch
+from prometheus_client import REGISTRY
+
+from extra_metrics import instrumentation
+from extra_metrics.exposition import MetricsPage
+from extra_metrics.fwrest_async import AsyncFWRestQuery
+from extra_metrics.package import get_package_resource_json
+from extra_metrics.scheduler import CollectorJob, DagExecutor
+from extra_metrics.softwarepatches import SoftwarePatchStatus
+from extra_metrics.test.fake_mocks import FakeQueryInterface
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels=labels)
+
+    def test_stages_rows_and_bytes_are_recorded_per_collector(self):
+        fw_query = FakeQueryInterface()
+        fw_query.get_software_updates_web_ui_j = MagicMock(
+            return_value=get_package_resource_json("extra_metrics.test", "software-update-testdata.json"))
+        fw_query.get_client_info_j = MagicMock(
+            return_value=get_package_resource_json("extra_metrics.test", "client-software-update-testdata.json"))
+        patches = SoftwarePatchStatus(AsyncFWRestQuery(fw_query))
+
+        dag = DagExecutor([CollectorJob("test_patches", patches.collect_patch_data_status, interval_seconds=60)])
+        asyncio.run(dag.run())
+
+        for stage in ["fetch", "decode", "frame", "aggregate", "publish"]:
+            count = self.sample('extra_metrics_collector_stage_seconds_count', collector="test_patches", stage=stage)
+            self.assertGreater(count, 0, f"no time was recorded for the {stage} stage")
+
+        self.assertGreater(self.sample('extra_metrics_collector_rows', collector="test_patches"), 0)
+        self.assertGreater(self.sample('extra_metrics_collector_payload_bytes', collector="test_patches"), 0)
+        self.assertGreater(self.sample('extra_metrics_collector_peak_memory_bytes', collector="test_patches"), 0)
+        self.assertGreater(self.sample('extra_metrics_collector_last_success_timestamp_seconds', collector="test_patches"), 0)
+
+    def test_a_failed_run_is_not_a_success(self):
+        async def broken():
+            instrumentation.add_rows(10)
+            raise ValueError("server went away")
+
+        dag = DagExecutor([CollectorJob("test_broken", broken, interval_seconds=60)])
+        asyncio.run(dag.run())
+
+        self.assertEqual(10, self.sample('extra_metrics_collector_rows', collector="test_broken"))
+        self.assertIsNone(self.sample('extra_metrics_collector_last_success_timestamp_seconds', collector="test_broken"))
+
+    def test_the_peak_memory_is_not_reset_while_another_collector_runs(self):
+        async def short():
+            await asyncio.sleep(0.01)
+
+        async def long():
+            await asyncio.sleep(0.05)
+
+        dag = DagExecutor([CollectorJob("test_long", long, interval_seconds=60),
+                           CollectorJob("test_short", short, interval_seconds=60)])
+        with patch.object(instrumentation, '_reset_peak_memory') as reset:
+            asyncio.run(dag.run())
+            self.assertEqual(1, reset.call_count)
+            asyncio.run(dag.run(["test_short"]))
+            self.assertEqual(2, reset.call_count)
+
+    def test_nothing_is_recorded_outside_of_a_collection(self):
+        self.assertIsNone(instrumentation.current_stats())
+        with instrumentation.stage(instrumentation.STAGE_FETCH):
+            instrumentation.add_rows(1)
+        self.assertIsNone(instrumentation.current_stats())
+
+    def test_event_loop_lag_is_current_on_every_scrape(self):
+        page = MetricsPage(REGISTRY)
+
+        async def measure(lag):
+            # each reading of the clock is lag seconds after the last, so every wake up is lag seconds late
+            readings = iter(range(1000))
+            monitor = asyncio.ensure_future(instrumentation.monitor_event_loop_lag(0, clock=lambda: next(readings) * lag))
+            for _ in range(3):
+                await asyncio.sleep(0)
+            monitor.cancel()
+
+        asyncio.run(measure(0.5))
+        self.assertIn(b'extra_metrics_event_loop_lag_seconds 0.5', page.get().body)
+        # served as measured, not as it was when a collection last finished
+        asyncio.run(measure(1.5))
+        self.assertIn(b'extra_metrics_event_loop_lag_seconds 1.5', page.get().body)
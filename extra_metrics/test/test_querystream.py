@@ -0,0 +1,80 @@
+import json
+import unittest
+
+from extra_metrics.querystream import QueryResultDecoder, QueryResultDecodeError, decode_query_result
+
+
+def split_into_chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class QueryResultDecoderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.payload = {
+            "offset": 0,
+            "fields": ["Client_device_name", "Client_filewave_id", "Client_location"],
+            "values": [
+                ["hades", 1, None],
+                ["zeus ] \"quoted\" ∑", 2, "office: 1"],
+                ["athena", 3, {"nested": [1, 2]}]
+            ],
+            "filter_results": 3,
+            "total_results": 3,
+            "version": 1
+        }
+        self.data = json.dumps(self.payload, indent=4).encode('utf-8')
+
+    def test_decoding_gives_the_same_result_for_any_chunk_size(self):
+        for chunk_size in [1, 2, 5, 64, len(self.data)]:
+            decoder = decode_query_result(split_into_chunks(self.data, chunk_size), chunk_rows=2)
+            self.assertEqual(self.payload["fields"], decoder.fields)
+            self.assertEqual(3, decoder.num_rows)
+            self.assertEqual(len(self.data), decoder.num_bytes)
+            self.assertEqual({"offset": 0, "filter_results": 3, "total_results": 3, "version": 1}, decoder.extra)
+
+            df = decoder.to_dataframe()
+            self.assertEqual(self.payload["fields"], list(df.columns))
+            self.assertEqual(["hades", "zeus ] \"quoted\" ∑", "athena"], list(df["Client_device_name"]))
+            self.assertEqual([1, 2, 3], list(df["Client_filewave_id"]))
+
+    def test_rows_are_moved_into_columns_in_chunks(self):
+        decoder = QueryResultDecoder(chunk_rows=2)
+        data = self.data.decode('utf-8')
+        values_end = data.index('"athena"')
+        decoder.feed(data[:values_end])
+        # two rows have been seen; so they are in the columns already
+        self.assertEqual(2, decoder.num_rows)
+        self.assertEqual(3, len(decoder.columns))
+        decoder.feed(data[values_end:])
+        decoder.close()
+        self.assertEqual(3, decoder.num_rows)
+
+    def test_rows_with_nested_lists_are_never_cut_short(self):
+        # every prefix of the payload is fed in turn, so the batch decode is tried at every '],' there is
+        fields = ["name", "tags", "more_tags"]
+        values = [["x", [0], [0]], ["a", [1], [2, [3]]], ["b", [], [[4], 5]]]
+        data = json.dumps({"fields": fields, "values": values}, separators=(',', ':'))
+        decoder = decode_query_result(list(data), chunk_rows=1)
+        self.assertEqual(values, decoder.to_dataframe().values.tolist())
+
+        # a batch is only taken when every row in it has a value per field
+        decoder = QueryResultDecoder()
+        decoder.fields = fields
+        decoder._buffer = '["x",[0],[0]],["a",[1]],'
+        self.assertIsNone(decoder._decode_batch_of_rows(0))
+        decoder._buffer = '["x",[0],[0]],["a",[1],[2]],'
+        self.assertEqual(len(decoder._buffer), decoder._decode_batch_of_rows(0))
+
+    def test_values_before_fields_and_empty_values(self):
+        decoder = decode_query_result([b'{"values": [], "fields": ["a", "b"]}'])
+        df = decoder.to_dataframe()
+        self.assertEqual(0, len(df))
+        self.assertEqual(["a", "b"], list(df.columns))
+
+    def test_truncated_or_invalid_payloads_raise(self):
+        with self.assertRaises(QueryResultDecodeError):
+            decode_query_result([self.data[:-10]])
+        with self.assertRaises(QueryResultDecodeError):
+            decode_query_result([b'["not", "an", "object"]'])
+        with self.assertRaises(QueryResultDecodeError):
+            decode_query_result([b'{"values": [[1, 2]]}'])
@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock
+from prometheus_client import REGISTRY
+
+from extra_metrics.fwrest_async import AsyncFWRestQuery
+from extra_metrics.responsecache import CycleResponseCache
+from extra_metrics.test.fake_mocks import FakeQueryInterface
+
+
+def cache_lookups(method_name, result):
+    value = REGISTRY.get_sample_value('extra_metrics_response_cache_requests_total',
+                                      labels={"method": method_name, "result": result})
+    return value if value is not None else 0
+
+
+class CycleResponseCacheTestCase(unittest.TestCase):
+    def test_concurrent_callers_share_one_request(self):
+        cache = CycleResponseCache()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"values": [1, 2, 3]}
+
+        async def run():
+            return await asyncio.gather(*[cache.get_or_fetch("test_single_flight", (), fetch) for _ in range(5)])
+
+        hits_before = cache_lookups("test_single_flight", "hit")
+        results = asyncio.run(run())
+        self.assertEqual(1, calls)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertEqual(4, cache_lookups("test_single_flight", "hit") - hits_before)
+
+    def test_failures_are_not_cached(self):
+        cache = CycleResponseCache()
+        attempts = 0
+
+        async def fetch():
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise ValueError("server went away")
+            return "ok"
+
+        with self.assertRaises(ValueError):
+            asyncio.run(cache.get_or_fetch("test_failures", (), fetch))
+        self.assertEqual(0, len(cache))
+        self.assertEqual("ok", asyncio.run(cache.get_or_fetch("test_failures", (), fetch)))
+
+    def test_a_failed_response_is_not_cached(self):
+        fake = FakeQueryInterface()
+        # a non-200 response comes back as None
+        fake.get_client_info_j = MagicMock(side_effect=[None, {"fields": [], "values": []}])
+        fw_query = AsyncFWRestQuery(fake)
+
+        self.assertIsNone(asyncio.run(fw_query.get_client_info_j()))
+        self.assertEqual([], asyncio.run(fw_query.get_client_info_j())["values"])
+        self.assertEqual(2, fake.get_client_info_j.call_count)
+
+    def test_new_cycle_forgets_previous_responses(self):
+        cache = CycleResponseCache()
+
+        async def fetch():
+            return "data"
+
+        asyncio.run(cache.get_or_fetch("test_new_cycle", (1,), fetch))
+        asyncio.run(cache.get_or_fetch("test_new_cycle", (2,), fetch))
+        self.assertEqual(2, len(cache))
+        cache.new_cycle()
+        self.assertEqual(0, len(cache))
+
+    def test_client_info_is_fetched_once_per_cycle(self):
+        fake = FakeQueryInterface()
+        fake.get_client_info_j = MagicMock(return_value={"fields": [], "values": []})
+        fw_query = AsyncFWRestQuery(fake)
+
+        async def run():
+            await asyncio.gather(fw_query.get_client_info_j(), fw_query.get_client_info_j())
+            await fw_query.get_client_info_j()
+
+        asyncio.run(run())
+        self.assertEqual(1, fake.get_client_info_j.call_count)
+
+        fw_query.new_cycle()
+        asyncio.run(run())
+        self.assertEqual(2, fake.get_client_info_j.call_count)
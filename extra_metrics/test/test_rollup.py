@@ -0,0 +1,61 @@
+import io
+import random
+import unittest
+import pandas as pd
+
+from extra_metrics.config import ExtraMetricsConfiguration
+from extra_metrics.rollup import RollupDimension, RollupEngine
+
+
+class RollupEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(3)
+        self.df = pd.DataFrame({
+            "Client_filewave_id": [rng.choice([None, 1, 2, 3, 4]) for _ in range(500)],
+            "OperatingSystem_name": [rng.choice([None, "macOS", "Windows", "Chrome OS"]) for _ in range(500)],
+            "OperatingSystem_version": [rng.choice([None, "10.15", "11.1", "14.1"]) for _ in range(500)],
+            "Client_is_tracking_enabled": [rng.choice([True, False]) for _ in range(500)],
+        })
+
+    def grouped(self, columns):
+        counts = self.df.groupby(columns)["Client_filewave_id"].count()
+        return [(key if isinstance(key, tuple) else (key,), int(count)) for key, count in counts.items() if count > 0]
+
+    def test_every_dimension_matches_a_groupby_count(self):
+        dimensions = [
+            RollupDimension("platform", ["OperatingSystem_name"]),
+            RollupDimension("tracked", ["Client_is_tracking_enabled"]),
+            RollupDimension("os_version", ["OperatingSystem_name", "OperatingSystem_version"]),
+        ]
+        results = RollupEngine(dimensions).run(self.df)
+        for dimension in dimensions:
+            self.assertEqual(self.grouped(dimension.columns), results[dimension.name], dimension.name)
+
+    def test_worker_processes_give_the_same_counts(self):
+        dimensions = [
+            RollupDimension("platform", ["OperatingSystem_name"]),
+            RollupDimension("os_version", ["OperatingSystem_name", "OperatingSystem_version"]),
+        ]
+        engine = RollupEngine(dimensions, processes=2, min_partitioned_rows=0)
+        try:
+            self.assertEqual(RollupEngine(dimensions).run(self.df), engine.run(self.df))
+        finally:
+            engine.shutdown()
+
+    def test_unknown_columns_are_skipped(self):
+        results = RollupEngine([RollupDimension("nope", ["Client_nope"]),
+                                RollupDimension("platform", ["OperatingSystem_name"])]).run(self.df)
+        self.assertEqual(["platform"], list(results.keys()))
+
+    def test_rollups_are_read_from_the_configuration(self):
+        cfg = ExtraMetricsConfiguration()
+        cfg.read_configuration(io.StringIO('''
+            [extra_metrics]
+            fw_device_rollups = os_version: OperatingSystem_name, OperatingSystem_version; upstream:Client_current_upstream_host;
+            '''))
+        rollups = [("os_version", ["OperatingSystem_name", "OperatingSystem_version"]), ("upstream", ["Client_current_upstream_host"])]
+        self.assertEqual(rollups, cfg.get_device_rollups())
+
+        cfg.set_device_rollups(rollups[:1])
+        self.assertEqual(rollups[:1], cfg.get_device_rollups())
+        self.assertEqual([], ExtraMetricsConfiguration().get_device_rollups())
@@ -0,0 +1,174 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import MagicMock
+from prometheus_client import REGISTRY
+
+from extra_metrics.fwrest_async import AsyncFWRestQuery
+from extra_metrics.responsecache import CycleResponseCache
+from extra_metrics.scheduler import CollectionScheduler, CollectorJob, DagExecutor
+from extra_metrics.test.fake_mocks import FakeQueryInterface
+
+
+class CollectionSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.runs = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def collect(self):
+        self.in_flight += 1
+        self.max_in_flight = max(self.in_flight, self.max_in_flight)
+        self.runs.append((time.monotonic(), time.monotonic() + 0.05))
+        await asyncio.sleep(0.05)
+        self.in_flight -= 1
+
+    def run_scheduler(self, scheduler, events, duration):
+        # events is a list of (delay, reason) fired at the scheduler while it runs
+        async def fire_events():
+            for delay, reason in events:
+                await asyncio.sleep(delay)
+                scheduler.trigger(reason)
+
+        async def run():
+            task = asyncio.ensure_future(scheduler.run_forever())
+            await fire_events()
+            await asyncio.sleep(duration)
+            task.cancel()
+
+        asyncio.run(run())
+
+    def test_first_run_is_immediate_and_bursts_are_coalesced(self):
+        scheduler = CollectionScheduler("test_burst", self.collect, interval_seconds=60,
+                                        debounce_seconds=0.1, min_spacing_seconds=0)
+        burst = [(0.1, "/server/update_model_finished")] + [(0.01, "/api/auditlog")] * 5
+        self.run_scheduler(scheduler, burst, 0.4)
+
+        # one run on start up, one for the whole burst
+        self.assertEqual(2, len(self.runs))
+        skipped = REGISTRY.get_sample_value('extra_metrics_scheduler_skipped_triggers_total', labels={"collector": "test_burst"})
+        self.assertEqual(5, skipped)
+        self.assertEqual(0, REGISTRY.get_sample_value('extra_metrics_scheduler_pending_triggers', labels={"collector": "test_burst"}))
+
+    def test_runs_never_overlap_and_are_spaced_out(self):
+        scheduler = CollectionScheduler("test_spacing", self.collect, interval_seconds=60,
+                                        debounce_seconds=0, min_spacing_seconds=0.2)
+        # these all arrive while the first run is still going
+        self.run_scheduler(scheduler, [(0.01, "a"), (0.01, "b"), (0.01, "c")], 0.5)
+
+        self.assertEqual(1, self.max_in_flight)
+        self.assertEqual(2, len(self.runs))
+        first_finished = self.runs[0][1]
+        second_started = self.runs[1][0]
+        self.assertGreaterEqual(second_started - first_finished, 0.19)
+
+    def test_runs_when_the_interval_passes(self):
+        scheduler = CollectionScheduler("test_interval", self.collect, interval_seconds=0.1,
+                                        debounce_seconds=10, min_spacing_seconds=0)
+        self.run_scheduler(scheduler, [], 0.4)
+        self.assertGreaterEqual(len(self.runs), 3)
+        runs = REGISTRY.get_sample_value('extra_metrics_scheduler_runs_total', labels={"collector": "test_interval", "reason": "interval"})
+        self.assertEqual(len(self.runs), runs)
+
+    def test_a_failed_run_does_not_stop_the_scheduler(self):
+        async def broken_collect():
+            self.runs.append(time.monotonic())
+            raise ValueError("server went away")
+
+        scheduler = CollectionScheduler("test_failure", broken_collect, interval_seconds=0.05,
+                                        debounce_seconds=0, min_spacing_seconds=0)
+        self.run_scheduler(scheduler, [], 0.2)
+        self.assertGreaterEqual(len(self.runs), 2)
+
+
+class DagExecutorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.cycles = 0
+
+    def make_job(self, name, depends_on=None, delay=0.05, fail=False):
+        async def collect():
+            self.events.append(("start", name))
+            await asyncio.sleep(delay)
+            self.events.append(("end", name))
+            if fail:
+                raise ValueError(f"{name} failed")
+        return CollectorJob(name, collect, interval_seconds=60, depends_on=depends_on)
+
+    def new_response_cache(self):
+        self.cycles += 1
+        return CycleResponseCache()
+
+    def test_dependencies_run_first_and_independent_jobs_overlap(self):
+        dag = DagExecutor([
+            self.make_job("devices", depends_on=["patches"]),
+            self.make_job("patches"),
+            self.make_job("apps"),
+        ], new_response_cache=self.new_response_cache)
+        self.assertEqual(["patches", "devices", "apps"], dag.order)
+
+        asyncio.run(dag.run())
+
+        self.assertLess(self.events.index(("end", "patches")), self.events.index(("start", "devices")))
+        # apps doesn't depend on anything, so it runs alongside patches
+        self.assertLess(self.events.index(("start", "apps")), self.events.index(("end", "patches")))
+        # devices shares the responses of the patches run it waited on, apps has its own
+        self.assertEqual(2, self.cycles)
+
+    def test_a_failed_dependency_does_not_stop_the_dependant(self):
+        dag = DagExecutor([
+            self.make_job("patches", fail=True),
+            self.make_job("devices", depends_on=["patches"]),
+        ])
+        asyncio.run(dag.run())
+        self.assertIn(("end", "devices"), self.events)
+
+    def test_a_triggered_job_waits_for_its_running_dependency(self):
+        dag = DagExecutor([
+            self.make_job("patches", delay=0.1),
+            self.make_job("devices", depends_on=["patches"]),
+        ], new_response_cache=self.new_response_cache)
+
+        async def run():
+            patches = asyncio.ensure_future(dag.run_job("patches"))
+            await asyncio.sleep(0.01)
+            self.assertTrue(dag.is_active("patches"))
+            # a second request for patches shares the run that's in progress
+            await asyncio.gather(dag.run_job("devices"), dag.run_job("patches"), patches)
+
+        asyncio.run(run())
+        self.assertEqual([("start", "patches"), ("end", "patches"), ("start", "devices"), ("end", "devices")], self.events)
+        self.assertEqual(1, self.cycles)
+        self.assertFalse(dag.is_active("patches"))
+
+    def test_responses_are_not_shared_with_a_later_run_of_the_same_job(self):
+        fake = FakeQueryInterface()
+        fake.get_client_info_j = MagicMock(return_value={"fields": [], "values": []})
+        fw_query = AsyncFWRestQuery(fake)
+
+        async def devices():
+            await fw_query.get_client_info_j()
+
+        dag = DagExecutor([
+            self.make_job("apps", delay=0.1),
+            CollectorJob("devices", devices, interval_seconds=60),
+        ], new_response_cache=self.new_response_cache)
+
+        async def run():
+            apps = asyncio.ensure_future(dag.run_job("apps"))
+            await asyncio.sleep(0.01)
+            # both runs happen while apps is still running; the second must see the server's latest
+            await dag.run_job("devices")
+            await dag.run_job("devices")
+            self.assertTrue(dag.is_active("apps"))
+            await apps
+
+        asyncio.run(run())
+        self.assertEqual(2, fake.get_client_info_j.call_count)
+        self.assertEqual(3, self.cycles)
+
+    def test_bad_dependencies_are_rejected(self):
+        with self.assertRaises(ValueError):
+            DagExecutor([self.make_job("a", depends_on=["b"]), self.make_job("b", depends_on=["a"])])
+        with self.assertRaises(ValueError):
+            DagExecutor([self.make_job("a", depends_on=["missing"])])
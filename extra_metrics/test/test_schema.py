@@ -0,0 +1,42 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import MagicMock
+from prometheus_client import REGISTRY
+
+from extra_metrics.devices import PerDeviceStatus
+from extra_metrics.fwrest_async import AsyncFWRestQuery
+from extra_metrics.rollup import RollupDimension
+from extra_metrics.schema import build_client_info_query, field_from_name
+from extra_metrics.softwarepatches import SoftwarePatchStatus
+from extra_metrics.test.fake_mocks import FakeQueryInterface
+
+
+class ClientInfoSchemaTestCase(unittest.TestCase):
+    def test_fields_keep_the_query_order_and_extra_ones_go_last(self):
+        query = json.loads(build_client_info_query(["OperatingSystem_name", "Client_custom_field", "Client_device_name", "nonsense"]))
+        self.assertEqual([{"column": "device_name", "component": "Client"},
+                          {"column": "name", "component": "OperatingSystem"},
+                          {"column": "custom_field", "component": "Client"}], query["fields"])
+
+        with self.assertRaises(ValueError):
+            field_from_name("Client_")
+
+    def test_devices_are_collected_from_just_the_declared_columns_in_any_order(self):
+        per_device = PerDeviceStatus(None, rollups=[RollupDimension("test_schema_os", ["OperatingSystem_name"])])
+        fields = list(reversed(dict.fromkeys(SoftwarePatchStatus.CLIENT_INFO_COLUMNS + per_device.client_info_columns())))
+        values = []
+        for device_id, os_name in enumerate(["macOS", "macOS", "Windows"]):
+            row = {f: None for f in fields}
+            row.update({"Client_device_name": f"device-{device_id}", "Client_filewave_id": device_id, "OperatingSystem_name": os_name})
+            values.append([row[f] for f in fields])
+
+        fw_query = FakeQueryInterface()
+        fw_query.get_client_info_j = MagicMock(return_value={"fields": fields, "values": values})
+        per_device.fw_query = AsyncFWRestQuery(fw_query)
+        asyncio.run(per_device.collect_client_data(SoftwarePatchStatus(None)))
+
+        self.assertEqual(2, REGISTRY.get_sample_value('extra_metrics_devices_by_rollup', labels={"rollup": "test_schema_os", "value": "macOS"}))
+        self.assertEqual(1, REGISTRY.get_sample_value('extra_metrics_devices_by_rollup', labels={"rollup": "test_schema_os", "value": "Windows"}))
+        # none of them have checked in
+        self.assertEqual(3, REGISTRY.get_sample_value('extra_metrics_devices_by_checkin_days', labels={"days": "More than 30"}))
@@ -0,0 +1,55 @@
+import unittest
+from prometheus_client import CollectorRegistry
+
+from extra_metrics.snapshot import SnapshotCollector
+
+
+class SnapshotCollectorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.metrics = SnapshotCollector()
+        self.by_device = self.metrics.gauge('test_snapshot_by_device', 'a value per device', ["device_name"])
+        self.total = self.metrics.gauge('test_snapshot_total', 'a single value')
+        self.registry.register(self.metrics)
+
+    def test_nothing_is_exposed_until_a_snapshot_is_published(self):
+        snapshot = self.metrics.new_snapshot()
+        snapshot.set(self.by_device, ["mac-1"], 3)
+        self.assertIsNone(self.registry.get_sample_value('test_snapshot_by_device', labels={"device_name": "mac-1"}))
+
+        self.metrics.publish(snapshot)
+        self.assertEqual(3, self.registry.get_sample_value('test_snapshot_by_device', labels={"device_name": "mac-1"}))
+
+    def test_stale_series_disappear_with_the_next_snapshot(self):
+        snapshot = self.metrics.new_snapshot()
+        snapshot.set(self.by_device, ["mac-1"], 1)
+        snapshot.set(self.by_device, ["mac-2"], 2)
+        snapshot.set(self.total, [], 2)
+        self.metrics.publish(snapshot)
+
+        snapshot = self.metrics.new_snapshot()
+        snapshot.set(self.by_device, ["mac-2"], 5)
+        # setting the same labels again keeps the last value, just like a Gauge
+        snapshot.set(self.by_device, ["mac-2"], 6)
+        snapshot.set(self.total, [], 1)
+        self.metrics.publish(snapshot)
+
+        self.assertIsNone(self.registry.get_sample_value('test_snapshot_by_device', labels={"device_name": "mac-1"}))
+        self.assertEqual(6, self.registry.get_sample_value('test_snapshot_by_device', labels={"device_name": "mac-2"}))
+        self.assertEqual(1, self.registry.get_sample_value('test_snapshot_total'))
+        self.assertEqual(2, self.metrics.snapshot.num_series())
+
+    def test_names_are_checked_for_duplicates_when_registered(self):
+        duplicate = SnapshotCollector()
+        duplicate.gauge('test_snapshot_total', 'the same name again')
+        with self.assertRaises(ValueError):
+            self.registry.register(duplicate)
+
+    def test_a_prepared_snapshot_is_published_without_building_it_again(self):
+        snapshot = self.metrics.new_snapshot()
+        snapshot.set(self.by_device, ["mac-1"], 3)
+        families = self.metrics.prepare(snapshot).families(self.metrics.gauges)
+
+        self.metrics.publish(snapshot)
+        self.assertIs(families, self.metrics.collect())
+        self.assertEqual(3, self.registry.get_sample_value('test_snapshot_by_device', labels={"device_name": "mac-1"}))
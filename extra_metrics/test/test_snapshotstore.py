@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+from prometheus_client import CollectorRegistry, generate_latest
+
+from extra_metrics.exposition import MetricsPage
+from extra_metrics.snapshot import SnapshotCollector
+from extra_metrics.snapshotstore import SnapshotStore
+
+
+def make_collector(device_labels=("device_name",)):
+    metrics = SnapshotCollector()
+    by_device = metrics.gauge('test_store_by_device', 'a value per device', device_labels)
+    by_state = metrics.gauge('test_store_by_state', 'a value per platform and state', ["platform", "state"])
+    total = metrics.gauge('test_store_total', 'a single value')
+    metrics.gauge('test_store_empty', 'never set', ["device_name"])
+    return metrics, by_device, by_state, total
+
+
+class SnapshotStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "snapshot.bin")
+        self.now = 1000000.0
+
+        self.metrics, by_device, by_state, total = make_collector()
+        snapshot = self.metrics.new_snapshot()
+        for n in range(50):
+            snapshot.set(by_device, [f"mac-{n}"], n * 1.5)
+            snapshot.set(by_state, ["macOS" if n % 2 else "Windows", "Installed"], n)
+        snapshot.set(total, [], 50)
+        self.metrics.publish(snapshot, published_at=self.now - 120)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_store(self, metrics, max_age_seconds=86400):
+        return SnapshotStore(self.path, {"test": metrics}, max_age_seconds=max_age_seconds, clock=lambda: self.now)
+
+    def test_a_restart_serves_the_saved_snapshot(self):
+        self.assertTrue(self.make_store(self.metrics).save())
+
+        restarted, _, _, _ = make_collector()
+        registry = CollectorRegistry()
+        registry.register(restarted)
+        store = self.make_store(restarted)
+        registry.register(store)
+        self.assertEqual(1, store.load())
+
+        self.assertEqual(generate_latest_of(self.metrics), generate_latest(registry).decode().split("# HELP extra_metrics_snapshot")[0])
+        self.assertEqual(120, registry.get_sample_value('extra_metrics_snapshot_age_seconds', labels={"collector": "test", "source": "disk"}))
+
+        # the first live cycle takes over
+        restarted.publish(restarted.new_snapshot(), published_at=self.now - 5)
+        self.assertEqual(5, registry.get_sample_value('extra_metrics_snapshot_age_seconds', labels={"collector": "test", "source": "live"}))
+        self.assertIsNone(registry.get_sample_value('extra_metrics_snapshot_age_seconds', labels={"collector": "test", "source": "disk"}))
+
+    def test_unchanged_snapshots_are_not_written_again(self):
+        store = self.make_store(self.metrics)
+        self.assertTrue(store.save())
+        self.assertFalse(store.save())
+        self.metrics.publish(self.metrics.new_snapshot())
+        self.assertTrue(store.save())
+
+    def test_old_or_changed_metrics_are_not_restored(self):
+        self.make_store(self.metrics).save()
+
+        restarted, _, by_state, _ = make_collector()
+        self.assertEqual(0, self.make_store(restarted, max_age_seconds=60).load())
+        self.assertIsNone(restarted.published_at)
+
+        # an upgrade gave a gauge another label; the rest of the collector's metrics are still restored
+        restarted, by_device, by_state, _ = make_collector(device_labels=("device_name", "serial"))
+        self.assertEqual(1, self.make_store(restarted).load())
+        self.assertEqual({}, restarted.snapshot.series(by_device))
+        self.assertEqual(self.metrics.snapshot.series(self.metrics.gauges[1]), restarted.snapshot.series(by_state))
+
+    def test_a_damaged_file_is_ignored(self):
+        with open(self.path, 'wb') as f:
+            f.write(b"EMSNAP01\xff\xff")
+        restarted, _, _, _ = make_collector()
+        self.assertEqual(0, self.make_store(restarted).load())
+        self.assertIsNone(restarted.published_at)
+
+    def test_the_age_is_current_on_every_scrape(self):
+        registry = CollectorRegistry()
+        registry.register(self.metrics)
+        registry.register(self.make_store(self.metrics))
+        page = MetricsPage(registry)
+        self.assertIn(b'extra_metrics_snapshot_age_seconds{collector="test",source="live"} 120.0', page.get().body)
+
+        # the snapshot stays the same, its age keeps growing between collections
+        self.now += 30
+        self.assertIn(b'extra_metrics_snapshot_age_seconds{collector="test",source="live"} 150.0', page.get().body)
+
+
+def generate_latest_of(collector):
+    registry = CollectorRegistry()
+    registry.register(collector)
+    return generate_latest(registry).decode()
@@ -1,8 +1,13 @@
+import asyncio
+import copy
+import random
 import unittest
 from unittest.mock import MagicMock
 from extra_metrics.package import get_package_resource_json
-from extra_metrics.test.fake_mocks import FakeQueryInterface
-from extra_metrics.softwarepatches import SoftwarePatchStatus
+from extra_metrics.test.fake_mocks import FailedRequest, FakeQueryInterface
+from extra_metrics.exposition import DEVICE_REGISTRY
+from extra_metrics.softwarepatches import SoftwarePatchStatus, PatchStateTable, software_patch_metrics
+from extra_metrics.fwrest_async import AsyncFWRestQuery
 from prometheus_client import REGISTRY
 
 
@@ -18,8 +23,8 @@ class TestEval21SoftwarePatch(unittest.TestCase):
     def test_that_software_patch_data_totals_are_correct(self):
         self.fw_query.get_software_updates_web_ui_j = MagicMock(return_value=self.json_data)
         self.fw_query.get_client_info_j = MagicMock(return_value=self.client_data)
-        mgr = SoftwarePatchStatus(self.fw_query)
-        mgr.collect_patch_data_status()
+        mgr = SoftwarePatchStatus(AsyncFWRestQuery(self.fw_query))
+        asyncio.run(mgr.collect_patch_data_status())
 
 
 class TestSoftwarePatchFetching(unittest.TestCase):
@@ -33,14 +38,14 @@ class TestSoftwarePatchFetching(unittest.TestCase):
         self.fw_query = FakeQueryInterface()
 
     def test_that_zero_data_doesnt_cause_bad_things(self):
-        mgr = SoftwarePatchStatus(self.fw_query)
-        mgr.collect_patch_data_status()
+        mgr = SoftwarePatchStatus(AsyncFWRestQuery(self.fw_query))
+        asyncio.run(mgr.collect_patch_data_status())
 
     def test_that_software_patch_data_totals_are_correct(self):
         self.fw_query.get_software_updates_web_ui_j = MagicMock(return_value=self.json_data)
         self.fw_query.get_client_info_j = MagicMock(return_value=self.client_data)
-        mgr = SoftwarePatchStatus(self.fw_query)
-        data = mgr.collect_patch_data_status()
+        mgr = SoftwarePatchStatus(AsyncFWRestQuery(self.fw_query))
+        data = asyncio.run(mgr.collect_patch_data_status())
 
         # for i in data["results"]:
         #     c = i["assigned_devices"]["assigned"]["count"]
@@ -78,3 +83,156 @@ class TestSoftwarePatchFetching(unittest.TestCase):
         self.assertEqual(device.get_counter(False).remaining, 4)
 
         # TODO: pick out a device and check it has the right number of outstanding updates...
+
+    def test_that_paged_fetching_gives_the_same_totals(self):
+        self.fw_query.get_software_updates_web_ui_j = MagicMock(return_value=self.json_data)
+        self.fw_query.get_client_info_j = MagicMock(return_value=self.client_data)
+        mgr = SoftwarePatchStatus(AsyncFWRestQuery(self.fw_query), page_size=3, max_concurrency=2)
+        data = asyncio.run(mgr.collect_patch_data_status())
+        self.assertEqual(len(self.json_data["results"]), len(data))
+
+        after = REGISTRY.get_sample_value('extra_metrics_software_updates_by_state', labels={"state": "Unassigned"})
+        self.assertEqual(after, 175, "the number of Unassigned software updates is incorrect")
+        after = REGISTRY.get_sample_value('extra_metrics_software_updates_by_state', labels={"state": "Completed"})
+        self.assertEqual(after, 8, "the number of Completed software updates is incorrect")
+
+        num_pages = (len(self.json_data["results"]) + 2) // 3
+        self.assertEqual(num_pages, REGISTRY.get_sample_value('extra_metrics_software_updates_pages'))
+        self.assertGreater(REGISTRY.get_sample_value('extra_metrics_software_updates_bytes'), 0)
+
+        device = mgr.get_perdevice_state(7)
+        self.assertEqual(device.get_counter(False).remaining, 4)
+
+    def test_device_names_are_only_kept_for_current_devices(self):
+        self.fw_query.get_software_updates_web_ui_j = MagicMock(return_value=self.json_data)
+        self.fw_query.get_client_info_j = MagicMock(return_value=self.client_data)
+        mgr = SoftwarePatchStatus(AsyncFWRestQuery(self.fw_query))
+        mgr.get_perdevice_state(4242).client_name = "deleted-mac"
+        asyncio.run(mgr.collect_patch_data_status())
+        self.assertIsNone(mgr.get_perdevice_state(4242).client_name)
+        self.assertEqual("TinyAir", mgr.get_perdevice_state(633).client_name)
+
+    def test_an_empty_catalog_removes_every_update(self):
+        self.fw_query.get_software_updates_web_ui_j = MagicMock(return_value=self.json_data)
+        self.fw_query.get_client_info_j = MagicMock(return_value=self.client_data)
+        mgr = SoftwarePatchStatus(AsyncFWRestQuery(self.fw_query), page_size=50)
+        asyncio.run(mgr.collect_patch_data_status())
+        self.assertEqual(4, mgr.get_perdevice_counters(7, False).remaining)
+
+        self.fw_query.get_software_updates_web_ui_j = MagicMock(return_value={"results": []})
+        mgr.fw_query = AsyncFWRestQuery(self.fw_query)
+        asyncio.run(mgr.collect_patch_data_status())
+        self.assertEqual({}, mgr.update_contributions)
+        self.assertEqual(0, mgr.get_perdevice_counters(7, False).remaining)
+        self.assertEqual(175, REGISTRY.get_sample_value('extra_metrics_software_updates_changed', labels={"change": "removed"}))
+        self.assertEqual(0, DEVICE_REGISTRY.get_sample_value('extra_metrics_software_updates_remaining_by_device',
+                                                             labels={"device_name": "TinyAir", "device_id": "633", "is_update_critical": "False"}))
+
+    def test_a_failed_page_leaves_the_previous_cycle_in_place(self):
+        self.fw_query.get_software_updates_web_ui_j = MagicMock(return_value=self.json_data)
+        self.fw_query.get_client_info_j = MagicMock(return_value=self.client_data)
+        mgr = SoftwarePatchStatus(AsyncFWRestQuery(self.fw_query), page_size=50)
+        asyncio.run(mgr.collect_patch_data_status())
+        published = software_patch_metrics.snapshot
+
+        pages = self.fw_query.get_software_updates_web_ui_page
+        self.fw_query.get_software_updates_web_ui_page = lambda limit, offset: FailedRequest() if offset == 50 else pages(limit, offset)
+        mgr.fw_query = AsyncFWRestQuery(self.fw_query)
+        self.assertIsNone(asyncio.run(mgr.collect_patch_data_status()))
+
+        self.assertIs(published, software_patch_metrics.snapshot)
+        self.assertEqual(175, len(mgr.update_contributions))
+        self.assertEqual(4, mgr.get_perdevice_counters(7, False).remaining)
+        self.assertEqual(175, REGISTRY.get_sample_value('extra_metrics_software_updates_by_state', labels={"state": "Unassigned"}))
+
+    def test_an_update_on_two_pages_is_counted_once(self):
+        self.fw_query.get_software_updates_web_ui_j = MagicMock(return_value=self.json_data)
+        self.fw_query.get_client_info_j = MagicMock(return_value=self.client_data)
+        mgr = SoftwarePatchStatus(AsyncFWRestQuery(self.fw_query), page_size=50)
+        asyncio.run(mgr.collect_patch_data_status())
+        expected = {state: REGISTRY.get_sample_value('extra_metrics_software_updates_by_state', labels={"state": state})
+                    for state in ["Unassigned", "Remaining", "Completed"]}
+
+        # the list moved by one between pages, the last update of the first page is on the second too
+        pages = self.fw_query.get_software_updates_web_ui_page
+        self.fw_query.get_software_updates_web_ui_page = lambda limit, offset: pages(limit + 1, offset - 1) if offset > 0 else pages(limit, offset)
+        mgr = SoftwarePatchStatus(AsyncFWRestQuery(self.fw_query), page_size=50)
+        asyncio.run(mgr.collect_patch_data_status())
+
+        self.assertEqual(175, len(mgr.update_contributions))
+        for state, value in expected.items():
+            self.assertEqual(value, REGISTRY.get_sample_value('extra_metrics_software_updates_by_state', labels={"state": state}))
+
+    def test_only_changed_updates_are_reapplied_and_the_result_is_the_same(self):
+        self.fw_query.get_client_info_j = MagicMock(return_value=self.client_data)
+        self.fw_query.get_software_updates_web_ui_j = MagicMock(return_value=self.json_data)
+        mgr = SoftwarePatchStatus(AsyncFWRestQuery(self.fw_query), page_size=50)
+        asyncio.run(mgr.collect_patch_data_status())
+        self.assertEqual(175, REGISTRY.get_sample_value('extra_metrics_software_updates_changed', labels={"change": "added"}))
+
+        asyncio.run(mgr.collect_patch_data_status())
+        for change in ["added", "changed", "removed"]:
+            self.assertEqual(0, REGISTRY.get_sample_value('extra_metrics_software_updates_changed', labels={"change": change}))
+
+        # one update goes away, one has a device finish installing and one becomes critical
+        changed_data = copy.deepcopy(self.json_data)
+        results = changed_data["results"]
+        del results[0]
+        moved = next(item for item in results if len(item["assigned_devices"]["remaining"]["device_ids"]) > 0)
+        device_id = moved["assigned_devices"]["remaining"]["device_ids"].pop()
+        moved["assigned_devices"]["completed"]["device_ids"].append(device_id)
+        results[-1]["critical"] = not results[-1]["critical"]
+        changed_data["count"] = len(results)
+
+        self.fw_query.get_software_updates_web_ui_j = MagicMock(return_value=changed_data)
+        asyncio.run(mgr.collect_patch_data_status())
+        self.assertEqual(0, REGISTRY.get_sample_value('extra_metrics_software_updates_changed', labels={"change": "added"}))
+        self.assertEqual(2, REGISTRY.get_sample_value('extra_metrics_software_updates_changed', labels={"change": "changed"}))
+        self.assertEqual(1, REGISTRY.get_sample_value('extra_metrics_software_updates_changed', labels={"change": "removed"}))
+
+        from_scratch = SoftwarePatchStatus(AsyncFWRestQuery(self.fw_query), page_size=50)
+        asyncio.run(from_scratch.collect_patch_data_status())
+        mgr.patch_state.flush()
+        from_scratch.patch_state.flush()
+        self.assertTrue((mgr.patch_state.counts == from_scratch.patch_state.counts).all())
+
+
+class TestPatchStateTable(unittest.TestCase):
+    def test_bulk_adds_match_counting_one_device_at_a_time(self):
+        rng = random.Random(7)
+        table = PatchStateTable(capacity=4)
+        expected = {}
+        for _ in range(200):
+            ids = [rng.randint(0, 5000) for _ in range(rng.randint(0, 30))]
+            is_critical = rng.random() < 0.3
+            state = rng.randrange(PatchStateTable.NUM_STATES)
+            table.add(ids, is_critical, state)
+            for device_id in ids:
+                key = (device_id, is_critical, state)
+                expected[key] = expected.get(key, 0) + 1
+
+        for (device_id, is_critical, state), count in expected.items():
+            self.assertEqual(count, table.get(device_id, is_critical, state))
+        self.assertEqual(sum(expected.values()), int(table.counts.sum()))
+
+    def test_removing_counts_and_looking_up_unknown_devices(self):
+        table = PatchStateTable()
+        table.add([1, 2, 2], True, PatchStateTable.ASSIGNED)
+        table.add([2], True, PatchStateTable.COMPLETED)
+        table.add([1], True, PatchStateTable.ASSIGNED, weight=-1)
+
+        totals = table.totals_not_completed([1, 2, None, 99999, -1], True)
+        self.assertEqual([0, 1, 0, 0, 0], list(totals))
+
+    def test_per_device_views_read_and_write_the_table(self):
+        mgr = SoftwarePatchStatus(None)
+        mgr.patch_state.add([11, 12], False, PatchStateTable.UNASSIGNED)
+
+        device = mgr.get_perdevice_state(11)
+        device.client_name = "mac-11"
+        device.get_counter(False).remaining += 3
+
+        self.assertEqual(1, mgr.get_perdevice_state(11).get_counter(False).unassigned)
+        self.assertEqual(3, mgr.get_perdevice_counters(11, False).remaining)
+        self.assertEqual(0, mgr.get_perdevice_counters(11, True).remaining)
+        self.assertEqual("mac-11", mgr.get_perdevice_state(11).client_name)
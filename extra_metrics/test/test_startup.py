@@ -0,0 +1,57 @@
+import ast
+import os
+import subprocess
+import sys
+import unittest
+
+SETUP_PY = os.path.join(os.path.dirname(__file__), "..", "..", "setup.py")
+PACKAGE_ROOT = os.path.join(os.path.dirname(__file__), "..", "..")
+
+# nothing starts up with pkg_resources; the config CLI doesn't need the exporter's heavy dependencies either
+NEVER_IMPORTED = ["pkg_resources"]
+NOT_IMPORTED_BY = {
+    "extra-metrics-config": ["pandas", "numpy", "requests", "zmq"],
+}
+
+
+def console_scripts(setup_py=SETUP_PY):
+    # {script name: (module, function)}, read out of the setup() call without running it; the startup
+    # benchmark uses this too
+    with open(setup_py) as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Dict):
+            for key, value in zip(node.keys, node.values):
+                if isinstance(key, ast.Constant) and key.value == 'console_scripts':
+                    scripts = {}
+                    for entry in ast.literal_eval(value):
+                        name, target = [part.strip() for part in entry.split("=", 1)]
+                        module, function = target.split(":", 1)
+                        scripts[name] = (module, function)
+                    return scripts
+    return {}
+
+
+def modules_imported_by(module, function):
+    code = f"import sys; from {module} import {function}; print(' '.join(sys.modules))"
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(PACKAGE_ROOT))
+    result = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True, env=env)
+    return set(result.stdout.split())
+
+
+@unittest.skipUnless(os.path.exists(SETUP_PY), "needs the source tree")
+class StartupImportsTestCase(unittest.TestCase):
+    def test_entry_points_dont_import_what_they_dont_need(self):
+        scripts = console_scripts()
+        self.assertIn("extra-metrics-config", scripts)
+        for name, (module, function) in scripts.items():
+            with self.subTest(script=name):
+                imported = modules_imported_by(module, function)
+                for module in NEVER_IMPORTED + NOT_IMPORTED_BY.get(name, []):
+                    self.assertNotIn(module, imported, f"{name} imports {module} at startup")
+
+    def test_package_resources_are_found(self):
+        from extra_metrics.package import get_package_resource_string, list_package_resources
+        self.assertIn("extra-metrics-PatchStatus.json", list_package_resources("extra_metrics.dashboards"))
+        self.assertIn("extra_metrics.yml", list_package_resources("extra_metrics.cfg"))
+        self.assertIn(b"${EXTRA_METRICS_RUN}", get_package_resource_string("extra_metrics.cfg", "extra_metrics_supervisord.conf"))
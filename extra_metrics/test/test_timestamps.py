@@ -0,0 +1,23 @@
+import datetime
+import unittest
+from datetime import timezone
+import numpy as np
+
+from extra_metrics.timestamps import MISSING, age_in_days, parse_epoch_ns
+
+
+class TimestampColumnTestCase(unittest.TestCase):
+    def test_formats_offsets_and_missing_values(self):
+        epoch_ns = parse_epoch_ns(["2020-05-28T21:34:59+02:00", "2020-05-28T19:34:59.5Z", None, float("nan"), "not a date"])
+        self.assertEqual(1590694499 * 10**9, epoch_ns[0])
+        self.assertEqual(1590694499 * 10**9 + 500 * 10**6, epoch_ns[1])
+        self.assertEqual([MISSING] * 3, epoch_ns[2:].tolist())
+        self.assertEqual(np.int64, epoch_ns.dtype)
+
+    def test_ages_are_whole_days_rounded_down_like_timedelta_days(self):
+        now = datetime.datetime(2020, 6, 10, 12, 0, 0, tzinfo=timezone.utc)
+        values = ["2020-06-10T11:00:00Z", "2020-06-09T12:00:00.000001Z", "2020-06-09T12:00:00+00:00", "2020-06-11T12:00:00Z", None]
+        self.assertEqual([0, 0, 1, -1, 99], age_in_days(values, now, missing_days=99).tolist())
+        # a naive now is taken to be UTC
+        self.assertEqual([0, 0, 1, -1, 99], age_in_days(values, now.replace(tzinfo=None), missing_days=99).tolist())
+        self.assertEqual([], age_in_days([], now).tolist())
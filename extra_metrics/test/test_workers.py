@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from prometheus_client import REGISTRY
+
+from extra_metrics import instrumentation
+from extra_metrics.fwrest_async import AsyncFWRestQuery
+from extra_metrics.package import get_package_resource_json
+from extra_metrics.softwarepatches import SoftwarePatchStatus
+from extra_metrics.test.fake_mocks import FakeQueryInterface
+from extra_metrics.workers import ComputePool
+
+
+class ComputePoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = ComputePool(max_workers=2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_work_runs_off_the_loop_and_reports_to_its_collection(self):
+        def crunch():
+            instrumentation.add_rows(5)
+            return threading.current_thread().name
+
+        async def collect():
+            with instrumentation.collection("test_compute_pool"):
+                return await self.pool.run(crunch)
+
+        self.assertTrue(asyncio.run(collect()).startswith("extra-metrics-compute"))
+        self.assertEqual(5, REGISTRY.get_sample_value('extra_metrics_collector_rows', labels={"collector": "test_compute_pool"}))
+
+    def test_inline_pool_runs_on_the_loop(self):
+        async def run():
+            return await ComputePool().run(lambda: threading.current_thread().name)
+        self.assertEqual(threading.current_thread().name, asyncio.run(run()))
+
+    def test_software_patches_give_the_same_totals_from_the_pool(self):
+        fw_query = FakeQueryInterface()
+        fw_query.get_software_updates_web_ui_j = MagicMock(
+            return_value=get_package_resource_json("extra_metrics.test", "software-update-testdata.json"))
+        fw_query.get_client_info_j = MagicMock(
+            return_value=get_package_resource_json("extra_metrics.test", "client-software-update-testdata.json"))
+        mgr = SoftwarePatchStatus(AsyncFWRestQuery(fw_query), page_size=20, compute=self.pool)
+        asyncio.run(mgr.collect_patch_data_status())
+
+        self.assertEqual(175, REGISTRY.get_sample_value('extra_metrics_software_updates_by_state', labels={"state": "Unassigned"}))
+        self.assertEqual(4, mgr.get_perdevice_state(7).get_counter(False).remaining)
+
+
+class EventLoopLagTestCase(unittest.TestCase):
+    def test_a_blocked_loop_shows_up_as_lag(self):
+        async def run():
+            monitor = asyncio.ensure_future(instrumentation.monitor_event_loop_lag(interval_seconds=0.01))
+            await asyncio.sleep(0.05)
+            time.sleep(0.2)  # hogs the loop
+            await asyncio.sleep(0.05)
+            monitor.cancel()
+
+        before = REGISTRY.get_sample_value('extra_metrics_event_loop_lag_bucket', labels={"le": "0.1"})
+        asyncio.run(run())
+        count = REGISTRY.get_sample_value('extra_metrics_event_loop_lag_count')
+        self.assertGreater(count - REGISTRY.get_sample_value('extra_metrics_event_loop_lag_bucket', labels={"le": "0.1"}), 0)
+        self.assertGreater(REGISTRY.get_sample_value('extra_metrics_event_loop_lag_bucket', labels={"le": "0.1"}), before)
@@ -0,0 +1,50 @@
+import datetime
+from datetime import timezone
+import numpy as np
+import pandas as pd
+
+'''
+Timestamps from the FileWave server come in a few ISO 8601 flavours:
+    Client_last_check_in:   2020-06-02T07:41:14.123456Z
+    creation_date:          2020-05-28T21:34:59+02:00 or 2020-05-28T21:34:59.123+02:00
+A whole column is parsed in one go, rather than a strptime (or two) per value.
+'''
+
+# the value of a missing or unparsable timestamp, the same as NaT
+MISSING = np.iinfo(np.int64).min
+
+NS_PER_DAY = 86400 * 1000 * 1000 * 1000
+
+# pandas 2 understands format='ISO8601' (mixed precision and offsets in one column), older versions
+# treat it as a strftime format - but infer ISO 8601 on their own when no format is given
+_ISO8601 = {"format": "ISO8601"} if int(pd.__version__.split(".")[0]) >= 2 else {}
+
+
+def parse_epoch_ns(values):
+    """
+    Parses a column (list/Series/array) of ISO 8601 strings into UTC epoch nanoseconds, as an int64
+    array; None, NaN and anything that can't be parsed become MISSING.  Timestamps without an offset
+    are taken to be UTC.
+    """
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    parsed = pd.to_datetime(pd.Series(values, dtype=object), utc=True, errors='coerce', **_ISO8601)
+    # whatever unit pandas picked, the result is in nanoseconds
+    return parsed.dt.tz_convert(None).to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+def age_in_days(values, now=None, missing_days=999):
+    """
+    The whole number of days (rounded down, like timedelta.days) between each timestamp and now,
+    missing_days where there's no timestamp.  now defaults to the current time; a naive datetime is
+    taken to be UTC.
+    """
+    if now is None:
+        now = datetime.datetime.now(timezone.utc)
+    now_ns = pd.Timestamp(now).tz_localize('UTC').value if now.tzinfo is None else pd.Timestamp(now).value
+
+    epoch_ns = parse_epoch_ns(values)
+    known = epoch_ns != MISSING
+    days = np.full(len(epoch_ns), missing_days, dtype=np.int64)
+    days[known] = (now_ns - epoch_ns[known]) // NS_PER_DAY
+    return days
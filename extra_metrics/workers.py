@@ -0,0 +1,37 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ComputePool:
+    """
+    Where the collectors do their number crunching (DataFrames, rollups, per device tables), so the
+    event loop stays free to forward FileWave events and answer scrapes while a big collection runs.
+
+    max_workers=0 runs the work inline, on the event loop, which is what the tests use.
+
+    It's a thread pool rather than a process pool; the collectors keep their state (e.g. the per device
+    patch counts) from one collection to the next, and pandas/numpy let go of the GIL for the heavy parts.
+    """
+    def __init__(self, max_workers=0):
+        self.max_workers = max_workers
+        self.executor = None
+        if max_workers > 0:
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="extra-metrics-compute")
+
+    async def run(self, func, *args, **kwargs):
+        if self.executor is None:
+            return func(*args, **kwargs)
+        # the work still reports its stages/rows to the collection that asked for it
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, func, *args, **kwargs))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+
+# used by collectors that aren't given a pool
+INLINE = ComputePool()
@@ -29,7 +29,6 @@ setuptools.setup(
         'click',
         'progressbar2',
         'pyzmq',
-        'asyncio-periodic'
     ],
     setup_requires=[
         'wheel'